@@ -11,4 +11,13 @@ __email__ = 'eodms-sgdot@nrcan-rncan.gc.ca'
 from .__version__ import __version__
 from .aaa import AAA_API
 from .dds import DDS_API
+from .cache import ItemCache
+from .store import ProductStore
+from .exceptions import EODMSError, DDSError, SearchError
+from .manager import DownloadManager
+from .pipeline import DownloadPipeline
+from .search import SearchAPI
+from .features import Feature, FeatureSet
+from .spatial import SpatialIndex
+from .catalog import CatalogMirror
 from . import config
\ No newline at end of file
@@ -3,12 +3,18 @@ from requests.packages import urllib3
 import ssl
 import os
 import json
+import tempfile
+import threading
 # import time
 from datetime import datetime, timedelta
 import dateparser
 from . import api_logger
 from .__version__ import __version__
 from . import config
+from . import locks
+from . import session as eodms_session
+from .metrics import registry as metrics
+from .retry import RetryPolicy
 
 class AAA_Creds():
 
@@ -22,6 +28,7 @@ class AAA_Creds():
         self.refresh_seconds = None
 
         self.cred_fn = None
+        self.cred_mtime = None
 
         self.logger = api_logger.EODMSLogger('eodms_aaa', api_logger.eodms_logger)
 
@@ -124,10 +131,28 @@ class AAA_Creds():
     def export_vals(self):
         """
         Exports the credential values to the aaa_creds.json file.
+
+        The values are written to a temporary file which then replaces
+            the aaa_creds.json file, so readers never see a partial file.
+            The token lifetimes are included so other instances and
+            processes clamp their renewal margin the same way.
         """
 
-        with open(self.cred_fn, 'w') as f:
-            json.dump(self.get_json(), f)
+        cred_folder = os.path.dirname(self.cred_fn)
+        fd, tmp_fn = tempfile.mkstemp(dir=cred_folder, suffix='.tmp',
+                                      prefix=os.path.basename(self.cred_fn))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.get_json(with_seconds=True), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_fn, self.cred_fn)
+        except:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+
+        self.cred_mtime = self._get_mtime()
 
         return self.cred_fn
 
@@ -139,33 +164,118 @@ class AAA_Creds():
         if not os.path.exists(self.cred_fn):
             return None
 
+        # Recorded even if the file can't be read, so a corrupt file is not
+        #   imported (and renewed for) again on every request; the next
+        #   renewal replaces it
+        self.cred_mtime = self._get_mtime()
+
         try:
             with open(self.cred_fn, 'r') as file:
                 creds = json.load(file)
-        except:
+
+            access_exp = datetime.fromisoformat(creds['access_expiration'])
+            refresh_exp_str = creds.get('refresh_expiration')
+            refresh_exp = datetime.fromisoformat(refresh_exp_str) \
+                if refresh_exp_str is not None else datetime.now()
+        except Exception as err:
+            self.logger.warning(f"WARNING: Could not read the credentials "
+                                f"in {self.cred_fn}: {err}")
             return None
 
         self.access_token = creds.get('access_token')
         self.refresh_token = creds.get('refresh_token')
-        
-        access_exp_str = creds.get('access_expiration')
-        refresh_exp_str = creds.get('refresh_expiration')
 
-        self.access_exp = datetime.fromisoformat(access_exp_str)
-        self.refresh_exp = datetime.fromisoformat(refresh_exp_str) \
-                            if refresh_exp_str is not None else datetime.now()
+        self.access_exp = access_exp
+        self.refresh_exp = refresh_exp
+
+        # Files written by older versions have no lifetimes
+        self.access_seconds = creds.get('access_seconds')
+        self.refresh_seconds = creds.get('refresh_seconds')
 
         self.logger.info(f"Access Expiration: {self.access_exp}")
         self.logger.info(f"Refresh Expiration: {self.refresh_exp}")
 
+    def file_changed(self):
+        """
+        Checks whether the aaa_creds.json file has been modified (for
+            example by another AAA_API instance or process) since it was
+            last imported or exported.
+        """
+
+        return self._get_mtime() != self.cred_mtime
+
+    def access_valid(self, margin=0):
+        """
+        Checks whether the in-memory Access Token is still valid.
+
+        :param margin: Number of seconds before the expiration time at which
+            the token is already considered expired (see clamp_margin).
+        :type  margin: int
+        """
+
+        if self.access_token is None or \
+                not isinstance(self.access_exp, datetime):
+            return False
+
+        margin = self.clamp_margin(margin)
+
+        return datetime.now() < self.access_exp - timedelta(seconds=margin)
+
+    def clamp_margin(self, margin):
+        """
+        Limits a renewal margin to half the usable lifetime of the Access
+            Token (its lifetime less the 120 seconds already taken off its
+            expiration time), so a short-lived token is not renewed on
+            every call.
+
+        :param margin: The number of seconds before the expiration time.
+        :type  margin: int
+
+        :return: The margin to use.
+        :rtype:  float
+        """
+
+        if not self.access_seconds:
+            return margin
+
+        return min(margin, max((self.access_seconds - 120) / 2, 0))
+
+    def _get_mtime(self):
+
+        try:
+            return os.stat(self.cred_fn).st_mtime_ns
+        except OSError:
+            return None
+
 class AAA_API():
 
-    def __init__(self, username, password, environment='prod'):
+    def __init__(self, username, password, environment='prod', session=None,
+                 pool_connections=eodms_session.DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=eodms_session.DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True, renew_margin=60,
+                 auto_renew=False, retry_policy=None, rate_limiter=None):
         """
         Initializes the AAA_API instance.
         :param username: EODMS username
         :param password: EODMS password
         :param environment: Environment to use ('prod' or 'staging')
+        :param session: An existing requests Session to use for all calls
+            (if None, a pooled session is created and owned by this object)
+        :param pool_connections: Number of per-host connection pools to cache
+        :param pool_maxsize: Maximum number of connections kept per host
+        :param pool_block: If True, limit each host to pool_maxsize
+            connections at a time
+        :param keep_alive: If False, close connections after each request
+        :param renew_margin: Number of seconds before expiry at which the
+            Access Token is renewed proactively
+        :param auto_renew: If True, start a background thread which renews
+            the tokens before they expire (see start_renewer)
+        :param retry_policy: The RetryPolicy used for every request sent
+            through prepare_request, which the DDS_API and the downloads
+            share (if None, a default RetryPolicy is created)
+        :param rate_limiter: A RateLimiter pacing the requests sent through
+            prepare_request and the downloads of the DDS_API (None for no
+            pacing)
         """
 
         self.aaa_creds = AAA_Creds()
@@ -178,16 +288,40 @@ class AAA_API():
         self.domain = domain_config['domain']
         self.verify_ssl = domain_config.get('verify_ssl', True)
 
+        if session is None:
+            session = eodms_session.create_session(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=pool_block,
+                keep_alive=keep_alive,
+                verify_ssl=self.verify_ssl)
+        self.session = session
+
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+
         user_folder = os.path.expanduser('~')
         self.auth_folder = os.path.join(user_folder, '.eodms')
         self.aaa_creds.set_fn(os.path.join(self.auth_folder, f'aaa_creds.{self.username}.{environment}.json'))
+        self.lock_fn = f'{self.aaa_creds.cred_fn}.lock'
+        self._refresh_lock = locks.get_named_lock(self.aaa_creds.cred_fn)
 
         if not os.path.exists(self.auth_folder):
             os.makedirs(self.auth_folder)
 
+        self.renew_margin = renew_margin
+
         self.login_success = True
         self.response = None
 
+        self._renewer = None
+        self._renewer_stop = threading.Event()
+
+        if auto_renew:
+            self.start_renewer()
+
     def get_access_token(self):
         """
         Gets a new Access Token using either an existing Access Token, 
@@ -199,16 +333,116 @@ class AAA_API():
             - "refresh" if the Access Token has expired but the Refresh
                 Token has not
             - "logging" if both tokens have expired
+
+        The Access Token is served from memory while it is valid; the
+            aaa_creds.json file is only read again if the token is about to
+            expire or if the file was modified by someone else.
+
+        Only one renewal per user and environment runs at a time: threads
+            wait on a shared lock and processes on a lock file, then reuse
+            the tokens obtained by whoever renewed them first.
         """
 
-        self.aaa_creds.import_vals()
+        return self._get_access_token(self.renew_margin)
+
+    def start_renewer(self):
+        """
+        Starts a background thread which renews the tokens ahead of their
+            expiration, so get_access_token always finds a valid token in
+            memory and never waits on the AAA API.
+        """
+
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+
+        self._renewer_stop.clear()
+        self._renewer = threading.Thread(target=self._run_renewer,
+                                         name='eodms_aaa_renewer',
+                                         daemon=True)
+        self._renewer.start()
+
+    def stop_renewer(self, timeout=None):
+        """
+        Stops the background renewal thread.
+
+        :param timeout: The maximum number of seconds to wait for the thread.
+        :type  timeout: float
+        """
+
+        self._renewer_stop.set()
+
+        if self._renewer is not None:
+            self._renewer.join(timeout)
+            self._renewer = None
+
+    def _get_access_token(self, margin):
+
+        if not self.aaa_creds.file_changed() and \
+                self.aaa_creds.access_valid(margin):
+            return self.aaa_creds.access_token
+
+        with self._refresh_lock, locks.FileLock(self.lock_fn):
+            return self._renew_access_token(margin)
+
+    def _renewer_margin(self):
+        """
+        Returns the number of seconds before expiry at which the background
+            renewer renews the tokens. It runs ahead of renew_margin so
+            requests never reach the renewal themselves.
+        """
+
+        access_seconds = self.aaa_creds.access_seconds
+        if not access_seconds:
+            return self.renew_margin + 30
+
+        margin = self.renew_margin + max(access_seconds * 0.1, 30)
+
+        # Never renew more often than every half token lifetime
+        return min(margin, max((access_seconds - 120) / 2, 1))
+
+    def _run_renewer(self):
+
+        while not self._renewer_stop.is_set():
+            margin = self._renewer_margin()
+
+            try:
+                self._get_access_token(margin)
+            except Exception as err:
+                self.logger.warning(f"WARNING: Background token renewal "
+                                    f"failed: {err}")
+                self._renewer_stop.wait(30)
+                continue
+
+            access_exp = self.aaa_creds.access_exp
+            if not self.login_success or \
+                    not isinstance(access_exp, datetime):
+                delay = 30
+            else:
+                renew_dt = access_exp - timedelta(seconds=margin)
+                delay = max((renew_dt - datetime.now()).total_seconds(), 1)
+
+            self._renewer_stop.wait(delay)
+
+    def _renew_access_token(self, margin):
+        """
+        Imports the latest tokens and renews them if still needed. Must be
+            called while holding the refresh locks.
+        """
+
+        # Another thread or process may have renewed the tokens while
+        #   this one was waiting for the locks
+        if self.aaa_creds.file_changed():
+            self.aaa_creds.import_vals()
+
+        if self.aaa_creds.access_valid(margin):
+            return self.aaa_creds.access_token
 
         if self.aaa_creds.access_token is None:
             self.logger.info("No existing Access Token found. Logging in...")
             self._login()
             return self.aaa_creds.access_token
 
-        now_dt = datetime.now()
+        now_dt = datetime.now() + timedelta(seconds=margin)
         access_exp = self.aaa_creds.access_exp
         refresh_exp = self.aaa_creds.refresh_exp
 
@@ -232,21 +466,47 @@ class AAA_API():
 
         return self.aaa_creds.access_token
     
-    def prepare_request(self, url, method='GET', **kwargs):
+    def prepare_request(self, url, method='GET', idempotent=None, **kwargs):
 
         req = requests.Request(method, url, **kwargs)
         
-        prepared = req.prepare()
+        prepared = self.session.prepare_request(req)
         
-        # Send the request
-        session = requests.Session()
-        session.trust_env = False
-        response = session.send(prepared, verify=self.verify_ssl)
+        # Send the request over the shared (pooled) session, retrying
+        #   transient failures according to the retry policy
+        response = self.retry_policy.call(lambda: self._send(prepared), url,
+                                          method, idempotent)
 
         #self.logger.info(f"response headers: {response.request.headers}")
 
         return response
 
+    def _send(self, prepared):
+
+        if self.rate_limiter is None:
+            return self.session.send(prepared, verify=self.verify_ssl)
+
+        self.rate_limiter.acquire(prepared.url)
+        response = self.session.send(prepared, verify=self.verify_ssl)
+
+        if response.status_code == 429:
+            # Slow down every thread (and process) sharing the limiter
+            retry_after = eodms_session.parse_retry_after(
+                response.headers.get('Retry-After'))
+            self.rate_limiter.penalize(
+                prepared.url, 1 if retry_after is None else retry_after)
+
+        return response
+
+    def close(self):
+        """
+        Stops the background renewer (if running) and closes the pooled
+            connections of the session.
+        """
+
+        self.stop_renewer()
+        self.session.close()
+
     def _print_response(self):
         log_str = "AAA Response Info:"
 
@@ -269,8 +529,8 @@ class AAA_API():
 
         kwargs["access_exp"] = self.access_exp
         kwargs["refresh_exp"] = self.refresh_exp
-        kwargs["access_seconds"] = self.response.get('refresh_token_expires_in')
-        kwargs["refresh_seconds"] = self.response.get('expires_in')
+        kwargs["access_seconds"] = self.response.get('expires_in')
+        kwargs["refresh_seconds"] = self.response.get('refresh_token_expires_in')
 
         # self.aaa_creds.set_vals(access_exp=self.access_exp,
         #                         refresh_exp=self.refresh_exp)
@@ -295,10 +555,14 @@ class AAA_API():
         #self.logger.info(f"Logging into {url} (user {self.username} pass {self.password})...")
 
         # resp = requests.post(url, json=payload, trust_env=False, verify=False) #, verify=False)
-        resp = self.prepare_request(url, "POST", json=payload)
+        # Logging in again is harmless, so it is retried like a GET
+        resp = self.prepare_request(url, "POST", idempotent=True,
+                                    json=payload)
 
         if resp.status_code == 200:
             self.logger.info("Successfully logged in using AAA API")
+            metrics.inc('eodms_token_renewals_total', kind='login',
+                        result='success')
 
             self.response = resp.json()
 
@@ -323,6 +587,8 @@ class AAA_API():
             self.logger.warning(f"WARNING: Failed to log in using "
                   f"AAA API: {error}: {msg}")
             self.login_success = False
+            metrics.inc('eodms_token_renewals_total', kind='login',
+                        result='failure')
 
             if resp.status_code == 429:
                 self.logger.info("Attempting to get new Access Token "
@@ -344,6 +610,8 @@ class AAA_API():
 
         if resp.status_code == 200:
             self.logger.info("Successfully refreshed using AAA API")
+            metrics.inc('eodms_token_renewals_total', kind='refresh',
+                        result='success')
             self.response = resp.json()
 
             new_access_token = self.response.get('access_token')
@@ -360,6 +628,8 @@ class AAA_API():
             self.logger.error("WARNING: Failed to refresh using "
                   f"AAA API: {error}: {msg}")
             self.login_success = False
+            metrics.inc('eodms_token_renewals_total', kind='refresh',
+                        result='failure')
 
 
         
\ No newline at end of file
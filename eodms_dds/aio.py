@@ -0,0 +1,717 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import aaa
+from . import api_logger
+from . import config
+from . import locks
+from . import session as eodms_session
+from .download import CHECKPOINT_INTERVAL, Checkpoint, Downloader, \
+    header_checksums, item_checksums, parse_content_range, \
+    unsatisfied_range_size
+from .metrics import registry as metrics
+from .ratelimit import endpoint_family
+from .retry import RetryPolicy
+from .exceptions import DDSError, IncompleteDownloadError, IntegrityError
+
+# Errors after which a request may be sent again (see retry.TRANSIENT_ERRORS)
+if aiohttp is not None:
+    TRANSIENT_ERRORS = (aiohttp.ClientConnectionError,
+                        aiohttp.ClientPayloadError, asyncio.TimeoutError)
+else:
+    TRANSIENT_ERRORS = ()
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("The asyncio clients require the aiohttp package. "
+                          "Install it with 'pip install py-eodms-dds[async]'.")
+
+
+def _timing_trace_config():
+    """
+    Creates an aiohttp TraceConfig which records the DNS, connect and
+        time-to-first-byte timings of each request in metrics.registry.
+    """
+
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+        ctx.timings = {}
+
+    async def on_dns_resolvehost_start(session, ctx, params):
+        ctx.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, ctx, params):
+        ctx.timings['dns'] = time.perf_counter() - ctx.dns_start
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        # Includes the DNS lookup and the TLS handshake
+        ctx.timings['connect'] = time.perf_counter() - ctx.connect_start
+
+    async def on_request_end(session, ctx, params):
+        family = endpoint_family(str(params.url))
+        ctx.timings['ttfb'] = time.perf_counter() - ctx.start
+        for phase, seconds in ctx.timings.items():
+            metrics.observe('eodms_request_seconds', seconds, family=family,
+                            phase=phase)
+        metrics.inc('eodms_requests_total', family=family,
+                    method=params.method, status=params.response.status)
+
+    async def on_request_exception(session, ctx, params):
+        metrics.inc('eodms_request_errors_total',
+                    family=endpoint_family(str(params.url)),
+                    error=type(params.exception).__name__)
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(
+        on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+
+    return trace_config
+
+
+class AsyncAAA_API():
+
+    def __init__(self, username, password, environment='prod', session=None,
+                 limit=100, limit_per_host=0, renew_margin=60,
+                 retry_policy=None, rate_limiter=None,
+                 file_check_interval=1):
+        """
+        Initializes the AsyncAAA_API instance. It shares the aaa_creds.json
+            file (and its lock) with AAA_API, so sync and async clients of
+            the same user and environment reuse each other's tokens.
+
+        :param username: EODMS username
+        :param password: EODMS password
+        :param environment: Environment to use ('prod' or 'staging')
+        :param session: An existing aiohttp ClientSession (if None, a pooled
+            session is created on first use and owned by this object)
+        :param limit: Maximum number of simultaneous connections
+        :param limit_per_host: Maximum number of simultaneous connections
+            per host (0 for no limit)
+        :param renew_margin: Number of seconds before expiry at which the
+            Access Token is renewed proactively
+        :param retry_policy: The RetryPolicy of the requests and downloads
+            (if None, a default RetryPolicy is created)
+        :param rate_limiter: A RateLimiter pacing the requests and downloads
+            (it can be shared with the threads of sync clients)
+        :param file_check_interval: The minimum number of seconds between
+            checks of the aaa_creds.json file for tokens renewed by other
+            clients (the check runs in the default executor)
+        """
+
+        _require_aiohttp()
+
+        self.aaa_creds = aaa.AAA_Creds()
+        self.logger = api_logger.EODMSLogger('eodms_aaa', api_logger.eodms_logger)
+
+        self.username = username
+        self.password = password
+
+        domain_config = config.get_domain_config(environment)
+        self.domain = domain_config['domain']
+        self.verify_ssl = domain_config.get('verify_ssl', True)
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.session = session
+        self._owns_session = session is None
+
+        user_folder = os.path.expanduser('~')
+        self.auth_folder = os.path.join(user_folder, '.eodms')
+        self.aaa_creds.set_fn(os.path.join(self.auth_folder, f'aaa_creds.{self.username}.{environment}.json'))
+        self.lock_fn = f'{self.aaa_creds.cred_fn}.lock'
+
+        if not os.path.exists(self.auth_folder):
+            os.makedirs(self.auth_folder)
+
+        self.renew_margin = renew_margin
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+
+        self.login_success = True
+        self.response = None
+
+        self._refresh_lock = None
+        self.file_check_interval = file_check_interval
+        self._file_checked = None
+
+        # The process-wide lock of the creds file (shared with AAA_API) is
+        #   a threading.RLock, so it is acquired and released by one thread
+        self._named_lock = locks.get_named_lock(self.aaa_creds.cred_fn)
+        self._lock_executor = None
+
+    async def get_session(self):
+        """
+        Returns the pooled aiohttp ClientSession, creating it if needed.
+        """
+
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                ssl=None if self.verify_ssl else False)
+            self.session = aiohttp.ClientSession(
+                connector=connector, trust_env=False,
+                trace_configs=[_timing_trace_config()])
+            self._owns_session = True
+
+        return self.session
+
+    async def close(self):
+        """
+        Closes the session (if it is owned by this object).
+        """
+
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+        if self._lock_executor is not None:
+            self._lock_executor.shutdown(wait=False)
+            self._lock_executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def get_access_token(self):
+        """
+        Gets a valid Access Token with the same rules as
+            AAA_API.get_access_token: the in-memory token is used while it
+            is valid and only one renewal runs at a time (per event loop
+            through an asyncio lock, across the threads of the process
+            through the same named lock as AAA_API, and across processes
+            through the lock file of the aaa_creds.json file).
+        """
+
+        if self.aaa_creds.access_valid(self.renew_margin) and \
+                not await self._creds_file_changed():
+            return self.aaa_creds.access_token
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            file_lock = locks.FileLock(self.lock_fn)
+            await self._run_locked(self._acquire_locks, file_lock)
+            try:
+                return await self._renew_access_token()
+            finally:
+                await self._run_locked(self._release_locks, file_lock)
+
+    async def _creds_file_changed(self):
+        """
+        Checks whether the aaa_creds.json file was changed by another
+            client, at most every file_check_interval seconds and in the
+            default executor, so requests don't stat it on the event loop.
+        """
+
+        now = time.monotonic()
+        if self._file_checked is not None and \
+                now - self._file_checked < self.file_check_interval:
+            return False
+        self._file_checked = now
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.aaa_creds.file_changed)
+
+    def _acquire_locks(self, file_lock):
+
+        self._named_lock.acquire()
+        try:
+            file_lock.acquire()
+        except BaseException:
+            self._named_lock.release()
+            raise
+
+    def _release_locks(self, file_lock):
+
+        try:
+            file_lock.release()
+        finally:
+            self._named_lock.release()
+
+    async def _run_locked(self, func, file_lock):
+        """
+        Runs _acquire_locks or _release_locks in the thread dedicated to
+            the locks. If the caller is cancelled while the locks are
+            being acquired, they are released once acquired.
+        """
+
+        if self._lock_executor is None:
+            self._lock_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='eodms_aaa_lock')
+        executor = self._lock_executor
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, func, file_lock)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if func == self._acquire_locks:
+                future.add_done_callback(
+                    lambda done: done.cancelled() or done.exception() or
+                    executor.submit(self._release_locks, file_lock))
+            raise
+
+    async def _renew_access_token(self):
+
+        # The token file is read and written in the default executor, so
+        #   the event loop never waits on the disk
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.aaa_creds.file_changed):
+            await loop.run_in_executor(None, self.aaa_creds.import_vals)
+
+        if self.aaa_creds.access_valid(self.renew_margin):
+            return self.aaa_creds.access_token
+
+        if self.aaa_creds.access_token is None:
+            self.logger.info("No existing Access Token found. Logging in...")
+            await self._login()
+            return self.aaa_creds.access_token
+
+        now_dt = datetime.now() + timedelta(seconds=self.renew_margin)
+
+        if now_dt >= self.aaa_creds.refresh_exp:
+            self.logger.info("Current Refresh Token has expired. "
+                             "Getting new Tokens...")
+            await self._login()
+        else:
+            self.logger.info("Current Access Token has expired. "
+                             "Getting a new Access Token using current "
+                             "Refresh Token...")
+            await self._refresh()
+
+        if not self.login_success:
+            self.logger.warning("WARNING: Could not access current AAA "
+                  f"session with existing tokens in {self.aaa_creds.cred_fn}")
+
+        return self.aaa_creds.access_token
+
+    async def request(self, url, method='GET', **kwargs):
+        """
+        Sends a request over the pooled session and returns the status code
+            and the decoded JSON (None if the body is not JSON).
+        """
+
+        resp = await self.send(url, method, **kwargs)
+
+        async with resp:
+            try:
+                resp_json = await resp.json(content_type=None)
+            except ValueError:
+                resp_json = None
+
+            return resp.status, resp_json
+
+    async def send(self, url, method='GET', **kwargs):
+        """
+        Sends a request over the pooled session, paced by the rate limiter
+            and retried according to the retry policy, and returns the
+            aiohttp response (to be used as a context manager).
+        """
+
+        session = await self.get_session()
+
+        async def send_once():
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(url)
+
+            resp = await session.request(method, url, **kwargs)
+
+            if resp.status == 429 and self.rate_limiter is not None:
+                retry_after = eodms_session.parse_retry_after(
+                    resp.headers.get('Retry-After'))
+                self.rate_limiter.penalize(
+                    url, 1 if retry_after is None else retry_after)
+
+            return resp
+
+        return await self.retry_policy.call_async(
+            send_once, url, method, retry_exceptions=TRANSIENT_ERRORS)
+
+    async def _update_tokens(self, **kwargs):
+
+        refresh_time = self.response.get('refresh_token_expires_in') - 180
+        access_time = self.response.get('expires_in') - 120
+        now_dt = datetime.now()
+
+        kwargs["access_exp"] = now_dt + timedelta(seconds=access_time)
+        kwargs["refresh_exp"] = now_dt + timedelta(seconds=refresh_time)
+        kwargs["access_seconds"] = self.response.get('expires_in')
+        kwargs["refresh_seconds"] = self.response.get('refresh_token_expires_in')
+
+        self.aaa_creds.set_vals(**kwargs)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.aaa_creds.export_vals)
+
+    async def _login(self):
+
+        url = f"{self.domain}/aaa/v1/login"
+
+        payload = {
+            "grant_type": "password",
+            "password": self.password,
+            "username": self.username
+        }
+
+        status, resp_json = await self.request(url, "POST", json=payload)
+        metrics.inc('eodms_token_renewals_total', kind='login',
+                    result='success' if status == 200 else 'failure')
+
+        if status == 200:
+            self.logger.info("Successfully logged in using AAA API")
+            self.response = resp_json
+            await self._update_tokens(
+                access_token=self.response.get('access_token'),
+                refresh_token=self.response.get('refresh_token'))
+            self.login_success = True
+        else:
+            resp_json = resp_json or {}
+            self.logger.warning(f"WARNING: Failed to log in using "
+                  f"AAA API: {resp_json.get('error')}: "
+                  f"{resp_json.get('message')}")
+            self.login_success = False
+
+            if status == 429:
+                self.logger.info("Attempting to get new Access Token "
+                      "using existing Refresh Token...")
+                await self._refresh()
+
+    async def _refresh(self):
+
+        url = f"{self.domain}/aaa/v1/refresh"
+
+        headers = {"Authorization": f"Bearer {self.aaa_creds.refresh_token}"}
+        status, resp_json = await self.request(url, headers=headers)
+        metrics.inc('eodms_token_renewals_total', kind='refresh',
+                    result='success' if status == 200 else 'failure')
+
+        if status == 200:
+            self.logger.info("Successfully refreshed using AAA API")
+            self.response = resp_json
+            await self._update_tokens(
+                access_token=self.response.get('access_token'),
+                refresh_token=self.response.get('refresh_token'))
+            self.login_success = True
+        else:
+            resp_json = resp_json or {}
+            self.logger.error("WARNING: Failed to refresh using "
+                  f"AAA API: {resp_json.get('error')}: "
+                  f"{resp_json.get('message')}")
+            self.login_success = False
+
+
+class AsyncDDS_API():
+
+    def __init__(self, aaa_api, environment='prod'):
+        """
+        Initializes the AsyncDDS_API instance.
+
+        :param aaa_api: The AsyncAAA_API instance used to get Access Tokens
+            (its pooled session is also used for item requests and
+            downloads)
+        :param environment: Environment to use ('prod' or 'staging')
+        """
+
+        _require_aiohttp()
+
+        domain_config = config.get_domain_config(environment)
+        self.domain = domain_config['domain']
+        self.verify_ssl = domain_config.get('verify_ssl', True)
+        self.img_info = None
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+        self.aaa = aaa_api
+
+    async def get_item(self, collection, item_uuid, catalog="EODMS"):
+        """
+        Gets the info of an item (see DDS_API.get_item). The item info is
+            also stored in self.img_info.
+
+        :return: The item info or None if the request failed.
+        """
+
+        try:
+            self.img_info = await self.fetch_item(collection, item_uuid,
+                                                  catalog)
+        except DDSError as err:
+            self.logger.error(f"Failed to get item using DDS API: {err}\n")
+            return None
+
+        status = self.img_info.get('status')
+        if 'download_url' in self.img_info:
+            self.logger.info("Successfully got item using DDS API")
+        else:
+            self.logger.info(f"Image is being processed. Its current "
+                  f"status is {status}.")
+
+        return self.img_info
+
+    async def fetch_item(self, collection, item_uuid, catalog="EODMS"):
+        """
+        Gets the info of an item (status 200 or 202) without changing
+            self.img_info, raising a DDSError on failure.
+        """
+
+        url = f"{self.domain}/dds/v1/item/{catalog}/{collection}/{item_uuid}"
+
+        access_token = await self.aaa.get_access_token()
+        headers = {"Authorization": f"Bearer {access_token}"}
+        status, resp_json = await self.aaa.request(url, headers=headers)
+
+        if status not in (200, 202) or resp_json is None:
+            resp_json = resp_json or {}
+            raise DDSError(resp_json.get('message') or f"HTTP {status}",
+                           status_code=status,
+                           error=resp_json.get('error'),
+                           request_id=resp_json.get('request_id'),
+                           trace_id=resp_json.get('trace_id'))
+
+        return resp_json
+
+    async def download_item(self, out_folder, item_info=None,
+                            chunk_size=1024 * 1024, resume=True,
+                            verify=True, verify_retries=1) -> str:
+        """
+        Downloads the item to the specified folder.
+        Returns the filename (full path).
+
+        As with DDS_API.download_item, the file is written to
+            '<filename>.part' and renamed once complete. An interrupted
+            download continues from its checkpoint, both when it is retried
+            (according to the retry policy of aaa_api) and on the next call.
+            The file is written (and hashed) in the default executor, so
+            the event loop never waits on the disk.
+
+        :param out_folder: The output folder.
+        :param item_info: The item info to download (defaults to
+            self.img_info). Pass it explicitly when running several
+            downloads at once.
+        :param chunk_size: The number of bytes written at a time.
+        :param resume: Determines whether to continue a previous partial
+            download of the same file.
+        :param verify: Determines whether to verify the size and checksums
+            of the file (from the item info and the response headers), as
+            Downloader does.
+        :param verify_retries: The number of times a download which fails
+            verification is started over before IntegrityError is raised.
+        """
+
+        if item_info is None:
+            item_info = self.img_info
+
+        if item_info is None:
+            self.logger.error("ERROR: No image info available.\n")
+            return None
+
+        download_url = item_info.get('download_url')
+
+        if not download_url:
+            return None
+
+        url_parsed = urlparse(download_url)
+        dest_fn = os.path.join(out_folder, os.path.basename(url_parsed.path))
+        part_fn = f'{dest_fn}.part'
+        checkpoint = Checkpoint(f'{part_fn}.json')
+
+        self.logger.info(f"Downloading image to {dest_fn}...\n")
+
+        loop = asyncio.get_running_loop()
+
+        def load_checkpoint():
+            return resume and os.path.exists(part_fn) and checkpoint.load()
+
+        if not await loop.run_in_executor(None, load_checkpoint):
+            checkpoint.reset()
+
+        # Only its verification helpers are used
+        checksums, expected_size = item_checksums(item_info)
+        verifier = Downloader(None, progress=False, verify=verify,
+                              checksums=checksums,
+                              expected_size=expected_size)
+
+        def discard_part():
+            checkpoint.reset()
+            checkpoint.remove()
+            if os.path.exists(part_fn):
+                os.remove(part_fn)
+
+        attempt = 0
+        while True:
+            try:
+                await self._download_part_with_retries(
+                    download_url, part_fn, checkpoint, chunk_size, verifier)
+                break
+            except IntegrityError as err:
+                # The file on disk is bad; never resume from it
+                await loop.run_in_executor(None, discard_part)
+                if attempt >= verify_retries:
+                    raise
+                attempt += 1
+                self.logger.warning(f"WARNING: {err}; downloading again "
+                                    f"(attempt {attempt + 1})...")
+
+        def finish():
+            os.replace(part_fn, dest_fn)
+            checkpoint.remove()
+
+        await loop.run_in_executor(None, finish)
+
+        self.logger.info(f"Finished downloading {dest_fn}")
+
+        return dest_fn
+
+    async def _download_part_with_retries(self, url, part_fn, checkpoint,
+                                          chunk_size, verifier):
+
+        # The requests are retried by aaa.send; here only a download cut
+        #   off after its response arrived is resumed from the checkpoint
+        retry_policy = self.aaa.retry_policy
+        attempt = 0
+        while True:
+            try:
+                return await self._download_part(url, part_fn, checkpoint,
+                                                 chunk_size, verifier)
+            except IncompleteDownloadError as err:
+                if attempt >= retry_policy.max_retries:
+                    raise
+                delay = retry_policy.delay(attempt)
+                self.logger.warning(f"WARNING: {err}; resuming in "
+                                    f"{delay:.1f}s...")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _download_part(self, url, part_fn, checkpoint, chunk_size,
+                             verifier):
+
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args):
+            return loop.run_in_executor(None, func, *args)
+
+        offset = checkpoint.contiguous_bytes()
+        if offset and offset == checkpoint.size:
+            # Everything is on disk; only the rename is missing
+            return await run(verifier._verify_part, url, part_fn, offset,
+                             checkpoint.etag)
+
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+
+        async with await self.aaa.send(url, headers=headers) as resp:
+            if resp.status == 416 and offset:
+                if unsatisfied_range_size(resp) == offset and \
+                        checkpoint.matches(offset, None):
+                    return await run(verifier._verify_part, url, part_fn,
+                                     offset, checkpoint.etag)
+
+                # The part file is larger than the remote file, start over
+                resp.release()
+                checkpoint.reset()
+                return await self._download_part(url, part_fn, checkpoint,
+                                                 chunk_size, verifier)
+
+            resp.raise_for_status()
+
+            etag = resp.headers.get('ETag')
+            content_range = parse_content_range(resp)
+
+            if resp.status == 206 and content_range is not None:
+                size = content_range[2]
+                if content_range[0] != offset or \
+                        not checkpoint.matches(size, etag):
+                    # The remote file changed, start over
+                    resp.release()
+                    checkpoint.reset()
+                    return await self._download_part(url, part_fn,
+                                                     checkpoint, chunk_size,
+                                                     verifier)
+                self.logger.info(f"Resuming download at byte {offset}...")
+            else:
+                offset = 0
+                size = resp.content_length
+
+            checkpoint.reset(size, etag)
+            checkpoint.add(0, offset - 1)
+
+            hashers = {}
+            if verifier.verify:
+                verifier._verify_size(url, size)
+                checksums = dict(verifier.checksums)
+                checksums.update(header_checksums(resp))
+                hashers = {algorithm: hashlib.new(algorithm)
+                           for algorithm in checksums}
+                if hashers and offset:
+                    await run(verifier._hash_prefix, part_fn, hashers,
+                              offset)
+
+            def write(data):
+                file_out.write(data)
+                for hasher in hashers.values():
+                    hasher.update(data)
+
+            file_out = await run(open, part_fn, 'r+b' if offset else 'wb')
+            pos = offset
+            last_saved = pos
+            try:
+                await run(file_out.seek, offset)
+                await run(file_out.truncate)
+
+                buffer = bytearray()
+                try:
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        buffer += chunk
+                        if len(buffer) < chunk_size:
+                            continue
+                        await run(write, buffer)
+                        pos += len(buffer)
+                        buffer = bytearray()
+
+                        if pos - last_saved >= CHECKPOINT_INTERVAL:
+                            await run(file_out.flush)
+                            checkpoint.add(offset, pos - 1)
+                            await run(checkpoint.save)
+                            last_saved = pos
+                except TRANSIENT_ERRORS as err:
+                    raise IncompleteDownloadError(
+                        f"Download of {url} was interrupted: "
+                        f"{type(err).__name__}: {err}") from err
+
+                if buffer:
+                    await run(write, buffer)
+                    pos += len(buffer)
+            finally:
+                await run(file_out.close)
+                checkpoint.add(offset, pos - 1)
+                await run(checkpoint.save)
+
+        if size is not None and pos != size:
+            raise IncompleteDownloadError(f"Download of {url} was "
+                                          f"incomplete ({pos} of {size} "
+                                          f"bytes)")
+
+        if hashers:
+            verifier._verify_checksums(url, hashers, checksums)
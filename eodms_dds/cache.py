@@ -0,0 +1,239 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+
+from .metrics import registry as metrics
+
+
+def download_url_expiry(download_url):
+    """
+    Gets the expiration time of a presigned download URL (AWS Signature
+        Version 4 'X-Amz-Date' + 'X-Amz-Expires', or the 'Expires' epoch
+        of older signatures).
+
+    :param download_url: The download URL.
+    :type  download_url: str
+
+    :return: The expiration as a UNIX timestamp or None if unknown.
+    :rtype:  float
+    """
+
+    query = {k.lower(): v[0] for k, v in
+             parse_qs(urlparse(download_url).query).items()}
+
+    try:
+        if 'x-amz-date' in query and 'x-amz-expires' in query:
+            signed_dt = datetime.strptime(query['x-amz-date'],
+                                          '%Y%m%dT%H%M%SZ')
+            signed_dt = signed_dt.replace(tzinfo=timezone.utc)
+            return signed_dt.timestamp() + int(query['x-amz-expires'])
+
+        if 'expires' in query:
+            return float(query['expires'])
+    except ValueError:
+        return None
+
+    return None
+
+
+class ItemCache():
+
+    def __init__(self, max_items=1024, db_fn=None, ttl=3600,
+                 processing_ttl=30, expiry_margin=300):
+        """
+        Initializes a cache of DDS item info keyed by catalog, collection
+            and UUID, with an in-memory LRU tier and an optional SQLite
+            tier shared between runs.
+
+        Ready items (with a download_url) are kept until their presigned
+            URL expires (minus expiry_margin) or for ttl seconds if the
+            expiration is unknown. Items still being processed are only
+            kept for processing_ttl seconds since their status changes.
+
+        :param max_items: The maximum number of items kept in memory.
+        :type  max_items: int
+        :param db_fn: The path of the SQLite database (None to only cache
+            in memory).
+        :type  db_fn: str
+        :param ttl: The lifetime in seconds of ready items whose download
+            URL has no known expiration.
+        :type  ttl: float
+        :param processing_ttl: The lifetime in seconds of items being
+            processed (0 to never cache them).
+        :type  processing_ttl: float
+        :param expiry_margin: The number of seconds before the download URL
+            expires at which an item is dropped, so a download has time to
+            start.
+        :type  expiry_margin: float
+        """
+
+        self.max_items = max_items
+        self.db_fn = db_fn
+        self.ttl = ttl
+        self.processing_ttl = processing_ttl
+        self.expiry_margin = expiry_margin
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+
+        if db_fn is not None:
+            self._db = sqlite3.connect(db_fn, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS items ("
+                             "key TEXT PRIMARY KEY, "
+                             "item_json TEXT NOT NULL, "
+                             "expires REAL NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(catalog, collection, item_uuid):
+        return f'{catalog}/{collection}/{item_uuid}'
+
+    def get(self, catalog, collection, item_uuid):
+        """
+        Gets an item from the cache.
+
+        :return: The item info or None if it is not cached (or expired).
+        :rtype:  dict
+        """
+
+        key = self.make_key(catalog, collection, item_uuid)
+        now = time.time()
+
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                item_info, expires = entry
+                if expires > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc('eodms_cache_lookups_total', result='hit')
+                    return item_info
+                del self._items[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT item_json, expires FROM items "
+                                       "WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        item_info = json.loads(row[0])
+                        self._remember(key, item_info, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        metrics.inc('eodms_cache_lookups_total',
+                                    result='disk_hit')
+                        return item_info
+                    self._db.execute("DELETE FROM items WHERE key = ?",
+                                     (key,))
+                    self._db.commit()
+
+            self.misses += 1
+
+        metrics.inc('eodms_cache_lookups_total', result='miss')
+
+        return None
+
+    def put(self, catalog, collection, item_uuid, item_info):
+        """
+        Adds an item to the cache (if it should be cached).
+        """
+
+        expires = self._expires(item_info)
+        if expires is None:
+            return
+
+        key = self.make_key(catalog, collection, item_uuid)
+
+        with self._lock:
+            self._remember(key, item_info, expires)
+
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO items "
+                                 "(key, item_json, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(item_info), expires))
+                self._db.commit()
+
+    def invalidate(self, catalog, collection, item_uuid):
+        """
+        Removes an item from the cache.
+        """
+
+        key = self.make_key(catalog, collection, item_uuid)
+
+        with self._lock:
+            self._items.pop(key, None)
+
+            if self._db is not None:
+                self._db.execute("DELETE FROM items WHERE key = ?", (key,))
+                self._db.commit()
+
+    def clear(self):
+        """
+        Removes all items from the cache.
+        """
+
+        with self._lock:
+            self._items.clear()
+
+            if self._db is not None:
+                self._db.execute("DELETE FROM items")
+                self._db.commit()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        :rtype: dict
+        """
+
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+            "size": len(self._items)
+        }
+
+    def close(self):
+        """
+        Closes the SQLite database.
+        """
+
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _expires(self, item_info):
+
+        now = time.time()
+        download_url = item_info.get('download_url')
+
+        if not download_url:
+            if not self.processing_ttl:
+                return None
+            return now + self.processing_ttl
+
+        url_expiry = download_url_expiry(download_url)
+        if url_expiry is None:
+            return now + self.ttl
+
+        expires = url_expiry - self.expiry_margin
+        return expires if expires > now else None
+
+    def _remember(self, key, item_info, expires):
+
+        self._items[key] = (item_info, expires)
+        self._items.move_to_end(key)
+
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
@@ -0,0 +1,446 @@
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import api_logger
+from .features import Feature, FeatureSet
+from .search import format_interval, parse_interval
+
+_COLUMNS = "i.id, i.collection, i.datetime, i.west, i.south, i.east, " \
+           "i.north, i.geometry, i.properties"
+
+
+def _to_datetime(value):
+
+    if value is None or isinstance(value, datetime):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+    return parse_interval(value)[0]
+
+
+class CatalogMirror():
+
+    def __init__(self, db_fn, search_api=None, batch_size=500):
+        """
+        Initializes a local mirror of collections of the search API in a
+            SQLite database, indexed on datetime, collection and bbox (with
+            an R*Tree when SQLite supports it).
+
+        Each sync only requests the items acquired after the newest item of
+            the previous sync (the high-water mark, minus an overlap), and
+            records which items it added, so queries and "what's new" feeds
+            run locally.
+
+        :param db_fn: The path of the SQLite database.
+        :type  db_fn: str
+        :param search_api: The SearchAPI used to sync.
+        :type  search_api: SearchAPI
+        :param batch_size: The number of items written per transaction.
+        :type  batch_size: int
+        """
+
+        self.db_fn = db_fn
+        self.search_api = search_api
+        self.batch_size = batch_size
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_fn, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "rowid INTEGER PRIMARY KEY, "
+            "collection TEXT NOT NULL, "
+            "id TEXT NOT NULL, "
+            "datetime REAL, "
+            "west REAL, south REAL, east REAL, north REAL, "
+            "geometry BLOB, "
+            "properties BLOB, "
+            "first_sync INTEGER NOT NULL, "
+            "last_sync INTEGER NOT NULL, "
+            "UNIQUE (collection, id));"
+            "CREATE INDEX IF NOT EXISTS items_collection_datetime "
+            "ON items (collection, datetime);"
+            "CREATE INDEX IF NOT EXISTS items_datetime ON items (datetime);"
+            "CREATE INDEX IF NOT EXISTS items_first_sync "
+            "ON items (first_sync);"
+            "CREATE TABLE IF NOT EXISTS syncs ("
+            "sync_id INTEGER PRIMARY KEY, "
+            "collection TEXT NOT NULL, "
+            "started REAL NOT NULL, "
+            "finished REAL, "
+            "query TEXT, "
+            "added INTEGER NOT NULL DEFAULT 0, "
+            "updated INTEGER NOT NULL DEFAULT 0, "
+            "high_water REAL);"
+            "CREATE TABLE IF NOT EXISTS readers ("
+            "reader TEXT NOT NULL, "
+            "collection TEXT NOT NULL, "
+            "sync_id INTEGER NOT NULL, "
+            "PRIMARY KEY (reader, collection));")
+
+        try:
+            self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS items_bbox "
+                             "USING rtree(id, west, east, south, north)")
+            self.rtree = True
+        except sqlite3.OperationalError:
+            self.logger.warning("WARNING: SQLite was built without the R*Tree "
+                                "module; bbox queries will use a regular "
+                                "index.")
+            self._db.execute("CREATE INDEX IF NOT EXISTS items_bbox_west "
+                             "ON items (west, east)")
+            self.rtree = False
+
+        self._db.commit()
+
+    def high_water(self, collection):
+        """
+        Gets the datetime of the newest item synced in a collection.
+
+        :return: The datetime or None if the collection was never synced.
+        :rtype:  datetime.datetime
+        """
+
+        with self._lock:
+            row = self._db.execute("SELECT MAX(high_water) FROM syncs "
+                                   "WHERE collection = ? AND finished IS NOT "
+                                   "NULL", (collection,)).fetchone()
+
+        if row[0] is None:
+            return None
+
+        return datetime.fromtimestamp(row[0], timezone.utc)
+
+    def sync(self, collection, bbox=None, start=None, params=None, workers=1,
+             overlap=timedelta(days=1)):
+        """
+        Syncs a collection with the search API: only the items acquired
+            since its high-water mark (minus overlap) are requested, or
+            since start on the first sync. New items are added and changed
+            items updated.
+
+        The search API does not say when an item was last modified, so an
+            item published more than overlap after its acquisition is
+            missed; a longer overlap costs more requests per sync.
+
+        :param collection: The collection Id.
+        :type  collection: str
+        :param bbox: The bounding box (west, south, east, north) to mirror.
+            It should not change between syncs of a collection.
+        :type  bbox: list
+        :param start: The oldest datetime to mirror on the first sync (None
+            for the whole collection).
+        :type  start: str or datetime.datetime
+        :param params: Other query parameters.
+        :type  params: dict
+        :param workers: The number of parallel shards (see
+            SearchAPI.sharded_features; 1 pages through one cursor).
+        :type  workers: int
+        :param overlap: The time before the high-water mark searched again.
+        :type  overlap: datetime.timedelta
+
+        :return: The sync_id and the number of items added and updated.
+        :rtype:  dict
+        """
+
+        if self.search_api is None:
+            raise ValueError("A SearchAPI is required to sync.")
+
+        high_water = self.high_water(collection)
+        begin = high_water - overlap if high_water is not None \
+            else _to_datetime(start)
+
+        date_range = None
+        if begin is not None or workers > 1:
+            # A closed interval can be split into shards in time
+            end = datetime.now(timezone.utc) if workers > 1 else None
+            date_range = format_interval(begin, end)
+
+        with self._lock:
+            sync_id = self._db.execute(
+                "INSERT INTO syncs (collection, started, query) "
+                "VALUES (?, ?, ?)",
+                (collection, time.time(), date_range)).lastrowid
+            self._db.commit()
+
+        self.logger.info(f"Syncing {collection} "
+                         f"({date_range or 'all items'})...")
+
+        if workers > 1:
+            features = self.search_api.sharded_features(
+                collection, bbox=bbox, datetime=date_range, workers=workers,
+                params=params)
+        else:
+            features = self.search_api.features(
+                collection, bbox=bbox, datetime=date_range, params=params)
+
+        counts = {'added': 0, 'updated': 0}
+        newest = high_water.timestamp() if high_water is not None \
+            else -math.inf
+
+        batch = []
+        for feature in features:
+            feature = Feature.from_dict(feature, collection)
+            if not math.isnan(feature.timestamp):
+                newest = max(newest, feature.timestamp)
+            batch.append(feature)
+            if len(batch) >= self.batch_size:
+                self._write(collection, batch, sync_id, counts)
+                batch = []
+        if batch:
+            self._write(collection, batch, sync_id, counts)
+
+        with self._lock:
+            self._db.execute("UPDATE syncs SET finished = ?, added = ?, "
+                             "updated = ?, high_water = ? WHERE sync_id = ?",
+                             (time.time(), counts['added'],
+                              counts['updated'],
+                              newest if newest > -math.inf else None,
+                              sync_id))
+            self._db.commit()
+
+        self.logger.info(f"Synced {collection}: {counts['added']} new and "
+                         f"{counts['updated']} updated items.")
+
+        return {'sync_id': sync_id, 'added': counts['added'],
+                'updated': counts['updated']}
+
+    def _write(self, collection, features, sync_id, counts):
+
+        with self._lock:
+            existing = {}
+            ids = [feature.id for feature in features]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in self._db.execute(
+                        f"SELECT id, rowid, geometry, properties FROM items "
+                        f"WHERE collection = ? AND id IN ({marks})",
+                        [collection] + chunk):
+                    existing[row[0]] = row[1:]
+
+            for feature in features:
+                timestamp = None if math.isnan(feature.timestamp) \
+                    else feature.timestamp
+                bbox = (None,) * 4 if math.isnan(feature.bbox[0]) \
+                    else feature.bbox
+                values = (timestamp,) + tuple(bbox) + \
+                    (feature._geometry, feature._properties)
+
+                row = existing.get(feature.id)
+                if row is None:
+                    rowid = self._db.execute(
+                        "INSERT INTO items (collection, id, datetime, west, "
+                        "south, east, north, geometry, properties, "
+                        "first_sync, last_sync) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (collection, feature.id) + values +
+                        (sync_id, sync_id)).lastrowid
+                    existing[feature.id] = (rowid, feature._geometry,
+                                            feature._properties)
+                    counts['added'] += 1
+                elif (row[1], row[2]) != (feature._geometry,
+                                          feature._properties):
+                    rowid = row[0]
+                    self._db.execute(
+                        "UPDATE items SET datetime = ?, west = ?, south = ?, "
+                        "east = ?, north = ?, geometry = ?, properties = ?, "
+                        "last_sync = ? WHERE rowid = ?",
+                        values + (sync_id, rowid))
+                    counts['updated'] += 1
+                else:
+                    self._db.execute("UPDATE items SET last_sync = ? "
+                                     "WHERE rowid = ?", (sync_id, row[0]))
+                    continue
+
+                if self.rtree:
+                    self._db.execute("DELETE FROM items_bbox WHERE id = ?",
+                                     (rowid,))
+                    if bbox[0] is not None:
+                        west, south, east, north = bbox
+                        if west > east:
+                            # Crossing the antimeridian
+                            west, east = -180.0, 180.0
+                        self._db.execute(
+                            "INSERT INTO items_bbox VALUES (?, ?, ?, ?, ?)",
+                            (rowid, west, east, south, north))
+
+            self._db.commit()
+
+    def query(self, collection=None, bbox=None, datetime=None, limit=None):
+        """
+        Queries the mirror, ordered by datetime.
+
+        :param collection: The collection Id (None for all).
+        :type  collection: str
+        :param bbox: The bounding box (west, south, east, north), which may
+            cross the antimeridian.
+        :type  bbox: list
+        :param datetime: The ISO 8601 date or range (ex:
+            '2023-01-01T00:00:00Z/..').
+        :type  datetime: str
+        :param limit: The maximum number of items.
+        :type  limit: int
+
+        :rtype: FeatureSet
+        """
+
+        if bbox is not None:
+            west, south, east, north = (float(coord) for coord in bbox[:4])
+            if west > east:
+                # Query each side of the antimeridian
+                features = list(self.query(collection,
+                                           (west, south, 180.0, north),
+                                           datetime))
+                seen = {(feature.collection, feature.id)
+                        for feature in features}
+                features += [feature for feature in
+                             self.query(collection,
+                                        (-180.0, south, east, north),
+                                        datetime)
+                             if (feature.collection, feature.id) not in seen]
+                features.sort(key=lambda feature: (
+                    math.isnan(feature.timestamp), feature.timestamp))
+                return FeatureSet(features[:limit], collection)
+
+        sql = f"SELECT {_COLUMNS} FROM items i"
+        where = []
+        args = []
+
+        if bbox is not None:
+            if self.rtree:
+                sql += " JOIN items_bbox b ON b.id = i.rowid " \
+                       "AND b.west <= ? AND b.east >= ? " \
+                       "AND b.south <= ? AND b.north >= ?"
+                args += [east, west, north, south]
+            where.append("i.south <= ? AND i.north >= ? AND "
+                         "(i.west <= i.east AND i.west <= ? AND i.east >= ? "
+                         "OR i.west > i.east AND (i.west <= ? OR i.east >= ?))")
+            args += [north, south, east, west, east, west]
+
+        if collection is not None:
+            where.append("i.collection = ?")
+            args.append(collection)
+
+        if datetime is not None:
+            begin, end = parse_interval(datetime)
+            if begin is not None:
+                where.append("i.datetime >= ?")
+                args.append(begin.timestamp())
+            if end is not None:
+                where.append("i.datetime <= ?")
+                args.append(end.timestamp())
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY i.datetime IS NULL, i.datetime"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+
+        return self._features(sql, args, collection)
+
+    def whats_new(self, collection=None, reader='default', mark=True):
+        """
+        Gets the items added to the mirror since the last call by the same
+            reader (all the items on the first call).
+
+        :param collection: The collection Id (None for all).
+        :type  collection: str
+        :param reader: The name of the reader, so several workflows each
+            get their own feed.
+        :type  reader: str
+        :param mark: Whether to mark the items as read.
+        :type  mark: boolean
+
+        :rtype: FeatureSet
+        """
+
+        key = collection or '*'
+
+        with self._lock:
+            row = self._db.execute("SELECT sync_id FROM readers WHERE "
+                                   "reader = ? AND collection = ?",
+                                   (reader, key)).fetchone()
+            last_read = row[0] if row is not None else 0
+            latest = self._db.execute("SELECT MAX(sync_id) FROM syncs "
+                                      "WHERE finished IS NOT NULL") \
+                .fetchone()[0] or 0
+
+            sql = f"SELECT {_COLUMNS} FROM items i " \
+                  f"WHERE i.first_sync > ? AND i.first_sync <= ?"
+            args = [last_read, latest]
+            if collection is not None:
+                sql += " AND i.collection = ?"
+                args.append(collection)
+            sql += " ORDER BY i.datetime IS NULL, i.datetime"
+
+            features = self._features(sql, args, collection)
+
+            if mark:
+                self._db.execute("INSERT OR REPLACE INTO readers "
+                                 "(reader, collection, sync_id) "
+                                 "VALUES (?, ?, ?)", (reader, key, latest))
+                self._db.commit()
+
+        return features
+
+    def _features(self, sql, args, collection):
+
+        features = FeatureSet(collection=collection)
+
+        with self._lock:
+            for (feature_id, feature_collection, timestamp, west, south,
+                 east, north, geometry, properties) in \
+                    self._db.execute(sql, args):
+                bbox = (west, south, east, north) if west is not None \
+                    else (math.nan,) * 4
+                features.features.append(Feature(
+                    feature_id, feature_collection,
+                    math.nan if timestamp is None else timestamp, bbox,
+                    geometry, properties))
+
+        return features
+
+    def stats(self):
+        """
+        Returns the number of items, the high-water mark and the last sync
+            of each collection.
+
+        :rtype: dict
+        """
+
+        with self._lock:
+            counts = dict(self._db.execute(
+                "SELECT collection, COUNT(*) FROM items "
+                "GROUP BY collection").fetchall())
+            syncs = self._db.execute(
+                "SELECT collection, MAX(high_water), MAX(finished) "
+                "FROM syncs WHERE finished IS NOT NULL "
+                "GROUP BY collection").fetchall()
+
+        stats = {}
+        for collection, high_water, finished in syncs:
+            stats[collection] = {
+                'items': counts.get(collection, 0),
+                'high_water': None if high_water is None else
+                datetime.fromtimestamp(high_water, timezone.utc),
+                'last_sync': datetime.fromtimestamp(finished, timezone.utc)
+            }
+
+        return stats
+
+    def close(self):
+        """
+        Closes the SQLite database.
+        """
+
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,4 +1,8 @@
 import os
+import heapq
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from requests.packages import urllib3
 from tqdm.auto import tqdm
@@ -10,14 +14,53 @@ from urllib.parse import urlparse, parse_qs
 from . import aaa
 from . import api_logger
 from . import config
+from . import session as eodms_session
+from .download import Downloader, item_checksums
+from .exceptions import CircuitOpenError, DDSError
+from .retry import TRANSIENT_ERRORS, RetryPolicy
+from .store import preferred_checksum
 
 class DDS_API():
 
-    def __init__(self, aaa_api, environment='prod'):
+    def __init__(self, aaa_api, environment='prod', session=None,
+                 item_cache=None, product_store=None, retry_policy=None):
+        """
+        Initializes the DDS_API instance.
+        :param aaa_api: The AAA_API instance used to get Access Tokens
+        :param environment: Environment to use ('prod' or 'staging')
+        :param session: A requests Session to use for item requests and
+            downloads (defaults to the pooled session of the aaa_api)
+        :param item_cache: An ItemCache used by get_item, get_items and
+            fetch_item to avoid requesting the same items again
+        :param product_store: A ProductStore used by download_item to reuse
+            products which were already downloaded
+        :param retry_policy: The RetryPolicy used for downloads (defaults
+            to the one of the aaa_api, which item requests go through)
+        """
+
         domain_config = config.get_domain_config(environment)
         self.domain = domain_config['domain']
         self.verify_ssl = domain_config.get('verify_ssl', True)
         self.img_info = None
+        self.img_uuid = None
+
+        if session is None:
+            if aaa_api is not None:
+                session = aaa_api.session
+            else:
+                session = eodms_session.create_session(
+                    verify_ssl=self.verify_ssl)
+        self.session = session
+
+        if retry_policy is None:
+            retry_policy = aaa_api.retry_policy if aaa_api is not None \
+                else RetryPolicy()
+        self.retry_policy = retry_policy
+        self.rate_limiter = aaa_api.rate_limiter if aaa_api is not None \
+            else None
+
+        self.item_cache = item_cache
+        self.product_store = product_store
 
         self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
 
@@ -28,55 +71,325 @@ class DDS_API():
         # self.login_info = self.aaa.login()
 
     def get_item(self, collection, item_uuid, catalog="EODMS"):
+        """
+        Gets the info of an item and stores it in self.img_info (see
+            fetch_item). Failures are logged instead of raised: errors of
+            the DDS API, network errors which outlasted the retries and
+            requests refused by an open circuit breaker.
 
-        url = f"{self.domain}/dds/v1/item/{catalog}/{collection}/{item_uuid}"
+        :return: The item info or None if the request failed.
+        :rtype:  dict
+        """
 
-        access_token = self.aaa.get_access_token()
-        headers = {"Authorization": f"Bearer {access_token}"}
-        # resp = requests.get(url, headers=headers, trust_env=False, verify=False)
-        resp = self.aaa.prepare_request(url, headers=headers)
+        self.img_uuid = item_uuid
+
+        cached = self._get_cached(collection, item_uuid, catalog)
+        if cached is not None:
+            self.logger.info("Got item from the item cache")
+            self.img_info = cached
+            return cached
 
-        if resp.status_code == 200:
+        try:
+            self.img_info = self._fetch_item(collection, item_uuid, catalog)
+        except (DDSError, CircuitOpenError) + TRANSIENT_ERRORS as err:
+            self.logger.error(f"Failed to get item using DDS API: {err}\n")
+            return None
+
+        if 'download_url' in self.img_info:
             self.logger.info("Successfully got item using DDS API")
-            try:
-                self.img_info = resp.json()
-            except:
-                resp_text = resp.text
-                if resp_text.content.startswith('<HTML>'):
-                    self.logger.info("DDS API cannot be accessed at this time.")
-                    return None
-        elif resp.status_code == 202:
-            self.img_info = resp.json()
+        else:
             status = self.img_info.get('status')
             self.logger.info(f"Image is being processed. Its current "
                   f"status is {status}.")
-        else:
+
+        return self.img_info
+
+    def get_items(self, collection, item_uuids, catalog="EODMS",
+                  max_workers=8):
+        """
+        Gets many items concurrently using a bounded pool of workers which
+            share the same Access Token and pooled session.
+        Unlike get_item, this does not change self.img_info.
+
+        :param collection: The Collection Id.
+        :type  collection: str
+        :param item_uuids: The UUIDs of the items.
+        :type  item_uuids: list
+        :param catalog: The catalog name.
+        :type  catalog: str
+        :param max_workers: The maximum number of concurrent requests (keep
+            it at or below the pool_maxsize of the session).
+        :type  max_workers: int
+
+        :return: A tuple (items, errors): items maps each UUID which was
+            found (including items still being processed) to its item info,
+            in the order of item_uuids; errors maps each UUID which failed
+            to the exception raised for it.
+        :rtype:  tuple
+        """
+
+        item_uuids = list(dict.fromkeys(item_uuids))
+
+        self.logger.info(f"Getting {len(item_uuids)} items using DDS API "
+                         f"with {max_workers} workers...")
+
+        def fetch(item_uuid):
             try:
-                err_json = resp.json()
-                error = err_json.get('error')
-                msg = err_json.get('message')
-                request_id = err_json.get('request_id')
-                trace_id = err_json.get('trace_id')
-                self.logger.error(err_json)
-                self.logger.error(f"Failed to get item using DDS API\n")
-            except:
-                self.logger.error("Failed to get item using DDS API\n")
-                #  self.logger.error(f"resp: {resp.content}")
-                return None
-
-        return resp.json()
-
-    def download_item(self, out_folder) -> str:
+                return self.fetch_item(collection, item_uuid, catalog), None
+            except Exception as err:
+                return None, err
+
+        items = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(fetch, item_uuids)
+            for item_uuid, (item_info, err) in zip(item_uuids, results):
+                if err is None:
+                    items[item_uuid] = item_info
+                else:
+                    errors[item_uuid] = err
+
+        self.logger.info(f"Got {len(items)} items using DDS API "
+                         f"({len(errors)} failed).")
+
+        return items, errors
+
+    def await_ready(self, collection, item_uuids, catalog="EODMS",
+                    timeout=None, initial_delay=5, max_delay=300,
+                    backoff=2, jitter=0.5, max_workers=4):
+        """
+        Polls items which are being processed by the DDS and yields each
+            one as soon as it can be downloaded.
+
+        Each item is polled on its own schedule: the delay grows
+            exponentially (with random jitter) after every 202 response,
+            and is extended to the Retry-After of the server if that is
+            longer. Items are polled max_workers at a time. Polls always go
+            to the DDS API (never to the item cache).
+
+        :param collection: The Collection Id.
+        :type  collection: str
+        :param item_uuids: The UUIDs of the items.
+        :type  item_uuids: list
+        :param catalog: The catalog name.
+        :type  catalog: str
+        :param timeout: The maximum number of seconds to wait for all items
+            (None waits forever).
+        :type  timeout: float
+        :param initial_delay: The delay in seconds before the second poll
+            of an item.
+        :type  initial_delay: float
+        :param max_delay: The maximum delay in seconds between polls.
+        :type  max_delay: float
+        :param backoff: The factor applied to the delay after each poll.
+        :type  backoff: float
+        :param jitter: The fraction of each delay which is randomized
+            (0 for none, 1 for "full jitter").
+        :type  jitter: float
+        :param max_workers: The maximum number of concurrent polls.
+        :type  max_workers: int
+
+        :return: A generator of tuples (item_uuid, item_info, error). error
+            is None once the item is ready; otherwise item_info is None and
+            error is the DDSError which stopped polling of the item
+            (including timeouts).
+        """
+
+        deadline = time.monotonic() + timeout if timeout is not None \
+            else None
+
+        # Heap of (poll time, order, item_uuid, attempt)
+        pending = [(0, idx, item_uuid, 0) for idx, item_uuid
+                   in enumerate(dict.fromkeys(item_uuids))]
+        heapq.heapify(pending)
+
+        def delay_for(attempt, retry_after):
+            delay = min(initial_delay * backoff ** attempt, max_delay)
+            delay *= 1 - jitter * random.random()
+            # The server may ask for a longer (never a shorter) wait
+            return max(delay, retry_after or 0)
+
+        def poll(item_uuid):
+            try:
+                resp = self._request_item(collection, item_uuid, catalog)
+            except requests.exceptions.RequestException as err:
+                # Transient network error; try again later
+                return None, None, err, None
+
+            retry_after = eodms_session.parse_retry_after(
+                resp.headers.get('Retry-After'))
+
+            if resp.status_code in (200, 202):
+                try:
+                    return resp.json(), None, None, retry_after
+                except ValueError:
+                    err = DDSError("DDS API cannot be accessed at this time.",
+                                   status_code=resp.status_code,
+                                   response=resp)
+                    return None, None, err, retry_after
+
+            err = DDSError.from_response(resp)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                return None, None, err, retry_after
+
+            return None, err, None, None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending:
+                now = time.monotonic()
+
+                if deadline is not None and now >= deadline:
+                    for _, _, item_uuid, _ in sorted(pending):
+                        yield item_uuid, None, DDSError(
+                            f"Timed out waiting for item {item_uuid}.")
+                    return
+
+                wait = pending[0][0] - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                if wait > 0:
+                    time.sleep(wait)
+                    continue
+
+                due = []
+                while pending and pending[0][0] <= now and \
+                        len(due) < max_workers:
+                    due.append(heapq.heappop(pending))
+
+                results = executor.map(poll, [entry[2] for entry in due])
+                for (_, idx, item_uuid, attempt), result in zip(due, results):
+                    item_info, fatal, transient, retry_after = result
+
+                    if fatal is not None:
+                        yield item_uuid, None, fatal
+                    elif item_info is not None and \
+                            item_info.get('download_url'):
+                        if self.item_cache is not None:
+                            self.item_cache.put(catalog, collection,
+                                                item_uuid, item_info)
+                        yield item_uuid, item_info, None
+                    else:
+                        if transient is not None:
+                            self.logger.warning(f"WARNING: Polling item "
+                                                f"{item_uuid} failed: "
+                                                f"{transient}")
+                        next_poll = time.monotonic() + \
+                            delay_for(attempt, retry_after)
+                        heapq.heappush(pending, (next_poll, idx, item_uuid,
+                                                 attempt + 1))
+
+    def _request_item(self, collection, item_uuid, catalog="EODMS"):
+
+        url = f"{self.domain}/dds/v1/item/{catalog}/{collection}/{item_uuid}"
+
+        access_token = self.aaa.get_access_token()
+        headers = {"Authorization": f"Bearer {access_token}"}
+        # resp = requests.get(url, headers=headers, trust_env=False, verify=False)
+        return self.aaa.prepare_request(url, headers=headers)
+
+    def fetch_item(self, collection, item_uuid, catalog="EODMS"):
+        """
+        Gets the info of an item (status 200 or 202) without changing
+            self.img_info, raising a DDSError on failure instead of logging
+            it.
+        """
+
+        cached = self._get_cached(collection, item_uuid, catalog)
+        if cached is not None:
+            return cached
+
+        return self._fetch_item(collection, item_uuid, catalog)
+
+    def _fetch_item(self, collection, item_uuid, catalog):
+
+        resp = self._request_item(collection, item_uuid, catalog)
+
+        if resp.status_code not in (200, 202):
+            raise DDSError.from_response(resp)
+
+        try:
+            item_info = resp.json()
+        except ValueError:
+            raise DDSError("DDS API cannot be accessed at this time.",
+                           status_code=resp.status_code, response=resp)
+
+        if self.item_cache is not None:
+            self.item_cache.put(catalog, collection, item_uuid, item_info)
+
+        return item_info
+
+    def _get_cached(self, collection, item_uuid, catalog):
+
+        if self.item_cache is None:
+            return None
+
+        return self.item_cache.get(catalog, collection, item_uuid)
+
+    def download_item(self, out_folder, segments=1, segment_size=None,
+                      resume=True, chunk_size=None, readinto=False,
+                      progress=True, item_info=None, on_chunk=None,
+                      item_uuid=None, verify=True, preallocate=True,
+                      write_mode='pwrite') -> str:
         """
         Downloads the item to the specified folder.
         Returns the filename (full path).
+
+        :param out_folder: The output folder.
+        :type  out_folder: str
+        :param segments: The number of parallel Range requests used to
+            download the file (1 downloads it as a single stream). If the
+            server does not support ranges, a single stream is used.
+        :type  segments: int
+        :param segment_size: The size of each segment in bytes (by default
+            the file is split into 'segments' equal parts).
+        :type  segment_size: int
+        :param resume: Determines whether to continue an interrupted
+            download of the same file (from its '.part' file) instead of
+            starting over.
+        :type  resume: boolean
+        :param chunk_size: The number of bytes read per chunk (by default
+            it adapts to the transfer speed).
+        :type  chunk_size: int
+        :param readinto: If True, read into a reusable buffer instead of
+            allocating a new one per chunk.
+        :type  readinto: boolean
+        :param progress: Determines whether to show a progress bar.
+        :type  progress: boolean
+        :param item_info: The item info to download (defaults to
+            self.img_info). Pass it explicitly when downloading several
+            items at once.
+        :type  item_info: dict
+        :param on_chunk: A function called with the size of each chunk
+            written (ex: to count or throttle the transfer).
+        :type  on_chunk: function
+        :param item_uuid: The UUID of the item, used to index it in the
+            product store (defaults to the UUID of the last get_item call
+            when item_info is not given).
+        :type  item_uuid: str
+        :param verify: Determines whether to verify the size and checksums
+            of the file against the item info and the response headers
+            while it is downloaded. A file which fails verification is
+            downloaded again once, then IntegrityError is raised.
+        :type  verify: boolean
+        :param preallocate: Determines whether to reserve the disk space of
+            the file before it is written (fallocate).
+        :type  preallocate: boolean
+        :param write_mode: How parallel segments are written: 'pwrite'
+            (positional writes), 'mmap' (into a memory map of the file) or
+            'seek'.
+        :type  write_mode: str
         """
 
-        if self.img_info is None:
+        if item_info is None:
+            item_info = self.img_info
+            if item_uuid is None:
+                item_uuid = self.img_uuid
+
+        if item_info is None:
             self.logger.error("ERROR: No image info available.\n")
             return None
 
-        download_url = self.img_info.get('download_url')
+        download_url = item_info.get('download_url')
 
         if not download_url:
             return None
@@ -86,15 +399,121 @@ class DDS_API():
 
         self.logger.info(f"Downloading image to {dest_fn}...\n")
 
-        with requests.get(download_url, stream=True, verify=self.verify_ssl) as stream:
-            with open(dest_fn, 'wb') as pipe:
-                with tqdm.wrapattr(
-                        pipe,
-                        method='write',
-                        miniters=1,
-                        desc=os.path.basename(dest_fn)
-                ) as file_out:
-                    for chunk in stream.iter_content(chunk_size=1024):
-                        file_out.write(chunk)
+        checksums, expected_size = item_checksums(item_info)
+
+        downloader = Downloader(self.session, self.verify_ssl,
+                                segments=segments,
+                                segment_size=segment_size,
+                                resume=resume,
+                                chunk_size=chunk_size,
+                                readinto=readinto,
+                                progress=progress,
+                                on_chunk=on_chunk,
+                                verify=verify,
+                                checksums=checksums,
+                                expected_size=expected_size,
+                                preallocate=preallocate,
+                                write_mode=write_mode,
+                                retry_policy=self.retry_policy,
+                                rate_limiter=self.rate_limiter)
+
+        if self.product_store is None:
+            return downloader.download(download_url, dest_fn)
+
+        basename = os.path.basename(dest_fn)
+        size, etag = downloader.probe(download_url)
+
+        # Products are found by the checksum of the item info when it has
+        #   one, otherwise by their size and ETag
+        stored_fn = self.product_store.find(basename, item_uuid, size, etag,
+                                            preferred_checksum(checksums))
+        if stored_fn is not None:
+            self.logger.info(f"Found {basename} in the product store; "
+                             f"linking it instead of downloading.")
+            if not (os.path.exists(dest_fn) and
+                    os.path.samefile(stored_fn, dest_fn)):
+                self.product_store.link(stored_fn, dest_fn)
+            return dest_fn
+
+        downloader.download(download_url, dest_fn)
+
+        checksum = preferred_checksum(downloader.digests)
+
+        self.product_store.add(dest_fn, item_uuid, size, etag, checksum)
 
         return dest_fn
+
+    def stream_item(self, target, item_info=None, segments=1,
+                    segment_size=None, chunk_size=None, readinto=True,
+                    progress=False, on_chunk=None, verify=True):
+        """
+        Downloads the item into a sink instead of a file in a folder: a
+            file path, an open binary file object (ex: a pipe into a
+            decompressor), a callable receiving each chunk (ex: an
+            object-store upload) or a preallocated writable buffer (ex: a
+            bytearray or an mmap, which is filled in place).
+        Chunks are passed to file objects and callables as memoryview
+            slices of a reused buffer, so they are not copied between
+            chunks; a callable must copy a chunk it wants to keep.
+
+        :param target: The file path or sink.
+        :type  target: str, file object, function, buffer or sinks.Sink
+        :param item_info: The item info to download (defaults to
+            self.img_info).
+        :type  item_info: dict
+        :param segments: The number of parallel Range requests (only used
+            for file paths, seekable files and buffers).
+        :type  segments: int
+        :param segment_size: The size of each segment in bytes.
+        :type  segment_size: int
+        :param chunk_size: The number of bytes read per chunk (by default
+            it adapts to the transfer speed).
+        :type  chunk_size: int
+        :param readinto: If True, read into a reusable buffer instead of
+            allocating a new one per chunk.
+        :type  readinto: boolean
+        :param progress: Determines whether to show a progress bar.
+        :type  progress: boolean
+        :param on_chunk: A function called with the size of each chunk
+            written.
+        :type  on_chunk: function
+        :param verify: Determines whether to verify the size and checksums
+            of the file.
+        :type  verify: boolean
+
+        :return: The number of bytes written.
+        :rtype:  int
+        """
+
+        if item_info is None:
+            item_info = self.img_info
+
+        if item_info is None:
+            self.logger.error("ERROR: No image info available.\n")
+            return None
+
+        download_url = item_info.get('download_url')
+
+        if not download_url:
+            return None
+
+        checksums, expected_size = item_checksums(item_info)
+
+        downloader = Downloader(self.session, self.verify_ssl,
+                                segments=segments,
+                                segment_size=segment_size,
+                                chunk_size=chunk_size,
+                                readinto=readinto,
+                                progress=progress,
+                                on_chunk=on_chunk,
+                                verify=verify,
+                                checksums=checksums,
+                                expected_size=expected_size,
+                                retry_policy=self.retry_policy,
+                                rate_limiter=self.rate_limiter)
+
+        if isinstance(target, (str, os.PathLike)):
+            dest_fn = downloader.download(download_url, os.fspath(target))
+            return os.path.getsize(dest_fn)
+
+        return downloader.stream(download_url, target)
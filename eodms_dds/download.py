@@ -0,0 +1,1267 @@
+import base64
+import binascii
+import errno
+import hashlib
+import heapq
+import mmap
+import os
+import re
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+from requests.packages import urllib3
+from tqdm.auto import tqdm
+
+from . import api_logger
+from .exceptions import DownloadError, IncompleteDownloadError, \
+    IntegrityError
+from .metrics import registry as metrics
+from .sinks import BufferSink, FileObjectSink, PwriteSink, make_sink
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+UNSATISFIED_RANGE_RE = re.compile(r'bytes \*/(\d+)')
+MD5_ETAG_RE = re.compile(r'^(?:W/)?"?([0-9a-fA-F]{32})"?$')
+
+HASH_ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512')
+
+CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+
+# Bounds of the adaptive chunk size
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 2 * 1024 * 1024
+INITIAL_CHUNK_SIZE = 256 * 1024
+
+
+def parse_content_range(resp):
+    """
+    Parses the Content-Range header of a response.
+
+    :return: A tuple (start, end, total) with total None if unknown, or
+        None if the header is missing.
+    """
+
+    match = CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+    if match is None:
+        return None
+
+    total = match.group(3)
+    return (int(match.group(1)), int(match.group(2)),
+            None if total == '*' else int(total))
+
+
+def unsatisfied_range_size(resp):
+    """
+    Parses the Content-Range header of a 416 (Range Not Satisfiable)
+        response.
+
+    :return: The size of the file, or None if the header is missing.
+    """
+
+    match = UNSATISFIED_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+    if match is None:
+        return None
+
+    return int(match.group(1))
+
+
+def preallocate(fd, offset, length):
+    """
+    Reserves the disk space of a part of a file (posix_fallocate), so a
+        large file is allocated in few extents and a full disk is reported
+        before the download starts. The file is extended if needed.
+
+    :param fd: The file descriptor.
+    :type  fd: int
+    :param offset: The offset of the part.
+    :type  offset: int
+    :param length: The length of the part.
+    :type  length: int
+
+    :return: False if the platform or file system does not support it.
+    :rtype:  boolean
+    """
+
+    if length <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except OSError as err:
+        if err.errno in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            return False
+        raise
+
+    return True
+
+
+def _normalize_algorithm(name):
+
+    name = str(name).lower().replace('-', '')
+    return name if name in HASH_ALGORITHMS else None
+
+
+def _b64_to_hex(value):
+
+    try:
+        return base64.b64decode(value, validate=True).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+def item_checksums(item_info):
+    """
+    Gets the checksums and size provided by the item info of the DDS API,
+        if any ('md5', 'sha256', ... keys, a 'checksum' given as
+        '<algorithm>:<hex>' or as a dictionary with 'algorithm' and 'value',
+        and a 'size' or 'file_size').
+
+    :param item_info: The item info.
+    :type  item_info: dict
+
+    :return: A tuple (checksums, size): checksums maps hash algorithms to
+        hex digests; size is None if unknown.
+    :rtype:  tuple
+    """
+
+    checksums = {}
+
+    for algorithm in HASH_ALGORITHMS:
+        value = item_info.get(algorithm)
+        if isinstance(value, str) and value:
+            checksums[algorithm] = value.lower()
+
+    checksum = item_info.get('checksum')
+    if isinstance(checksum, dict):
+        algorithm = _normalize_algorithm(checksum.get('algorithm') or
+                                         checksum.get('type') or '')
+        if algorithm and checksum.get('value'):
+            checksums[algorithm] = str(checksum['value']).lower()
+    elif isinstance(checksum, str) and ':' in checksum:
+        algorithm, value = checksum.split(':', 1)
+        algorithm = _normalize_algorithm(algorithm)
+        if algorithm:
+            checksums[algorithm] = value.strip().lower()
+
+    size = item_info.get('size', item_info.get('file_size'))
+    try:
+        size = int(size) if size is not None else None
+    except (TypeError, ValueError):
+        size = None
+
+    return checksums, size
+
+
+def header_checksums(resp):
+    """
+    Gets the checksums of the whole file provided by the headers of a
+        response: 'x-amz-checksum-sha256'/'-sha1', 'Content-MD5' and
+        'Digest' (only on full 200 responses), and an ETag which is a plain
+        MD5 (single-part S3 uploads).
+
+    :return: A dictionary mapping hash algorithms to hex digests.
+    :rtype:  dict
+    """
+
+    checksums = {}
+    headers = resp.headers
+    # requests or aiohttp
+    status = getattr(resp, 'status_code', None) or getattr(resp, 'status',
+                                                           None)
+
+    if status == 200:
+        for algorithm in ('sha1', 'sha256'):
+            value = headers.get(f'x-amz-checksum-{algorithm}')
+            if value and _b64_to_hex(value):
+                checksums[algorithm] = _b64_to_hex(value)
+
+        if headers.get('Content-MD5') and \
+                _b64_to_hex(headers['Content-MD5']):
+            checksums['md5'] = _b64_to_hex(headers['Content-MD5'])
+
+        for digest in headers.get('Digest', '').split(','):
+            if '=' not in digest:
+                continue
+            algorithm, value = digest.strip().split('=', 1)
+            algorithm = _normalize_algorithm(algorithm)
+            if algorithm and _b64_to_hex(value):
+                checksums[algorithm] = _b64_to_hex(value)
+
+    match = MD5_ETAG_RE.match(headers.get('ETag', ''))
+    if match is not None and 'md5' not in checksums:
+        checksums['md5'] = match.group(1).lower()
+
+    return checksums
+
+
+class Checkpoint():
+
+    def __init__(self, fn):
+        """
+        Initializes a checkpoint which records the byte ranges of a partial
+            download that are already on disk, in a small JSON sidecar file.
+
+        :param fn: The filename of the checkpoint.
+        :type  fn: str
+        """
+
+        self.fn = fn
+        self.size = None
+        self.etag = None
+        self.completed = []
+
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Loads the checkpoint from disk.
+
+        :return: True if a checkpoint was loaded.
+        """
+
+        if not os.path.exists(self.fn):
+            return False
+
+        try:
+            with open(self.fn, 'r') as f:
+                vals = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.size = vals.get('size')
+        self.etag = vals.get('etag')
+        self.completed = [tuple(r) for r in vals.get('completed', [])]
+
+        return True
+
+    def save(self):
+        """
+        Saves the checkpoint to disk (atomically).
+        """
+
+        with self._lock:
+            vals = {
+                "size": self.size,
+                "etag": self.etag,
+                "completed": [list(r) for r in self.completed]
+            }
+
+            tmp_fn = f'{self.fn}.tmp'
+            with open(tmp_fn, 'w') as f:
+                json.dump(vals, f)
+            os.replace(tmp_fn, self.fn)
+
+    def remove(self):
+        """
+        Removes the checkpoint file.
+        """
+
+        if os.path.exists(self.fn):
+            os.remove(self.fn)
+
+    def reset(self, size=None, etag=None):
+        """
+        Forgets all completed ranges (ex: if the remote file changed).
+        """
+
+        with self._lock:
+            self.size = size
+            self.etag = etag
+            self.completed = []
+
+    def matches(self, size, etag):
+        """
+        Checks whether the checkpoint belongs to a remote file with the
+            given size and ETag (values which are unknown are ignored).
+        """
+
+        if size is not None and self.size is not None and size != self.size:
+            return False
+
+        if etag and self.etag and etag != self.etag:
+            return False
+
+        return True
+
+    def add(self, start, end):
+        """
+        Marks the inclusive byte range start-end as completed.
+        """
+
+        if end < start:
+            return
+
+        with self._lock:
+            ranges = sorted(self.completed + [(start, end)])
+            merged = [ranges[0]]
+            for r_start, r_end in ranges[1:]:
+                last_start, last_end = merged[-1]
+                if r_start <= last_end + 1:
+                    merged[-1] = (last_start, max(last_end, r_end))
+                else:
+                    merged.append((r_start, r_end))
+            self.completed = merged
+
+    def contiguous_bytes(self):
+        """
+        Returns the number of bytes completed from the start of the file.
+        """
+
+        with self._lock:
+            if self.completed and self.completed[0][0] == 0:
+                return self.completed[0][1] + 1
+
+        return 0
+
+    def missing(self, size):
+        """
+        Returns the inclusive byte ranges of a file of the given size which
+            have not been completed.
+        """
+
+        with self._lock:
+            missing = []
+            pos = 0
+            for start, end in self.completed:
+                if start > pos:
+                    missing.append((pos, min(start, size) - 1))
+                pos = max(pos, end + 1)
+            if pos < size:
+                missing.append((pos, size - 1))
+
+        return [r for r in missing if r[1] >= r[0]]
+
+
+class SegmentHasher():
+
+    def __init__(self, algorithms, read_at):
+        """
+        Initializes a hasher of a file whose ranges are written out of order
+            (ex: by parallel segments). The file is hashed in order as the
+            written prefix grows: a chunk written at the end of the prefix
+            is hashed as it is, and the chunks written ahead of it are read
+            back (from memory or the page cache, as they were just written)
+            once the prefix reaches them. The checksums are ready when the
+            last chunk is written, with no pass over the finished file.
+
+        :param algorithms: The hash algorithms.
+        :type  algorithms: list
+        :param read_at: A function reading back the given number of bytes
+            written at an offset (ex: Sink.read_at).
+        :type  read_at: function
+        """
+
+        self.hashers = {algorithm: hashlib.new(algorithm)
+                        for algorithm in algorithms}
+        self.read_at = read_at
+
+        # The number of bytes hashed
+        self.pos = 0
+
+        # The ranges (start, end) written past pos
+        self._pending = []
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def update(self, offset, chunk):
+        """
+        Records a chunk written at an offset, and hashes what it makes
+            contiguous. Thread-safe; the chunk is not kept.
+        """
+
+        self._record(offset, offset + len(chunk), chunk)
+
+    def add(self, offset, nbytes):
+        """
+        Records bytes already written at an offset (ex: by a previous
+            attempt), which are read back when the prefix reaches them.
+        """
+
+        if nbytes > 0:
+            self._record(offset, offset + nbytes, None)
+
+    def _record(self, start, end, chunk):
+
+        with self._lock:
+            if self._busy or start != self.pos or chunk is None:
+                heapq.heappush(self._pending, (start, end))
+                # A thread already hashing picks the range up
+                if self._busy:
+                    return
+                chunk = None
+            self._busy = True
+
+        try:
+            if chunk is not None:
+                self._hash(chunk)
+                with self._lock:
+                    self.pos = end
+            self._drain()
+        except BaseException:
+            with self._lock:
+                self._busy = False
+            raise
+
+    def _drain(self):
+
+        while True:
+            with self._lock:
+                while self._pending and self._pending[0][1] <= self.pos:
+                    heapq.heappop(self._pending)
+                if not self._pending or self._pending[0][0] > self.pos:
+                    self._busy = False
+                    return
+                start, end = self.pos, heapq.heappop(self._pending)[1]
+
+            while start < end:
+                data = self.read_at(start, min(end - start, MAX_CHUNK_SIZE))
+                if not len(data):
+                    raise DownloadError(f"Could not read back bytes "
+                                        f"{start}-{end - 1} to hash them")
+                self._hash(data)
+                start += len(data)
+
+            with self._lock:
+                self.pos = end
+
+    def _hash(self, data):
+
+        for hasher in self.hashers.values():
+            hasher.update(data)
+
+
+class Downloader():
+
+    def __init__(self, session, verify_ssl=True, segments=1,
+                 segment_size=None, resume=True, chunk_size=None,
+                 readinto=False, progress=True, progress_interval=0.5,
+                 on_chunk=None, verify=True, checksums=None,
+                 expected_size=None, verify_retries=1, preallocate=True,
+                 write_mode='pwrite', retry_policy=None, rate_limiter=None):
+        """
+        Initializes a Downloader which downloads files over a shared
+            requests Session, either as a single stream or as parallel
+            segments (HTTP Range requests).
+
+        Files are written to '<dest_fn>.part' and renamed once complete.
+            With resume, the ranges already written are recorded in
+            '<dest_fn>.part.json' so an interrupted download continues
+            where it stopped on the next attempt.
+
+        :param session: The requests Session.
+        :type  session: requests.Session
+        :param verify_ssl: Determines whether to verify SSL certificates.
+        :type  verify_ssl: boolean
+        :param segments: The number of segments downloaded in parallel. With
+            1 the file is downloaded as a single stream.
+        :type  segments: int
+        :param segment_size: The size of each segment in bytes. If None, the
+            file is split into 'segments' segments of equal size.
+        :type  segment_size: int
+        :param resume: Determines whether to continue a previous partial
+            download of the same file.
+        :type  resume: boolean
+        :param chunk_size: The number of bytes read per chunk. If None, the
+            chunk size adapts to the transfer speed (between 64 KB and
+            2 MB), so a fast link is read with few, large chunks.
+        :type  chunk_size: int
+        :param readinto: If True, read into a single reusable buffer
+            instead of allocating a new bytes object for each chunk.
+        :type  readinto: boolean
+        :param progress: Determines whether to show a progress bar.
+        :type  progress: boolean
+        :param progress_interval: The minimum number of seconds between
+            progress bar updates.
+        :type  progress_interval: float
+        :param on_chunk: A function called with the number of bytes of each
+            chunk once it is written (ex: to count or throttle transfers).
+        :type  on_chunk: function
+        :param verify: Determines whether to verify the size and checksums
+            of the file. Checksums are computed on the bytes as they are
+            written: a single stream chunk by chunk, and segments in file
+            order as the written prefix grows (see SegmentHasher). The part
+            already on disk is read again when a download is resumed.
+        :type  verify: boolean
+        :param checksums: Expected checksums (hash algorithm to hex digest),
+            ex: from the item info. Checksums from the response headers are
+            added to these.
+        :type  checksums: dict
+        :param expected_size: The expected size of the file in bytes.
+        :type  expected_size: int
+        :param verify_retries: The number of times a download which fails
+            verification is started over before IntegrityError is raised.
+        :type  verify_retries: int
+        :param preallocate: Determines whether to reserve the disk space of
+            the file before writing it (posix_fallocate, when supported).
+        :type  preallocate: boolean
+        :param write_mode: How parallel segments are written to the file:
+            'pwrite' (positional writes on a shared descriptor, no seek
+            pointer), 'mmap' (read straight into a memory map of the file)
+            or 'seek' (seek and write on a shared file object). 'pwrite'
+            falls back to 'seek' where it is not available (Windows).
+        :type  write_mode: str
+        :param retry_policy: The RetryPolicy for the download requests.
+            Downloads interrupted after their response arrived are resumed
+            up to its max_retries times, with its backoff. If None, nothing
+            is retried.
+        :type  retry_policy: retry.RetryPolicy
+        :param rate_limiter: The RateLimiter pacing the download requests
+            (each segment is one request).
+        :type  rate_limiter: ratelimit.RateLimiter
+        """
+
+        if write_mode not in ('pwrite', 'mmap', 'seek'):
+            raise ValueError(f"Invalid write_mode '{write_mode}'; must be "
+                             f"'pwrite', 'mmap' or 'seek'.")
+
+        self.session = session
+        self.verify_ssl = verify_ssl
+        self.segments = max(int(segments or 1), 1)
+        self.segment_size = segment_size
+        self.resume = resume
+        self.chunk_size = chunk_size
+        self.readinto = readinto
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.on_chunk = on_chunk
+        self.verify = verify
+        self.checksums = dict(checksums or {})
+        self.expected_size = expected_size
+        self.verify_retries = verify_retries
+        self.preallocate = preallocate
+        self.write_mode = write_mode
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+
+        # The checksums computed by the last download
+        self.digests = {}
+
+        # The bytes transferred, time and throughput of the last download
+        self.stats = {}
+        self._transferred = 0
+        self._stats_lock = threading.Lock()
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def download(self, url, dest_fn):
+        """
+        Downloads a URL to a file.
+
+        :param url: The download URL.
+        :type  url: str
+        :param dest_fn: The destination filename.
+        :type  dest_fn: str
+
+        :return: The destination filename.
+        :rtype:  str
+        """
+
+        part_fn = f'{dest_fn}.part'
+        checkpoint = Checkpoint(f'{part_fn}.json')
+        self.digests = {}
+        self._transferred = 0
+        start = time.perf_counter()
+
+        if not (self.resume and os.path.exists(part_fn) and
+                checkpoint.load()):
+            checkpoint.reset()
+
+        attempt = 0
+        while True:
+            try:
+                self._download_part_with_retries(url, part_fn, checkpoint)
+                break
+            except IntegrityError as err:
+                # The file on disk is bad; never resume from it
+                checkpoint.reset()
+                checkpoint.remove()
+                if os.path.exists(part_fn):
+                    os.remove(part_fn)
+
+                if attempt >= self.verify_retries:
+                    raise
+                attempt += 1
+                self.logger.warning(f"WARNING: {err}; downloading again "
+                                    f"(attempt {attempt + 1})...")
+
+        os.replace(part_fn, dest_fn)
+        checkpoint.remove()
+
+        self._record_stats(url, time.perf_counter() - start)
+
+        return dest_fn
+
+    def stream(self, url, target, name=None):
+        """
+        Streams a URL into a sink instead of a file path: an open binary
+            file object (ex: a pipe), a callable or a writable buffer (ex:
+            a bytearray or an mmap). There is no temporary file and no
+            resume; a download which fails verification is only retried if
+            the sink can be rewound.
+
+        Segmented downloads are used only for sinks which can be written at
+            any offset (seekable files and buffers). Their checksums are
+            verified if the sink can also be read back (buffers and files
+            opened for reading); otherwise a warning is logged and only
+            their size is verified.
+
+        :param url: The download URL.
+        :type  url: str
+        :param target: The sink or an object make_sink accepts.
+        :type  target: Sink, file object, function or buffer
+        :param name: The name shown on the progress bar.
+        :type  name: str
+
+        :return: The number of bytes written.
+        :rtype:  int
+        """
+
+        sink = make_sink(target)
+        name = name or os.path.basename(urlparse(url).path)
+        self.digests = {}
+        self._transferred = 0
+        start = time.perf_counter()
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    nbytes = self._stream_to_sink(url, sink, name)
+                    self._record_stats(url, time.perf_counter() - start)
+                    return nbytes
+                except IntegrityError as err:
+                    if attempt >= self.verify_retries or not sink.reset():
+                        raise
+                    attempt += 1
+                    self.logger.warning(f"WARNING: {err}; downloading again "
+                                        f"(attempt {attempt + 1})...")
+        finally:
+            # Only close sinks created here
+            if sink is not target:
+                sink.close()
+
+    def _stream_to_sink(self, url, sink, name):
+
+        size = None
+        if sink.seekable and (self.segments > 1 or self.segment_size):
+            size, etag = self.probe(url)
+
+        if size is not None:
+            self._verify_size(url, size)
+            checksums = self._known_checksums(etag) if self.verify else {}
+            if checksums and not sink.readable:
+                self.logger.warning(f"WARNING: The checksums of {url} can't "
+                                    f"be verified: its segments are written "
+                                    f"to a sink which can't be read back.")
+                checksums = {}
+
+            sink.open(size)
+            hasher = self._stream_segments(url, sink, name, size, checksums)
+            if hasher is not None:
+                self._verify_checksums(url, hasher.hashers, checksums)
+            return size
+
+        direct = isinstance(sink, BufferSink)
+
+        with self._get(url) as stream:
+            stream.raise_for_status()
+
+            size = stream.headers.get('Content-Length')
+            size = int(size) if size is not None else None
+
+            hashers = {}
+            if self.verify:
+                self._verify_size(url, size)
+                checksums = dict(self.checksums)
+                checksums.update(header_checksums(stream))
+                hashers = {algorithm: hashlib.new(algorithm)
+                           for algorithm in checksums}
+
+            sink.open(size)
+
+            pos = 0
+
+            def into(nbytes):
+                return sink.view_at(pos, nbytes)
+
+            with self._progress_bar(name, size, 0) as progress:
+                for chunk in self._iter_chunks(stream,
+                                               into if direct else None):
+                    if not direct:
+                        sink.write(chunk)
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+                    pos += len(chunk)
+                    progress.update(len(chunk))
+                    self._chunk_done(len(chunk))
+
+        if size is not None and pos != size:
+            raise IncompleteDownloadError(f"Download of {url} was "
+                                          f"incomplete ({pos} of {size} "
+                                          f"bytes)")
+
+        if hashers:
+            self._verify_checksums(url, hashers, checksums)
+
+        return pos
+
+    def _stream_segments(self, url, sink, name, size, checksums=None):
+
+        direct = isinstance(sink, BufferSink)
+        ranges = self._plan_segments([(0, size - 1)])
+        hasher = SegmentHasher(checksums, sink.read_at) if checksums \
+            else None
+
+        self.logger.info(f"Downloading {size} bytes in {len(ranges)} "
+                         f"segments with {self.segments} workers...")
+
+        progress = self._progress_bar(name, size, 0)
+        progress_lock = threading.Lock()
+
+        def fetch(byte_range):
+            start, end = byte_range
+            headers = {'Range': f'bytes={start}-{end}'}
+            with self._get(url, headers=headers) as resp:
+                resp.raise_for_status()
+                content_range = parse_content_range(resp)
+                if resp.status_code != 206 or content_range is None or \
+                        content_range[0] != start:
+                    raise DownloadError(f"Server did not return the range "
+                                        f"{start}-{end} of {url}")
+
+                pos = start
+
+                def into(nbytes):
+                    return sink.view_at(pos, min(nbytes, end + 1 - pos))
+
+                for chunk in self._iter_chunks(resp,
+                                               into if direct else None):
+                    if not direct:
+                        sink.write_at(pos, chunk)
+                    if hasher is not None:
+                        hasher.update(pos, chunk)
+                    pos += len(chunk)
+                    with progress_lock:
+                        progress.update(len(chunk))
+                    self._chunk_done(len(chunk))
+
+                if pos != end + 1:
+                    raise IncompleteDownloadError(f"Segment {start}-{end} "
+                                                  f"of {url} was incomplete")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.segments) as executor:
+                for _ in executor.map(fetch, ranges):
+                    pass
+        finally:
+            progress.close()
+
+        return hasher
+
+    def _download_part_with_retries(self, url, part_fn, checkpoint):
+
+        # The requests are retried by _get, which counts them against the
+        #   retry budget and the circuit breaker. Here only a download cut
+        #   off after its response arrived is resumed from the checkpoint,
+        #   so a failing request is never retried twice over
+        attempt = 0
+        while True:
+            try:
+                return self._download_part(url, part_fn, checkpoint)
+            except IncompleteDownloadError as err:
+                if self.retry_policy is None or \
+                        attempt >= self.retry_policy.max_retries:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                self.logger.warning(f"WARNING: {err}; resuming in "
+                                    f"{delay:.1f}s...")
+                self.retry_policy.sleep(delay)
+                attempt += 1
+
+    def _download_part(self, url, part_fn, checkpoint):
+
+        segmented = False
+        if self.segments > 1 or self.segment_size:
+            size, etag = self.probe(url)
+            if size is not None:
+                segmented = True
+            else:
+                self.logger.info("Server does not support range requests; "
+                                 "downloading as a single stream.")
+
+        if segmented:
+            self._verify_size(url, size)
+            checksums = self._known_checksums(etag) if self.verify else {}
+            hasher = self._download_segments(url, part_fn, size, etag,
+                                             checkpoint, checksums)
+            if hasher is not None:
+                self._verify_checksums(url, hasher.hashers, checksums)
+        else:
+            self._download_stream(url, part_fn, checkpoint)
+
+    def _get(self, url, headers=None):
+
+        # The shared session ignores the environment, so pass any proxy
+        #   settings along explicitly as requests.get() would
+        proxies = requests.utils.get_environ_proxies(url)
+
+        def send():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+            return self.session.get(url, headers=headers, stream=True,
+                                    proxies=proxies, verify=self.verify_ssl)
+
+        if self.retry_policy is None:
+            return send()
+
+        return self.retry_policy.call(send, url)
+
+    def probe(self, url):
+        """
+        Requests the first byte of the file to find out whether the server
+            supports range requests.
+
+        :return: A tuple (size, etag) with size None if ranges are not
+            supported.
+        """
+
+        with self._get(url, headers={'Range': 'bytes=0-0'}) as resp:
+            resp.raise_for_status()
+
+            etag = resp.headers.get('ETag')
+
+            if resp.status_code != 206 or \
+                    resp.headers.get('Accept-Ranges', 'bytes') == 'none':
+                return None, etag
+
+            content_range = parse_content_range(resp)
+            if content_range is None:
+                return None, etag
+
+            return content_range[2], etag
+
+    def _chunk_done(self, nbytes):
+
+        with self._stats_lock:
+            self._transferred += nbytes
+
+        if self.on_chunk is not None:
+            self.on_chunk(nbytes)
+
+    def _record_stats(self, url, seconds):
+        """
+        Records the bytes transferred (not counting resumed bytes), time
+            and throughput of a finished download in self.stats and in
+            metrics.registry.
+        """
+
+        rate = self._transferred / seconds if seconds > 0 else 0
+        self.stats = {
+            "bytes": self._transferred,
+            "seconds": seconds,
+            "bytes_per_second": rate
+        }
+
+        host = urlparse(url).netloc
+        metrics.inc('eodms_download_bytes_total', self._transferred,
+                    host=host)
+        metrics.observe('eodms_download_seconds', seconds, host=host)
+        metrics.set('eodms_download_bytes_per_second', rate, host=host)
+
+        self.logger.info(f"Downloaded {self._transferred} bytes in "
+                         f"{seconds:.1f}s ({rate / 1e6:.1f} MB/s).")
+
+    def _verify_size(self, url, size):
+
+        if self.verify and self.expected_size is not None and \
+                size is not None and size != self.expected_size:
+            raise IntegrityError(f"Size of {url} is {size} bytes; expected "
+                                 f"{self.expected_size} bytes")
+
+    def _verify_checksums(self, url, hashers, checksums):
+
+        self.digests = {algorithm: hasher.hexdigest()
+                        for algorithm, hasher in hashers.items()}
+
+        for algorithm, digest in self.digests.items():
+            if digest != checksums[algorithm]:
+                raise IntegrityError(f"{algorithm} checksum of {url} is "
+                                     f"{digest}; expected "
+                                     f"{checksums[algorithm]}")
+
+            self.logger.info(f"Verified {algorithm} checksum of the "
+                             f"download.")
+
+    def _verify_part(self, url, part_fn, size, etag=None):
+        """
+        Verifies the size and the known checksums of a complete part file
+            which was written without hashing it (ex: in segments). Of the
+            response headers, only an MD5 ETag is used.
+        """
+
+        if not self.verify:
+            return
+
+        self._verify_size(url, size)
+
+        checksums = self._known_checksums(etag)
+        if checksums:
+            hashers = {algorithm: hashlib.new(algorithm)
+                       for algorithm in checksums}
+            self._hash_prefix(part_fn, hashers, size)
+            self._verify_checksums(url, hashers, checksums)
+
+    def _known_checksums(self, etag=None):
+        """
+        Gets the expected checksums of a file whose full response is not
+            seen (ex: segments): the given ones and an MD5 ETag.
+        """
+
+        checksums = dict(self.checksums)
+        match = MD5_ETAG_RE.match(etag or '')
+        if match is not None and 'md5' not in checksums:
+            checksums['md5'] = match.group(1).lower()
+
+        return checksums
+
+    def _hash_prefix(self, part_fn, hashers, nbytes):
+        """
+        Hashes the first nbytes of a resumed partial file.
+        """
+
+        with open(part_fn, 'rb') as f:
+            while nbytes > 0:
+                chunk = f.read(min(nbytes, MAX_CHUNK_SIZE))
+                if not chunk:
+                    break
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+                nbytes -= len(chunk)
+
+    def _progress_bar(self, name, total, initial):
+
+        return tqdm(total=total, initial=initial, unit='B', unit_scale=True,
+                    desc=name,
+                    mininterval=self.progress_interval,
+                    disable=not self.progress)
+
+    def _iter_chunks(self, resp, into=None):
+        """
+        Yields the body of a streamed response in chunks.
+
+        If a fixed chunk_size is not set, the chunk size is doubled while
+            chunks arrive faster than 10 ms and halved when they take more
+            than 250 ms. With readinto, chunks are memoryview slices of a
+            buffer which is reused for the next chunk, so they must be
+            consumed before the next one is requested.
+
+        :param into: A function returning the memoryview the next chunk of
+            the given size is read into (ex: the matching part of a
+            destination buffer), instead of an internal buffer.
+        :type  into: function
+        """
+
+        raw = resp.raw
+        raw.decode_content = True
+
+        adaptive = not self.chunk_size
+        chunk_size = self.chunk_size or INITIAL_CHUNK_SIZE
+
+        buffer = None
+        view = None
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                if into is not None:
+                    view = into(chunk_size)
+                    if not len(view):
+                        if raw.read(1):
+                            raise DownloadError("The response is larger "
+                                                "than its destination")
+                        break
+                    nbytes = raw.readinto(view)
+                    chunk = view[:nbytes]
+                elif self.readinto:
+                    if buffer is None or len(buffer) < chunk_size:
+                        buffer = bytearray(chunk_size)
+                        view = memoryview(buffer)
+                    nbytes = raw.readinto(view[:chunk_size])
+                    chunk = view[:nbytes]
+                else:
+                    chunk = raw.read(chunk_size)
+                    nbytes = len(chunk)
+            except (urllib3.exceptions.ProtocolError,
+                    urllib3.exceptions.ReadTimeoutError) as err:
+                # The request itself succeeded, so this is not retried as a
+                #   request but resumed as a download
+                raise IncompleteDownloadError(f"Download was interrupted: "
+                                              f"{err}") from err
+
+            if not nbytes:
+                break
+
+            yield chunk
+
+            if adaptive and nbytes == chunk_size:
+                elapsed = time.perf_counter() - start
+                if elapsed < 0.01:
+                    chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+                elif elapsed > 0.25:
+                    chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+
+    def _plan_segments(self, ranges):
+        """
+        Splits the given byte ranges into segments.
+        """
+
+        if self.segment_size:
+            segment_size = int(self.segment_size)
+        else:
+            total = sum(end - start + 1 for start, end in ranges)
+            segment_size = -(-total // self.segments)
+
+        segment_size = max(segment_size, 1)
+
+        segments = []
+        for start, end in ranges:
+            for seg_start in range(start, end + 1, segment_size):
+                segments.append((seg_start,
+                                 min(seg_start + segment_size - 1, end)))
+
+        return segments
+
+    def _download_stream(self, url, part_fn, checkpoint):
+
+        offset = checkpoint.contiguous_bytes()
+        if offset and offset == checkpoint.size:
+            # The part file is complete (ex: the download was interrupted
+            #   before the rename), so only verify it
+            return self._verify_part(url, part_fn, offset, checkpoint.etag)
+
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+
+        with self._get(url, headers=headers) as stream:
+            if stream.status_code == 416 and offset:
+                if unsatisfied_range_size(stream) == offset and \
+                        checkpoint.matches(offset, None):
+                    # Nothing left to download
+                    return self._verify_part(url, part_fn, offset,
+                                             checkpoint.etag)
+
+                # The part file is larger than the remote file, start over
+                stream.close()
+                checkpoint.reset()
+                return self._download_stream(url, part_fn, checkpoint)
+
+            stream.raise_for_status()
+
+            etag = stream.headers.get('ETag')
+            content_range = parse_content_range(stream)
+
+            if stream.status_code == 206 and content_range is not None:
+                size = content_range[2]
+                if content_range[0] != offset or \
+                        not checkpoint.matches(size, etag):
+                    # The remote file changed, start over
+                    stream.close()
+                    checkpoint.reset()
+                    return self._download_stream(url, part_fn, checkpoint)
+                self.logger.info(f"Resuming download at byte {offset}...")
+            else:
+                offset = 0
+                size = stream.headers.get('Content-Length')
+                size = int(size) if size is not None else None
+
+            checkpoint.reset(size, etag)
+            checkpoint.add(0, offset - 1)
+
+            hashers = {}
+            if self.verify:
+                self._verify_size(url, size)
+                checksums = dict(self.checksums)
+                checksums.update(header_checksums(stream))
+                hashers = {algorithm: hashlib.new(algorithm)
+                           for algorithm in checksums}
+                if hashers and offset:
+                    self._hash_prefix(part_fn, hashers, offset)
+
+            name = os.path.basename(part_fn)[:-5]
+            with open(part_fn, 'r+b' if offset else 'wb') as file_out, \
+                    self._progress_bar(name, size, offset) as progress:
+                file_out.seek(offset)
+                file_out.truncate()
+                if self.preallocate and size is not None:
+                    preallocate(file_out.fileno(), offset, size - offset)
+
+                pos = offset
+                last_saved = pos
+                try:
+                    for chunk in self._iter_chunks(stream):
+                        file_out.write(chunk)
+                        for hasher in hashers.values():
+                            hasher.update(chunk)
+                        pos += len(chunk)
+                        progress.update(len(chunk))
+                        self._chunk_done(len(chunk))
+
+                        if pos - last_saved >= CHECKPOINT_INTERVAL:
+                            file_out.flush()
+                            checkpoint.add(offset, pos - 1)
+                            checkpoint.save()
+                            last_saved = pos
+                finally:
+                    file_out.flush()
+                    checkpoint.add(offset, pos - 1)
+                    checkpoint.save()
+
+        if size is not None and pos != size:
+            raise IncompleteDownloadError(f"Download of {url} was "
+                                          f"incomplete ({pos} of {size} "
+                                          f"bytes)")
+
+        if hashers:
+            self._verify_checksums(url, hashers, checksums)
+
+    @contextmanager
+    def _open_part(self, part_fn, size):
+        """
+        Opens a preallocated part file as a sink which segments are written
+            to at their offsets, according to write_mode.
+        """
+
+        if self.write_mode == 'mmap' and size:
+            with open(part_fn, 'r+b') as f:
+                mm = mmap.mmap(f.fileno(), size)
+            sink = BufferSink(mm)
+            try:
+                yield sink
+            finally:
+                sink.close()
+                try:
+                    mm.close()
+                except BufferError:
+                    # A chunk is still referenced (ex: by a traceback); the
+                    #   map is closed once it is garbage collected
+                    pass
+
+        elif self.write_mode == 'pwrite' and hasattr(os, 'pwrite'):
+            fd = os.open(part_fn, os.O_RDWR)
+            try:
+                yield PwriteSink(fd)
+            finally:
+                os.close(fd)
+
+        else:
+            with open(part_fn, 'r+b') as f:
+                sink = FileObjectSink(f)
+                try:
+                    yield sink
+                finally:
+                    sink.close()
+
+    def _download_segments(self, url, part_fn, size, etag, checkpoint,
+                           checksums=None):
+        """
+        Downloads the missing ranges of a part file in parallel segments.
+            With checksums, the file is hashed as it is written (the ranges
+            of a previous attempt are read back).
+
+        :return: The SegmentHasher (None without checksums).
+        :rtype:  SegmentHasher
+        """
+
+        if not checkpoint.matches(size, etag) or \
+                not os.path.exists(part_fn) or \
+                os.path.getsize(part_fn) != size:
+            checkpoint.reset()
+
+        if not checkpoint.completed:
+            # Preallocate the file so each segment can be written at its
+            #   offset
+            with open(part_fn, 'wb') as f:
+                if not (self.preallocate and
+                        preallocate(f.fileno(), 0, size)):
+                    f.truncate(size)
+
+        checkpoint.size = size
+        checkpoint.etag = etag
+        checkpoint.save()
+
+        missing = checkpoint.missing(size)
+        ranges = self._plan_segments(missing)
+        done = size - sum(end - start + 1 for start, end in missing)
+
+        if done:
+            self.logger.info(f"Resuming download ({done} of {size} bytes "
+                             f"already downloaded)...")
+
+        self.logger.info(f"Downloading {size - done} bytes in {len(ranges)} "
+                         f"segments with {self.segments} workers...")
+
+        progress = self._progress_bar(os.path.basename(part_fn)[:-5], size,
+                                      done)
+        progress_lock = threading.Lock()
+
+        def fetch(sink, byte_range):
+            start, end = byte_range
+            headers = {'Range': f'bytes={start}-{end}'}
+            with self._get(url, headers=headers) as resp:
+                resp.raise_for_status()
+                content_range = parse_content_range(resp)
+                if resp.status_code != 206 or content_range is None or \
+                        content_range[0] != start:
+                    raise DownloadError(f"Server did not return the range "
+                                        f"{start}-{end} of {url}")
+
+                direct = isinstance(sink, BufferSink)
+                pos = start
+                last_saved = pos
+
+                def into(nbytes):
+                    return sink.view_at(pos, min(nbytes, end + 1 - pos))
+
+                try:
+                    for chunk in self._iter_chunks(resp,
+                                                   into if direct else None):
+                        if not direct:
+                            sink.write_at(pos, chunk)
+                        if hasher is not None:
+                            hasher.update(pos, chunk)
+                        pos += len(chunk)
+                        with progress_lock:
+                            progress.update(len(chunk))
+                        self._chunk_done(len(chunk))
+
+                        if pos - last_saved >= CHECKPOINT_INTERVAL:
+                            sink.flush()
+                            checkpoint.add(last_saved, pos - 1)
+                            checkpoint.save()
+                            last_saved = pos
+                finally:
+                    sink.flush()
+                    checkpoint.add(last_saved, pos - 1)
+
+                if pos != end + 1:
+                    raise IncompleteDownloadError(f"Segment {start}-{end} "
+                                                  f"of {url} was incomplete")
+
+        hasher = None
+        try:
+            with self._open_part(part_fn, size) as sink, \
+                    ThreadPoolExecutor(max_workers=self.segments) as executor:
+                if checksums:
+                    hasher = SegmentHasher(checksums, sink.read_at)
+                    for start, end in checkpoint.completed:
+                        hasher.add(start, end - start + 1)
+                for _ in executor.map(lambda r: fetch(sink, r), ranges):
+                    pass
+        finally:
+            progress.close()
+            checkpoint.save()
+
+        return hasher
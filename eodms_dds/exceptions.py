@@ -0,0 +1,101 @@
+class EODMSError(Exception):
+    """
+    Base class for errors raised by the eodms_dds package.
+    """
+
+
+class DDSError(EODMSError):
+
+    def __init__(self, message, status_code=None, error=None,
+                 request_id=None, trace_id=None, response=None):
+        """
+        Initializes an error returned by the DDS API.
+
+        :param message: The error message.
+        :param status_code: The HTTP status code of the response.
+        :param error: The error name returned by the DDS API.
+        :param request_id: The request_id returned by the DDS API.
+        :param trace_id: The trace_id returned by the DDS API.
+        :param response: The requests Response (if any).
+        """
+
+        super().__init__(message)
+
+        self.message = message
+        self.status_code = status_code
+        self.error = error
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.response = response
+
+    @classmethod
+    def from_response(cls, resp):
+        """
+        Creates a DDSError from a failed response.
+
+        :param resp: The requests Response.
+        """
+
+        try:
+            err_json = resp.json()
+        except ValueError:
+            return cls(f"HTTP {resp.status_code} (non-JSON response)",
+                       status_code=resp.status_code, response=resp)
+
+        return cls(err_json.get('message') or f"HTTP {resp.status_code}",
+                   status_code=resp.status_code,
+                   error=err_json.get('error'),
+                   request_id=err_json.get('request_id'),
+                   trace_id=err_json.get('trace_id'),
+                   response=resp)
+
+    def __str__(self):
+        if self.error:
+            return f"{self.status_code} {self.error}: {self.message}"
+        return self.message
+
+
+class DownloadError(EODMSError):
+    """
+    Raised when a download could not be completed.
+    """
+
+
+class IntegrityError(DownloadError):
+    """
+    Raised when a downloaded file does not match its expected size or
+        checksum.
+    """
+
+
+class IncompleteDownloadError(DownloadError):
+    """
+    Raised when the connection ended before a download (or one of its
+        segments) was complete. The bytes received are kept, so the
+        download can be resumed.
+    """
+
+
+class CircuitOpenError(EODMSError):
+
+    def __init__(self, endpoint, retry_in):
+        """
+        Initializes an error raised instead of sending a request to an
+            endpoint whose circuit breaker is open after repeated failures.
+
+        :param endpoint: The endpoint.
+        :param retry_in: The number of seconds before requests are allowed
+            again.
+        """
+
+        super().__init__(f"Requests to {endpoint} are suspended after "
+                         f"repeated failures (retry in {retry_in:.1f}s)")
+
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class SearchError(DDSError):
+    """
+    Raised when a request to the search API (OGC API - Features) fails.
+    """
@@ -0,0 +1,335 @@
+import json
+import math
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .search import parse_interval
+
+_NO_BBOX = (math.nan, math.nan, math.nan, math.nan)
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def _timestamp(properties):
+
+    value = properties.get('datetime') or properties.get('start_datetime')
+    if not value:
+        return math.nan
+
+    try:
+        return parse_interval(value)[0].timestamp()
+    except (ValueError, AttributeError):
+        return math.nan
+
+
+def _geometry_bbox(geometry):
+    """
+    Gets the bbox (west, south, east, north) of a GeoJSON geometry.
+    """
+
+    if not geometry:
+        return _NO_BBOX
+
+    xs = []
+    ys = []
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for part in coords:
+                walk(part)
+
+    if geometry.get('type') == 'GeometryCollection':
+        boxes = [_geometry_bbox(part) for part in geometry['geometries']]
+        boxes = [box for box in boxes if not math.isnan(box[0])]
+        if not boxes:
+            return _NO_BBOX
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+    walk(geometry.get('coordinates') or [])
+    if not xs:
+        return _NO_BBOX
+
+    return float(min(xs)), float(min(ys)), float(max(xs)), float(max(ys))
+
+
+class Feature():
+    """
+    A compact search result. The id, collection, datetime and bbox are kept
+        as plain attributes; the geometry and properties are kept as
+        encoded JSON and only decoded when they are first used.
+    """
+
+    __slots__ = ('id', 'collection', 'timestamp', 'bbox', '_geometry',
+                 '_properties')
+
+    def __init__(self, id, collection=None, timestamp=math.nan,
+                 bbox=_NO_BBOX, geometry=None, properties=None):
+        """
+        Initializes a feature (usually created with Feature.from_dict).
+
+        :param id: The feature Id.
+        :type  id: str
+        :param collection: The Collection Id.
+        :type  collection: str
+        :param timestamp: The acquisition datetime as a POSIX timestamp
+            (nan if unknown).
+        :type  timestamp: float
+        :param bbox: The bounding box (west, south, east, north).
+        :type  bbox: tuple
+        :param geometry: The GeoJSON geometry, decoded or encoded.
+        :type  geometry: dict or bytes
+        :param properties: The properties, decoded or encoded.
+        :type  properties: dict or bytes
+        """
+
+        self.id = id
+        self.collection = collection
+        self.timestamp = timestamp
+        self.bbox = bbox
+        self._geometry = geometry
+        self._properties = properties
+
+    @classmethod
+    def from_dict(cls, feature, collection=None):
+        """
+        Creates a compact feature from a GeoJSON feature (or STAC item)
+            dictionary.
+
+        :param feature: The feature.
+        :type  feature: dict
+        :param collection: The Collection Id (defaults to the 'collection'
+            of the feature).
+        :type  collection: str
+
+        :rtype: Feature
+        """
+
+        geometry = feature.get('geometry')
+        properties = feature.get('properties') or {}
+
+        bbox = feature.get('bbox')
+        if bbox and len(bbox) >= 6:
+            bbox = (bbox[0], bbox[1], bbox[3], bbox[4])
+        bbox = tuple(float(coord) for coord in bbox[:4]) if bbox \
+            else _geometry_bbox(geometry)
+
+        return cls(feature.get('id'),
+                   collection or feature.get('collection'),
+                   _timestamp(properties), bbox,
+                   _encode(geometry) if geometry is not None else None,
+                   _encode(properties))
+
+    @property
+    def geometry(self):
+        if isinstance(self._geometry, bytes):
+            self._geometry = json.loads(self._geometry)
+        return self._geometry
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = {}
+        elif isinstance(self._properties, bytes):
+            self._properties = json.loads(self._properties)
+        return self._properties
+
+    @property
+    def datetime(self):
+        if math.isnan(self.timestamp):
+            return None
+        return datetime.fromtimestamp(self.timestamp, timezone.utc)
+
+    def get(self, name, default=None):
+        """
+        Gets a property.
+        """
+
+        return self.properties.get(name, default)
+
+    def _peek_properties(self):
+        # Decodes the properties without keeping them decoded
+        if isinstance(self._properties, bytes):
+            return json.loads(self._properties)
+        return self._properties or {}
+
+    def to_dict(self):
+        """
+        Returns the feature as a GeoJSON dictionary.
+
+        :rtype: dict
+        """
+
+        feature = {'type': 'Feature', 'id': self.id,
+                   'geometry': self.geometry,
+                   'properties': self.properties}
+        if not math.isnan(self.bbox[0]):
+            feature['bbox'] = list(self.bbox)
+        if self.collection is not None:
+            feature['collection'] = self.collection
+
+        return feature
+
+    def __getstate__(self):
+        # Keep pickles (ex: to worker processes) in the compact form
+        return (self.id, self.collection, self.timestamp, self.bbox,
+                _encode(self._geometry)
+                if isinstance(self._geometry, dict) else self._geometry,
+                _encode(self._properties)
+                if isinstance(self._properties, dict) else self._properties)
+
+    def __setstate__(self, state):
+        (self.id, self.collection, self.timestamp, self.bbox,
+         self._geometry, self._properties) = state
+
+    def __repr__(self):
+        return f"Feature({self.id!r}, {self.collection!r})"
+
+
+class FeatureSet():
+
+    def __init__(self, features=(), collection=None):
+        """
+        Initializes a list of compact features. The features can be
+            dictionaries (ex: SearchAPI.features), which are converted one
+            at a time, so a search generator is never held in memory in
+            full.
+
+        :param features: The features.
+        :type  features: iterable of dict or Feature
+        :param collection: The Collection Id of dictionaries without one.
+        :type  collection: str
+        """
+
+        self.collection = collection
+        self.features = []
+        self.extend(features)
+
+    def extend(self, features):
+
+        for feature in features:
+            if not isinstance(feature, Feature):
+                feature = Feature.from_dict(feature, self.collection)
+            self.features.append(feature)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __iter__(self):
+        return iter(self.features)
+
+    def __getitem__(self, key):
+        """
+        Gets a feature by position, or a FeatureSet from a slice, a list of
+            positions or a boolean mask (ex: computed on the columns).
+        """
+
+        if isinstance(key, slice):
+            return self._subset(self.features[key])
+
+        if np is not None and isinstance(key, np.ndarray):
+            if key.dtype == bool:
+                key = np.flatnonzero(key)
+            return self._subset([self.features[index] for index in key])
+
+        if isinstance(key, (list, tuple)):
+            if key and all(isinstance(value, bool) for value in key):
+                return self._subset([feature for feature, keep
+                                     in zip(self.features, key) if keep])
+            return self._subset([self.features[index] for index in key])
+
+        return self.features[key]
+
+    def _subset(self, features):
+
+        subset = FeatureSet(collection=self.collection)
+        subset.features = features
+
+        return subset
+
+    def to_columns(self, properties=(), numpy=None):
+        """
+        Exports the features as columns:
+
+        - 'id': the Ids;
+        - 'collection': the Collection Ids;
+        - 'datetime': the datetimes (datetime64[ms], NaT if unknown, with
+          NumPy; POSIX timestamps, nan if unknown, otherwise);
+        - 'bbox': the bboxes, as an (n, 4) array with NumPy and as a flat
+          array of 4 * n values otherwise (nan if unknown);
+        - each of the given properties (None where missing).
+
+        :param properties: The names of the properties to export.
+        :type  properties: list
+        :param numpy: Whether to return NumPy arrays (by default, if NumPy
+            is installed) or lists and array.array.
+        :type  numpy: boolean
+
+        :rtype: dict
+        """
+
+        if numpy is None:
+            numpy = np is not None
+        elif numpy and np is None:
+            raise ImportError("Columns as arrays require the numpy package. "
+                              "Install it with 'pip install "
+                              "py-eodms-dds[numpy]'.")
+
+        features = self.features
+
+        timestamps = array('d', (feature.timestamp for feature in features))
+        bboxes = array('d')
+        for feature in features:
+            bboxes.extend(feature.bbox)
+
+        columns = {
+            'id': [feature.id for feature in features],
+            'collection': [feature.collection for feature in features],
+            'datetime': timestamps,
+            'bbox': bboxes
+        }
+        if properties:
+            values = [[] for _ in properties]
+            for feature in features:
+                feature_properties = feature._peek_properties()
+                for name, column in zip(properties, values):
+                    column.append(feature_properties.get(name))
+            columns.update(zip(properties, values))
+
+        if not numpy:
+            return columns
+
+        seconds = np.frombuffer(timestamps, dtype=np.float64) \
+            if len(timestamps) else np.empty(0)
+        millis = np.full(len(seconds), np.iinfo(np.int64).min,
+                         dtype=np.int64)
+        known = ~np.isnan(seconds)
+        millis[known] = np.round(seconds[known] * 1000)
+
+        columns['id'] = np.array(columns['id'], dtype=object)
+        columns['collection'] = np.array(columns['collection'],
+                                         dtype=object)
+        columns['datetime'] = millis.view('datetime64[ms]')
+        columns['bbox'] = np.frombuffer(bboxes, dtype=np.float64) \
+            .reshape(-1, 4).copy() if len(bboxes) else np.empty((0, 4))
+
+        for name in properties:
+            values = columns[name]
+            if any(value is None for value in values) or \
+                    any(isinstance(value, (dict, list)) for value in values):
+                columns[name] = np.array(values + [None],
+                                         dtype=object)[:-1]
+            else:
+                columns[name] = np.array(values)
+
+        return columns
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_registry_lock = threading.Lock()
+_named_locks = {}
+
+
+def get_named_lock(name):
+    """
+    Returns the process-wide lock registered under a name, creating it
+        if needed. Every caller using the same name shares the same lock.
+
+    :param name: The name of the lock (ex: the path of a credentials file).
+    :type  name: str
+    """
+
+    with _registry_lock:
+        lock = _named_locks.get(name)
+        if lock is None:
+            lock = threading.RLock()
+            _named_locks[name] = lock
+
+        return lock
+
+
+class FileLock():
+
+    def __init__(self, path, timeout=None, poll_interval=0.05):
+        """
+        Initializes an exclusive lock shared by all processes on a node
+            through a lock file.
+
+        :param path: The path of the lock file.
+        :type  path: str
+        :param timeout: The maximum number of seconds to wait for the lock
+            (None waits forever).
+        :type  timeout: float
+        :param poll_interval: The number of seconds between attempts.
+        :type  poll_interval: float
+        """
+
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        self._fd = None
+
+    def acquire(self):
+        """
+        Acquires the lock, waiting for other processes to release it.
+        """
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        start = time.monotonic()
+        while True:
+            try:
+                self._lock_fd(fd)
+                break
+            except OSError:
+                if self.timeout is not None and \
+                        time.monotonic() - start >= self.timeout:
+                    os.close(fd)
+                    raise TimeoutError(f"Could not acquire lock on "
+                                       f"{self.path} within "
+                                       f"{self.timeout} seconds.")
+                time.sleep(self.poll_interval)
+
+        self._fd = fd
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+
+        if self._fd is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def _lock_fd(self, fd):
+
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
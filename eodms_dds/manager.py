@@ -0,0 +1,295 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from . import api_logger
+from .download import Downloader
+from .ratelimit import TokenBucket
+
+
+class DownloadJob():
+
+    def __init__(self, collection, item_uuid, priority=0, catalog="EODMS"):
+        """
+        Initializes a download job for one item.
+
+        :param collection: The Collection Id.
+        :param item_uuid: The UUID of the item.
+        :param priority: The user-defined priority (lower runs first).
+        :param catalog: The catalog name.
+        """
+
+        self.collection = collection
+        self.item_uuid = item_uuid
+        self.priority = priority
+        self.catalog = catalog
+
+        self.item_info = None
+        self.size = None
+        self.filename = None
+        self.status = 'pending'
+        self.error = None
+        self.bytes = 0
+        self.elapsed = None
+
+    def __repr__(self):
+        return (f"DownloadJob(item_uuid={self.item_uuid}, "
+                f"status={self.status})")
+
+
+class DownloadManager():
+
+    def __init__(self, dds_api, out_folder, max_transfers=4,
+                 max_bandwidth=None, max_per_host=None, order='priority',
+                 resolve_workers=4, start_early=False, **download_kwargs):
+        """
+        Initializes a manager which downloads a queue of items with a
+            limited number of parallel transfers.
+
+        :param dds_api: The DDS_API instance.
+        :type  dds_api: DDS_API
+        :param out_folder: The output folder.
+        :type  out_folder: str
+        :param max_transfers: The maximum number of parallel transfers.
+        :type  max_transfers: int
+        :param max_bandwidth: The maximum total bandwidth in bytes per
+            second over all transfers (None for no limit).
+        :type  max_bandwidth: float
+        :param max_per_host: The maximum number of parallel transfers to a
+            single download host (None for no limit).
+        :type  max_per_host: int
+        :param order: The order in which items are downloaded: 'priority'
+            (the job priority), 'smallest' or 'largest' (by file size).
+            Ties are broken by the job priority, then by the order the jobs
+            were added.
+        :type  order: str
+        :param resolve_workers: The number of workers getting item info
+            (and, for 'smallest' or 'largest', probing the file sizes).
+        :type  resolve_workers: int
+        :param start_early: If False, every item is resolved before the
+            first transfer starts, so the order holds over all the items.
+            If True, transfers start as soon as items are resolved, which
+            overlaps the two but only orders the items resolved so far.
+        :type  start_early: boolean
+        :param download_kwargs: Other arguments passed to
+            DDS_API.download_item (ex: segments, resume).
+        """
+
+        if order not in ('priority', 'smallest', 'largest'):
+            raise ValueError(f"Invalid order '{order}'; must be 'priority', "
+                             f"'smallest' or 'largest'.")
+
+        self.dds_api = dds_api
+        self.out_folder = os.path.abspath(out_folder)
+        self.max_transfers = max_transfers
+        self.max_per_host = max_per_host
+        self.order = order
+        self.resolve_workers = resolve_workers
+        self.start_early = start_early
+
+        download_kwargs.setdefault('progress', False)
+        self.download_kwargs = download_kwargs
+
+        # Keep the burst short so the cap holds over short windows too
+        self.bandwidth = TokenBucket(max_bandwidth, max_bandwidth / 4) \
+            if max_bandwidth else None
+
+        self.jobs = []
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._bytes = 0
+        self._start = None
+        self._end = None
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def add(self, collection, item_uuid, priority=0, catalog="EODMS"):
+        """
+        Adds an item to the queue.
+
+        :return: The DownloadJob.
+        :rtype:  DownloadJob
+        """
+
+        job = DownloadJob(collection, item_uuid, priority, catalog)
+        self.jobs.append(job)
+
+        return job
+
+    def run(self):
+        """
+        Gets the info of every queued item and downloads the items which are
+            ready in the chosen order, keeping up to max_transfers
+            downloads running.
+        Items still being processed by the DDS get the status 'processing'
+            and failed items the status 'failed' (with the error in
+            job.error).
+
+        :return: The list of DownloadJobs.
+        :rtype:  list
+        """
+
+        jobs = [job for job in self.jobs if job.status == 'pending']
+        ready = queue.PriorityQueue()
+
+        self._start = time.monotonic()
+        self._end = None
+
+        workers = [threading.Thread(target=self._transfer_worker,
+                                    args=(ready,), daemon=True)
+                   for _ in range(self.max_transfers)]
+        if self.start_early:
+            for worker in workers:
+                worker.start()
+
+        with ThreadPoolExecutor(max_workers=self.resolve_workers) as executor:
+            futures = [executor.submit(self._resolve, job) for job in jobs]
+            for future in as_completed(futures):
+                job = future.result()
+                if job.status == 'ready':
+                    ready.put((self._sort_key(job), next(self._counter), job))
+
+        if not self.start_early:
+            for worker in workers:
+                worker.start()
+
+        for _ in workers:
+            ready.put(((float('inf'),), next(self._counter), None))
+        for worker in workers:
+            worker.join()
+
+        self._end = time.monotonic()
+
+        stats = self.stats()
+        self.logger.info(f"Downloaded {stats['downloaded']} items "
+                         f"({stats['bytes']} bytes at "
+                         f"{stats['bytes_per_second'] / 1e6:.1f} MB/s); "
+                         f"{stats['processing']} still processing, "
+                         f"{stats['failed']} failed.")
+
+        return self.jobs
+
+    def stats(self):
+        """
+        Returns the aggregate statistics of the transfers.
+
+        :rtype: dict
+        """
+
+        end = self._end if self._end is not None else time.monotonic()
+        elapsed = end - self._start if self._start is not None else 0
+
+        counts = {}
+        for job in self.jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+
+        return {
+            "bytes": self._bytes,
+            "elapsed": elapsed,
+            "bytes_per_second": self._bytes / elapsed if elapsed else 0,
+            "downloaded": counts.get('downloaded', 0),
+            "processing": counts.get('processing', 0),
+            "failed": counts.get('failed', 0),
+            "pending": counts.get('pending', 0) + counts.get('ready', 0)
+        }
+
+    def _resolve(self, job):
+
+        try:
+            job.item_info = self.dds_api.fetch_item(job.collection,
+                                                    job.item_uuid,
+                                                    job.catalog)
+        except Exception as err:
+            job.status = 'failed'
+            job.error = err
+            return job
+
+        if not job.item_info.get('download_url'):
+            job.status = 'processing'
+            return job
+
+        if self.order != 'priority':
+            try:
+                downloader = Downloader(
+                    self.dds_api.session, self.dds_api.verify_ssl,
+                    retry_policy=self.dds_api.retry_policy,
+                    rate_limiter=self.dds_api.rate_limiter)
+                job.size = downloader.probe(job.item_info['download_url'])[0]
+            except Exception as err:
+                self.logger.warning(f"WARNING: Could not get the size of "
+                                    f"{job.item_uuid}: {err}")
+
+        job.status = 'ready'
+
+        return job
+
+    def _sort_key(self, job):
+
+        if self.order == 'priority':
+            return (job.priority,)
+
+        # Items with an unknown size go last
+        if job.size is None:
+            return (1, 0, job.priority)
+
+        size = job.size if self.order == 'smallest' else -job.size
+        return (0, size, job.priority)
+
+    def _host_limit(self, url):
+
+        host = urlparse(url).netloc
+        with self._lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = threading.Semaphore(self.max_per_host)
+                self._host_limits[host] = limit
+
+            return limit
+
+    def _on_chunk(self, job, nbytes):
+
+        # Segments of one job report their chunks from several threads
+        with self._lock:
+            self._bytes += nbytes
+            job.bytes += nbytes
+
+        if self.bandwidth is not None:
+            self.bandwidth.consume(nbytes)
+
+    def _transfer_worker(self, ready):
+
+        while True:
+            _, _, job = ready.get()
+            if job is None:
+                return
+
+            download_url = job.item_info['download_url']
+            host_limit = self._host_limit(download_url) \
+                if self.max_per_host else None
+
+            if host_limit is not None:
+                host_limit.acquire()
+
+            start = time.monotonic()
+            try:
+                job.filename = self.dds_api.download_item(
+                    self.out_folder, item_info=job.item_info,
+                    item_uuid=job.item_uuid,
+                    on_chunk=lambda nbytes: self._on_chunk(job, nbytes),
+                    **self.download_kwargs)
+                job.status = 'downloaded'
+            except Exception as err:
+                self.logger.error(f"Failed to download {job.item_uuid}: "
+                                  f"{err}")
+                job.status = 'failed'
+                job.error = err
+            finally:
+                job.elapsed = time.monotonic() - start
+                if host_limit is not None:
+                    host_limit.release()
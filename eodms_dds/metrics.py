@@ -0,0 +1,441 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from . import api_logger
+from .ratelimit import endpoint_family
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300)
+
+HELP = {
+    'eodms_requests_total': "HTTP requests sent, by endpoint family, "
+                            "method and status.",
+    'eodms_request_errors_total': "HTTP requests which failed without a "
+                                  "response.",
+    'eodms_request_seconds': "Time of each phase of the HTTP requests: "
+                             "connect (DNS and TCP), tls and ttfb (until "
+                             "the response headers).",
+    'eodms_token_renewals_total': "Logins and token refreshes with the AAA "
+                                  "API.",
+    'eodms_cache_lookups_total': "Item cache lookups, by result.",
+    'eodms_retries_total': "Requests retried by the retry policy.",
+    'eodms_circuit_open_total': "Requests refused by an open circuit "
+                                "breaker.",
+    'eodms_download_bytes_total': "Bytes downloaded.",
+    'eodms_download_seconds': "Duration of the downloads.",
+    'eodms_download_bytes_per_second': "Throughput of the last download.",
+}
+
+_local = threading.local()
+
+
+class Metrics():
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes a registry of counters, gauges and histograms with
+            labels. Every update is also passed to the listeners, which is
+            how metrics are forwarded to other systems (ex: OpenTelemetry).
+
+        :param buckets: The upper bounds of the histogram buckets.
+        :type  buckets: tuple
+        """
+
+        self.buckets = tuple(sorted(buckets))
+
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def add_listener(self, listener):
+        """
+        Adds a function called with (kind, name, value, labels) on every
+            update, where kind is 'counter', 'gauge' or 'histogram'.
+        """
+
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+
+        with self._lock:
+            self._listeners = [func for func in self._listeners
+                               if func is not listener]
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter.
+        """
+
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+        self._emit('counter', name, value, labels)
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge.
+        """
+
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+        self._emit('gauge', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value in a histogram.
+        """
+
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0]
+            hist[0][bisect.bisect_left(self.buckets, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+        self._emit('histogram', name, value, labels)
+
+    def value(self, name, **labels):
+        """
+        Returns the value of a counter or gauge (the count of a histogram),
+            0 if it was never updated.
+        """
+
+        key = _key(name, labels)
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            if key in self._gauges:
+                return self._gauges[key]
+            if key in self._histograms:
+                return self._histograms[key][2]
+
+        return 0
+
+    def total(self, name):
+        """
+        Returns the sum of a counter over all its labels.
+        """
+
+        with self._lock:
+            return sum(value for (key, _), value in self._counters.items()
+                       if key == name)
+
+    def reset(self):
+        """
+        Clears all the metrics (but not the listeners).
+        """
+
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, (list(hist[0]), hist[1], hist[2]))
+                                for key, hist in self._histograms.items())
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (('le', str(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} "
+                             f"{cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def serve_prometheus(self, port=9464, addr=''):
+        """
+        Serves the metrics to Prometheus over HTTP (at any path) from a
+            background thread.
+
+        :return: The server (call shutdown() to stop it).
+        :rtype:  http.server.ThreadingHTTPServer
+        """
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='eodms_metrics',
+                         daemon=True).start()
+
+        return server
+
+    def _emit(self, kind, name, value, labels):
+
+        for listener in self._listeners:
+            try:
+                listener(kind, name, value, labels)
+            except Exception as err:
+                self.logger.warning(f"WARNING: Metrics listener failed: "
+                                    f"{err}")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value))
+                              for key, value in labels.items()))
+
+
+def _format_labels(labels):
+
+    if not labels:
+        return ''
+
+    values = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        values.append(f'{key}="{value}"')
+
+    return '{' + ','.join(values) + '}'
+
+
+# The registry updated by the whole package
+registry = Metrics()
+
+
+class OpenTelemetryExporter():
+
+    def __init__(self, meter=None, metrics=None):
+        """
+        Initializes a listener which forwards the metrics of a registry to
+            OpenTelemetry instruments. Requires the opentelemetry-api
+            package ('pip install py-eodms-dds[otel]').
+
+        :param meter: The OpenTelemetry Meter (defaults to the meter
+            'eodms_dds' of the global MeterProvider).
+        :type  meter: opentelemetry.metrics.Meter
+        :param metrics: The registry (defaults to the package registry).
+        :type  metrics: Metrics
+        """
+
+        try:
+            from opentelemetry import metrics as otel_metrics
+        except ImportError:
+            raise ImportError("The OpenTelemetry exporter requires the "
+                              "opentelemetry-api package. Install it with "
+                              "'pip install py-eodms-dds[otel]'.")
+
+        self.meter = meter or otel_metrics.get_meter('eodms_dds')
+        self.metrics = metrics or registry
+
+        self._instruments = {}
+        self._gauge_values = {}
+        self._lock = threading.Lock()
+
+        self.metrics.add_listener(self)
+
+    def close(self):
+        self.metrics.remove_listener(self)
+
+    def __call__(self, kind, name, value, labels):
+
+        instrument = self._instrument(kind, name)
+
+        if kind == 'counter':
+            instrument.add(value, attributes=labels)
+        elif kind == 'histogram':
+            instrument.record(value, attributes=labels)
+        else:
+            with self._lock:
+                self._gauge_values[(name, tuple(sorted(labels.items())))] = \
+                    value
+
+    def _instrument(self, kind, name):
+
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is not None:
+                return instrument
+
+            description = HELP.get(name, '')
+            if kind == 'counter':
+                instrument = self.meter.create_counter(
+                    name, description=description)
+            elif kind == 'histogram':
+                instrument = self.meter.create_histogram(
+                    name, unit='s' if name.endswith('_seconds') else '',
+                    description=description)
+            else:
+                instrument = self.meter.create_observable_gauge(
+                    name, callbacks=[self._gauge_callback(name)],
+                    description=description)
+            self._instruments[name] = instrument
+
+            return instrument
+
+    def _gauge_callback(self, name):
+
+        from opentelemetry.metrics import Observation
+
+        def callback(options):
+            with self._lock:
+                return [Observation(value, dict(labels))
+                        for (gauge_name, labels), value
+                        in self._gauge_values.items() if gauge_name == name]
+
+        return callback
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """
+    A urllib3 connection which records the time taken to connect.
+    """
+
+    def _new_conn(self):
+
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._tcp_seconds = time.perf_counter() - start
+
+        return sock
+
+    def connect(self):
+
+        super().connect()
+        _local.timings = {'connect': self._tcp_seconds}
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """
+    A urllib3 connection which records the time taken to connect and to
+        complete the TLS handshake.
+    """
+
+    def _new_conn(self):
+
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._tcp_seconds = time.perf_counter() - start
+        self._connect_start = start
+
+        return sock
+
+    def connect(self):
+
+        super().connect()
+        total = time.perf_counter() - self._connect_start
+        _local.timings = {'connect': self._tcp_seconds,
+                          'tls': total - self._tcp_seconds}
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, *args, metrics=None, **kwargs):
+        """
+        Initializes an HTTPAdapter which records the connect, TLS and
+            time-to-first-byte timings of each request in a metrics
+            registry (connect includes the DNS lookup; connect and tls are
+            only recorded when a new connection is opened).
+
+        :param metrics: The registry (defaults to the package registry).
+        :type  metrics: Metrics
+        """
+
+        self.metrics = metrics or registry
+
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+    def send(self, request, **kwargs):
+
+        family = endpoint_family(request.url)
+        _local.timings = {}
+
+        # The body is not read here, so this is the time to the headers
+        start = time.perf_counter()
+        try:
+            resp = super().send(request, **kwargs)
+        except Exception as err:
+            self.metrics.inc('eodms_request_errors_total', family=family,
+                             error=type(err).__name__)
+            raise
+
+        timings = _local.timings
+        timings['ttfb'] = time.perf_counter() - start
+        for phase, seconds in timings.items():
+            self.metrics.observe('eodms_request_seconds', seconds,
+                                 family=family, phase=phase)
+
+        self.metrics.inc('eodms_requests_total', family=family,
+                         method=request.method, status=resp.status_code)
+
+        return resp
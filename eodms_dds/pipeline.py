@@ -0,0 +1,192 @@
+import os
+import queue
+import threading
+
+from . import api_logger
+from .manager import DownloadJob
+
+_DONE = object()
+
+
+class DownloadPipeline():
+
+    def __init__(self, dds_api, out_folder, resolve_workers=4,
+                 download_workers=2, queue_size=16, catalog="EODMS",
+                 **download_kwargs):
+        """
+        Initializes a streaming pipeline: search results -> item info
+            (get_item) -> downloads. The stages run concurrently and are
+            linked by bounded queues, so downloads start while the search
+            is still paginating and memory stays flat however many results
+            there are.
+
+        :param dds_api: The DDS_API instance.
+        :type  dds_api: DDS_API
+        :param out_folder: The output folder.
+        :type  out_folder: str
+        :param resolve_workers: The number of workers getting item info.
+        :type  resolve_workers: int
+        :param download_workers: The number of parallel downloads.
+        :type  download_workers: int
+        :param queue_size: The capacity of each queue between the stages.
+        :type  queue_size: int
+        :param catalog: The catalog name.
+        :type  catalog: str
+        :param download_kwargs: Other arguments passed to
+            DDS_API.download_item (ex: segments, resume).
+        """
+
+        self.dds_api = dds_api
+        self.out_folder = os.path.abspath(out_folder)
+        self.resolve_workers = resolve_workers
+        self.download_workers = download_workers
+        self.queue_size = queue_size
+        self.catalog = catalog
+
+        download_kwargs.setdefault('progress', False)
+        self.download_kwargs = download_kwargs
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def run(self, collection, items):
+        """
+        Runs the pipeline over a (lazy) sequence of items and yields a
+            DownloadJob for each item as soon as it is finished: status
+            'downloaded', 'processing' (not ready in the DDS yet) or
+            'failed' (with the error in job.error).
+
+        :param collection: The Collection Id.
+        :type  collection: str
+        :param items: An iterable of item UUIDs, item dictionaries (STAC
+            items or OGC features) or objects with an 'id' attribute,
+            ideally a generator over the search results.
+        :type  items: iterable
+        """
+
+        stop = threading.Event()
+        uuid_q = queue.Queue(self.queue_size)
+        download_q = queue.Queue(self.queue_size)
+        result_q = queue.Queue(self.queue_size)
+        source_error = []
+
+        def put(q, value):
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(uuid_q, self._get_uuid(item)):
+                        return
+            except Exception as err:
+                source_error.append(err)
+            finally:
+                for _ in range(self.resolve_workers):
+                    put(uuid_q, _DONE)
+
+        remaining = {'resolve': self.resolve_workers,
+                     'download': self.download_workers}
+        remaining_lock = threading.Lock()
+
+        def finish(stage, next_q, count):
+            with remaining_lock:
+                remaining[stage] -= 1
+                last = remaining[stage] == 0
+            if last:
+                for _ in range(count):
+                    put(next_q, _DONE)
+
+        def resolve():
+            while True:
+                item_uuid = get(uuid_q)
+                if item_uuid is _DONE:
+                    break
+
+                job = DownloadJob(collection, item_uuid,
+                                  catalog=self.catalog)
+                try:
+                    job.item_info = self.dds_api.fetch_item(
+                        collection, item_uuid, self.catalog)
+                except Exception as err:
+                    job.status = 'failed'
+                    job.error = err
+                    put(result_q, job)
+                    continue
+
+                if job.item_info.get('download_url'):
+                    job.status = 'ready'
+                    put(download_q, job)
+                else:
+                    job.status = 'processing'
+                    put(result_q, job)
+
+            finish('resolve', download_q, self.download_workers)
+
+        def download():
+            while True:
+                job = get(download_q)
+                if job is _DONE:
+                    break
+
+                def on_chunk(nbytes, job=job):
+                    job.bytes += nbytes
+
+                try:
+                    job.filename = self.dds_api.download_item(
+                        self.out_folder, item_info=job.item_info,
+                        item_uuid=job.item_uuid,
+                        on_chunk=on_chunk, **self.download_kwargs)
+                    job.status = 'downloaded'
+                except Exception as err:
+                    self.logger.error(f"Failed to download "
+                                      f"{job.item_uuid}: {err}")
+                    job.status = 'failed'
+                    job.error = err
+
+                put(result_q, job)
+
+            finish('download', result_q, 1)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=resolve, daemon=True)
+                    for _ in range(self.resolve_workers)]
+        threads += [threading.Thread(target=download, daemon=True)
+                    for _ in range(self.download_workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                job = result_q.get()
+                if job is _DONE:
+                    break
+                yield job
+        finally:
+            # Also reached if the caller stops iterating early
+            stop.set()
+
+        if source_error:
+            raise source_error[0]
+
+    def _get_uuid(self, item):
+
+        if isinstance(item, str):
+            return item
+
+        if isinstance(item, dict):
+            return item['id']
+
+        return item.id
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from . import locks
+
+
+class TokenBucket():
+
+    def __init__(self, rate, capacity=None):
+        """
+        Initializes a thread-safe token bucket which refills at a fixed
+            rate (ex: bytes per second for a bandwidth cap).
+
+        :param rate: The number of tokens added per second.
+        :type  rate: float
+        :param capacity: The maximum number of tokens kept (the burst size).
+            Defaults to one second worth of tokens.
+        :type  capacity: float
+        """
+
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, amount=1):
+        """
+        Takes tokens from the bucket without waiting.
+
+        :return: The number of seconds the caller must wait before using
+            the tokens (0 if they were available).
+        :rtype:  float
+        """
+
+        with self._lock:
+            self._refill()
+            # Going into debt lets amounts larger than the capacity through
+            #   while keeping the long-term rate
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self.rate
+
+    def drain(self, seconds):
+        """
+        Empties the bucket so no tokens are available for the given number
+            of seconds (ex: after the server asked to slow down).
+        """
+
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def consume(self, amount=1):
+        """
+        Takes tokens from the bucket, waiting until they are available.
+
+        :param amount: The number of tokens.
+        :type  amount: float
+        """
+
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def consume_async(self, amount=1):
+        """
+        Takes tokens from the bucket, waiting (without blocking the event
+            loop) until they are available. Threads and asyncio tasks can
+            share the same bucket.
+        """
+
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+
+    def __init__(self, fn, rate, capacity=None):
+        """
+        Initializes a token bucket whose state is kept in a small JSON file,
+            so every process using the same file shares the rate (ex: all
+            the workers of a job on one machine).
+
+        :param fn: The path of the state file (a '.lock' file is created
+            next to it).
+        :type  fn: str
+        :param rate: The number of tokens added per second.
+        :type  rate: float
+        :param capacity: The maximum number of tokens kept.
+        :type  capacity: float
+        """
+
+        super().__init__(rate, capacity)
+
+        self.fn = fn
+        self.lock_fn = f'{fn}.lock'
+
+    def _update(self, change):
+        """
+        Applies a change to the number of tokens in the state file.
+        """
+
+        with self._lock, locks.FileLock(self.lock_fn):
+            # Wall-clock time, since monotonic clocks differ per process
+            now = time.time()
+
+            try:
+                with open(self.fn, 'r') as f:
+                    state = json.load(f)
+                tokens = state['tokens'] + \
+                    max(now - state['last'], 0) * self.rate
+            except (OSError, ValueError, KeyError, TypeError):
+                tokens = self.capacity
+
+            tokens = change(min(self.capacity, tokens))
+
+            with open(self.fn, 'w') as f:
+                json.dump({"tokens": tokens, "last": now}, f)
+
+        return tokens
+
+    def reserve(self, amount=1):
+
+        tokens = self._update(lambda tokens: tokens - amount)
+        if tokens >= 0:
+            return 0
+
+        return -tokens / self.rate
+
+    def drain(self, seconds):
+        self._update(lambda tokens: min(tokens, -seconds * self.rate))
+
+
+def endpoint_family(url):
+    """
+    Gets the endpoint family of a URL: 'aaa', 'dds' (item requests),
+        'search' (STAC and OGC API searches) or 'download'.
+    """
+
+    path = urlparse(url).path
+
+    if path.startswith('/aaa/'):
+        return 'aaa'
+    if path.startswith('/dds/'):
+        return 'dds'
+    if path.rstrip('/').endswith('/search') or '/collections' in path:
+        return 'search'
+
+    return 'download'
+
+
+class RateLimiter():
+
+    def __init__(self, limits=None, shared_dir=None):
+        """
+        Initializes a client-side rate limiter with a token bucket per
+            endpoint family ('aaa', 'dds', 'search' and 'download'), which
+            paces requests so they stay under the quota of the server. One
+            RateLimiter is shared by the threads and asyncio tasks of a
+            process; with shared_dir, it is also shared with the other
+            processes using the same folder.
+
+        :param limits: The limits per family: a number of requests per
+            second, or a tuple (rate, burst). Families without a limit are
+            not paced.
+        :type  limits: dict
+        :param shared_dir: A folder where the state of the buckets is kept
+            to coordinate processes (all of them must use the same limits).
+        :type  shared_dir: str
+        """
+
+        self.limits = dict(limits or {})
+        self.shared_dir = shared_dir
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        if shared_dir is not None:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def bucket(self, family):
+        """
+        Gets the token bucket of an endpoint family (None if the family is
+            not limited).
+
+        :rtype: TokenBucket
+        """
+
+        limit = self.limits.get(family)
+        if not limit:
+            return None
+
+        with self._lock:
+            bucket = self._buckets.get(family)
+            if bucket is None:
+                rate, capacity = limit if isinstance(limit, (tuple, list)) \
+                    else (limit, None)
+                if self.shared_dir is not None:
+                    fn = os.path.join(self.shared_dir,
+                                      f'ratelimit.{family}.json')
+                    bucket = FileTokenBucket(fn, rate, capacity)
+                else:
+                    bucket = TokenBucket(rate, capacity)
+                self._buckets[family] = bucket
+
+            return bucket
+
+    def acquire(self, url):
+        """
+        Waits until a request to the URL is allowed.
+
+        :return: The number of seconds waited.
+        :rtype:  float
+        """
+
+        bucket = self.bucket(endpoint_family(url))
+        if bucket is None:
+            return 0
+
+        wait = bucket.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    async def acquire_async(self, url):
+        """
+        Waits (without blocking the event loop) until a request to the URL
+            is allowed.
+
+        :return: The number of seconds waited.
+        :rtype:  float
+        """
+
+        bucket = self.bucket(endpoint_family(url))
+        if bucket is None:
+            return 0
+
+        if isinstance(bucket, FileTokenBucket):
+            # The file lock may block; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            wait = await loop.run_in_executor(None, bucket.reserve)
+        else:
+            wait = bucket.reserve()
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        return wait
+
+    def penalize(self, url, seconds):
+        """
+        Pauses every request of the URL's family for the given number of
+            seconds (ex: after a 429 response), by putting its bucket into
+            debt.
+        """
+
+        bucket = self.bucket(endpoint_family(url))
+        if bucket is not None and seconds > 0:
+            bucket.drain(seconds)
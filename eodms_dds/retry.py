@@ -0,0 +1,424 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import requests
+
+from . import api_logger
+from . import session as eodms_session
+from .exceptions import CircuitOpenError
+from .metrics import registry as metrics
+from .ratelimit import endpoint_family
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+# Errors after which a request may be sent again
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+
+def endpoint_key(url):
+    """
+    Gets the endpoint of a URL used for circuit breakers: the host and the
+        first three parts of the path (ex: 'host/dds/v1/item'), so all the
+        items of an API share one breaker.
+    """
+
+    parsed = urlparse(url)
+    parts = [part for part in parsed.path.split('/') if part][:3]
+
+    return '/'.join([parsed.netloc] + parts)
+
+
+class RetryBudget():
+
+    def __init__(self, ratio=0.2, min_retries=10, window=10):
+        """
+        Initializes a retry budget which caps retries at a fraction of the
+            recent requests, so retries can't multiply the load on a server
+            which is already failing.
+
+        :param ratio: The number of retries allowed per request.
+        :type  ratio: float
+        :param min_retries: The number of retries always allowed per window
+            (so a quiet client can still retry).
+        :type  min_retries: int
+        :param window: The length of the window in seconds.
+        :type  window: float
+        """
+
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+
+        for times in (self._requests, self._retries):
+            while times and times[0] <= now - self.window:
+                times.popleft()
+
+    def record_request(self):
+
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._requests.append(now)
+
+    def withdraw(self):
+        """
+        Takes a retry from the budget.
+
+        :return: False if the budget is exhausted.
+        :rtype:  boolean
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+
+            allowed = max(self.min_retries, self.ratio * len(self._requests))
+            if len(self._retries) >= allowed:
+                return False
+
+            self._retries.append(now)
+
+            return True
+
+
+class CircuitBreaker():
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Initializes a circuit breaker for one endpoint. After
+            failure_threshold consecutive failures the circuit opens and
+            requests fail fast for reset_timeout seconds; then a single
+            trial request is let through, which closes the circuit if it
+            succeeds.
+
+        :param failure_threshold: The number of consecutive failures which
+            open the circuit.
+        :type  failure_threshold: int
+        :param reset_timeout: The number of seconds the circuit stays open.
+        :type  reset_timeout: float
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns the number of seconds before a request is allowed (0 if it
+            can be sent now).
+        """
+
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+
+            now = time.monotonic()
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+
+            # Let one trial request through (again if the last trial never
+            #   finished)
+            self.state = 'half_open'
+            self.opened_at = now
+
+            return 0
+
+    def record_success(self):
+
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or \
+                    self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy():
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30,
+                 jitter=0.5, max_retry_after=120, budget=None,
+                 failure_threshold=5, reset_timeout=30):
+        """
+        Initializes the retry policy shared by the AAA API, the DDS API and
+            the downloads: exponential backoff with jitter, the Retry-After
+            of the server, a retry budget and a circuit breaker per
+            endpoint.
+
+        Responses with a status in RETRY_STATUSES and transient network
+            errors are retried for idempotent requests. Other requests are
+            only retried if the server refused them (429 or 503) or if the
+            connection could not be opened.
+
+        :param max_retries: The maximum number of retries per request.
+        :type  max_retries: int
+        :param backoff: The delay in seconds before the first retry; it is
+            doubled for each retry.
+        :type  backoff: float
+        :param max_backoff: The maximum delay in seconds between retries.
+        :type  max_backoff: float
+        :param jitter: The fraction of each delay which is randomized.
+        :type  jitter: float
+        :param max_retry_after: The longest Retry-After in seconds which is
+            waited for; a response asking for a longer wait is returned.
+        :type  max_retry_after: float
+        :param budget: The retry budget (by default 20% of the requests of
+            the last 10 seconds, and at least 10 retries).
+        :type  budget: RetryBudget
+        :param failure_threshold: The number of consecutive failures of an
+            endpoint which open its circuit breaker (0 disables them).
+        :type  failure_threshold: int
+        :param reset_timeout: The number of seconds an open circuit breaker
+            fails requests before trying the endpoint again.
+        :type  reset_timeout: float
+        """
+
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.budget = budget if budget is not None else RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.retries = 0
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def breaker(self, endpoint):
+        """
+        Gets the circuit breaker of an endpoint.
+
+        :rtype: CircuitBreaker
+        """
+
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold,
+                                         self.reset_timeout)
+                self._breakers[endpoint] = breaker
+
+            return breaker
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Returns the number of seconds to wait before the given retry
+            (0-based), never less than the Retry-After of the server.
+        """
+
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        delay *= 1 - self.jitter * random.random()
+
+        return max(delay, retry_after or 0)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def call(self, func, url, method='GET', idempotent=None,
+             retry_exceptions=()):
+        """
+        Calls func (which sends a request to url) until it succeeds or the
+            retries are exhausted.
+
+        :param func: The function sending the request. It returns a
+            requests Response (or any other value, which is not checked).
+        :type  func: function
+        :param url: The URL of the request (used for its endpoint).
+        :type  url: str
+        :param method: The HTTP method of the request.
+        :type  method: str
+        :param idempotent: Whether the request can safely be sent twice
+            (by default, depends on the method).
+        :type  idempotent: boolean
+        :param retry_exceptions: Other exceptions which are retried.
+        :type  retry_exceptions: tuple
+
+        :return: The result of func. A response with a retryable status is
+            returned once the retries are exhausted.
+        """
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        endpoint = endpoint_key(url)
+        breaker = self.breaker(endpoint) if self.failure_threshold else None
+
+        self.budget.record_request()
+
+        attempt = 0
+        while True:
+            self._check_breaker(breaker, endpoint, url)
+
+            try:
+                result = func()
+            except TRANSIENT_ERRORS + tuple(retry_exceptions) as err:
+                reason = self._on_error(err, breaker, idempotent, attempt,
+                                        url)
+                retry_after = None
+            else:
+                retry = self._on_result(result, breaker, idempotent, attempt,
+                                        url)
+                if retry is None:
+                    return result
+                reason, retry_after = retry
+
+            self.sleep(self._next_delay(endpoint, reason, attempt,
+                                        retry_after))
+            attempt += 1
+
+    async def call_async(self, func, url, method='GET', idempotent=None,
+                         retry_exceptions=()):
+        """
+        Awaits func (which sends a request to url) until it succeeds or the
+            retries are exhausted, with the same rules as call. The delays
+            are awaited, so the event loop is never blocked.
+
+        :param func: The coroutine function sending the request. It returns
+            a response with a 'status' (aiohttp) or a 'status_code'.
+        :type  func: function
+        :param retry_exceptions: The exceptions which are retried, such as
+            aiohttp.ClientError (TRANSIENT_ERRORS only covers requests).
+        :type  retry_exceptions: tuple
+
+        :return: The result of func.
+        """
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        endpoint = endpoint_key(url)
+        breaker = self.breaker(endpoint) if self.failure_threshold else None
+
+        self.budget.record_request()
+
+        attempt = 0
+        while True:
+            self._check_breaker(breaker, endpoint, url)
+
+            try:
+                result = await func()
+            except TRANSIENT_ERRORS + tuple(retry_exceptions) as err:
+                reason = self._on_error(err, breaker, idempotent, attempt,
+                                        url)
+                retry_after = None
+            else:
+                retry = self._on_result(result, breaker, idempotent, attempt,
+                                        url)
+                if retry is None:
+                    return result
+                reason, retry_after = retry
+
+            await asyncio.sleep(self._next_delay(endpoint, reason, attempt,
+                                                 retry_after))
+            attempt += 1
+
+    def _check_breaker(self, breaker, endpoint, url):
+
+        if breaker is None:
+            return
+
+        retry_in = breaker.allow()
+        if retry_in:
+            metrics.inc('eodms_circuit_open_total',
+                        family=endpoint_family(url))
+            raise CircuitOpenError(endpoint, retry_in)
+
+    def _on_error(self, err, breaker, idempotent, attempt, url):
+        """
+        Records a failed attempt and returns the reason of its retry, or
+            raises the error if it can't be retried.
+        """
+
+        if breaker is not None:
+            breaker.record_failure()
+        if not (idempotent or
+                isinstance(err, requests.exceptions.ConnectTimeout)):
+            raise err
+        if not self._can_retry(attempt):
+            raise err
+
+        metrics.inc('eodms_retries_total', family=endpoint_family(url),
+                    reason=type(err).__name__)
+
+        return f"{type(err).__name__}: {err}"
+
+    def _on_result(self, result, breaker, idempotent, attempt, url):
+        """
+        Records a response and returns a tuple (reason, retry_after) if it
+            should be retried, or None if it should be returned.
+        """
+
+        status = getattr(result, 'status_code', None)
+        if status is None:
+            status = getattr(result, 'status', None)
+
+        if status not in RETRY_STATUSES:
+            if breaker is not None:
+                breaker.record_success()
+            return None
+
+        # A 429 means the endpoint is up but busy
+        if breaker is not None and status != 429:
+            breaker.record_failure()
+
+        retry_after = eodms_session.parse_retry_after(
+            result.headers.get('Retry-After'))
+
+        if not (idempotent or status in (429, 503)) or \
+                (retry_after or 0) > self.max_retry_after or \
+                not self._can_retry(attempt):
+            return None
+
+        result.close()
+        metrics.inc('eodms_retries_total', family=endpoint_family(url),
+                    reason=str(status))
+
+        return f"HTTP {status}", retry_after
+
+    def _next_delay(self, endpoint, reason, attempt, retry_after):
+
+        delay = self.delay(attempt, retry_after)
+        self.logger.warning(f"WARNING: Request to {endpoint} failed "
+                            f"({reason}); retrying in {delay:.1f}s "
+                            f"(retry {attempt + 1} of {self.max_retries})...")
+
+        return delay
+
+    def _can_retry(self, attempt):
+
+        if attempt >= self.max_retries or not self.budget.withdraw():
+            return False
+
+        with self._lock:
+            self.retries += 1
+
+        return True
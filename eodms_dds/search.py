@@ -0,0 +1,512 @@
+import datetime as dt
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+from . import api_logger
+from . import config
+from . import session as eodms_session
+from .exceptions import SearchError
+from .retry import RetryPolicy
+
+# The bbox searched when a query without one has to be split spatially
+WORLD_BBOX = (-180.0, -90.0, 180.0, 90.0)
+
+_DONE = object()
+
+
+def next_page_params(page):
+    """
+    Gets the query parameters of the next page of a search response, from
+        its 'next' link (or a 'page_token' in the response).
+
+    :param page: The decoded response.
+    :type  page: dict
+
+    :return: The parameters to add to the request or None on the last page.
+    :rtype:  dict
+    """
+
+    for link in page.get('links', []):
+        if link.get('rel') == 'next' and link.get('href'):
+            query = parse_qs(urlparse(link['href']).query,
+                             keep_blank_values=True)
+            return {key: values[-1] for key, values in query.items()}
+
+    if page.get('page_token'):
+        return {'page_token': page['page_token']}
+
+    return None
+
+
+def parse_interval(value):
+    """
+    Parses an ISO 8601 datetime or interval ('start/end', where '..' or an
+        empty string is an open end).
+
+    :param value: The datetime or interval.
+    :type  value: str
+
+    :return: The start and end as UTC datetimes (None for an open end).
+    :rtype:  tuple
+    """
+
+    def parse(text):
+        if text in ('', '..'):
+            return None
+        parsed = dt.datetime.fromisoformat(text.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=dt.timezone.utc)
+        return parsed.astimezone(dt.timezone.utc)
+
+    start, sep, end = value.partition('/')
+
+    start = parse(start)
+    end = parse(end) if sep else start
+
+    return start, end
+
+
+def format_interval(start, end):
+    """
+    Formats a datetime interval for the 'datetime' query parameter.
+
+    :rtype: str
+    """
+
+    def fmt(value):
+        if value is None:
+            return '..'
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ' if value.microsecond
+                              else '%Y-%m-%dT%H:%M:%SZ')
+
+    return f"{fmt(start)}/{fmt(end)}"
+
+
+def split_shard(shard, parts, min_interval, min_degrees):
+    """
+    Splits a shard of a search into equal parts: its datetime interval
+        while it is longer than min_interval, otherwise its bbox across its
+        longest side.
+
+    Neighbouring parts share their boundary (both filters are inclusive),
+        so an item on it is returned by both and must be de-duplicated.
+
+    :param shard: The bbox (or None) and the (start, end) interval (or
+        None) of the shard.
+    :type  shard: tuple
+    :param parts: The number of parts (at least 2).
+    :type  parts: int
+    :param min_interval: The shortest interval which is split.
+    :type  min_interval: datetime.timedelta
+    :param min_degrees: The smallest bbox side which is split.
+    :type  min_degrees: float
+
+    :return: The parts, or None if the shard can't be split.
+    :rtype:  list
+    """
+
+    bbox, interval = shard
+
+    if interval is not None and None not in interval and \
+            interval[1] - interval[0] > min_interval:
+        start, end = interval
+        step = (end - start) / parts
+        bounds = [start + step * index for index in range(parts)] + [end]
+        return [(bbox, (bounds[index], bounds[index + 1]))
+                for index in range(parts)]
+
+    west, south, east, north = bbox if bbox is not None else WORLD_BBOX
+
+    # A bbox crossing the antimeridian has west > east
+    width = (east - west) % 360 if west > east else east - west
+    height = north - south
+
+    if max(width, height) <= min_degrees:
+        return None
+
+    if width >= height:
+        step = width / parts
+        bounds = [west + step * index for index in range(parts)] + [east]
+        bounds = [bound - 360 if bound > 180 else bound for bound in bounds]
+        return [((bounds[index], south, bounds[index + 1], north), interval)
+                for index in range(parts)]
+
+    step = height / parts
+    bounds = [south + step * index for index in range(parts)] + [north]
+    return [((west, bounds[index], east, bounds[index + 1]), interval)
+            for index in range(parts)]
+
+
+class SearchAPI():
+
+    def __init__(self, aaa_api=None, environment='prod', session=None,
+                 page_size=100):
+        """
+        Initializes a client of the EODMS search API (OGC API - Features).
+
+        :param aaa_api: The AAA_API instance used to get Access Tokens (None
+            to search as a guest). Its session, retry policy and rate
+            limiter are shared.
+        :type  aaa_api: AAA_API
+        :param environment: Environment to use ('prod' or 'staging')
+        :type  environment: str
+        :param session: A requests Session (defaults to the pooled session
+            of the aaa_api)
+        :type  session: requests.Session
+        :param page_size: The default number of features per page.
+        :type  page_size: int
+        """
+
+        domain_config = config.get_domain_config(environment)
+        self.base_url = f"{domain_config['domain']}/search"
+        self.verify_ssl = domain_config.get('verify_ssl', True)
+        self.page_size = page_size
+
+        self.aaa = aaa_api
+
+        if session is None:
+            if aaa_api is not None:
+                session = aaa_api.session
+            else:
+                session = eodms_session.create_session(
+                    verify_ssl=self.verify_ssl)
+        self.session = session
+
+        self.retry_policy = aaa_api.retry_policy if aaa_api is not None \
+            else RetryPolicy()
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def get_collections(self):
+        """
+        Gets the collections available to the user.
+
+        :return: The decoded response (with a 'collections' list).
+        :rtype:  dict
+        """
+
+        return self._get(f"{self.base_url}/collections")
+
+    def get_feature(self, collection_id, feature_id):
+        """
+        Gets a single feature.
+
+        :rtype: dict
+        """
+
+        return self._get(f"{self.base_url}/collections/{collection_id}/"
+                         f"items/{feature_id}")
+
+    def features(self, collection_id, bbox=None, datetime=None, limit=None,
+                 page_size=None, params=None, prefetch=True):
+        """
+        Searches a collection and yields its features (dictionaries) as the
+            pages arrive. See pages for the parameters.
+        """
+
+        for page in self.pages(collection_id, bbox, datetime, limit,
+                               page_size, params, prefetch):
+            yield from page
+
+    def pages(self, collection_id, bbox=None, datetime=None, limit=None,
+              page_size=None, params=None, prefetch=True):
+        """
+        Searches a collection and yields each page of features (a list of
+            dictionaries) as it arrives.
+
+        While the caller consumes a page, the next one is requested in a
+            background thread, so the first results arrive after one page
+            and at most two pages are held in memory.
+
+        :param collection_id: The collection Id.
+        :type  collection_id: str
+        :param bbox: The bounding box (west, south, east, north).
+        :type  bbox: list
+        :param datetime: The temporal filter as an ISO 8601 date or range
+            (ex: '2020-10-31T00:00:00Z/2020-11-04T23:59:00Z').
+        :type  datetime: str
+        :param limit: The maximum number of features (None for all).
+        :type  limit: int
+        :param page_size: The number of features per page (defaults to
+            self.page_size).
+        :type  page_size: int
+        :param params: Other query parameters.
+        :type  params: dict
+        :param prefetch: Determines whether to request the next page in the
+            background.
+        :type  prefetch: boolean
+        """
+
+        url = f"{self.base_url}/collections/{collection_id}/items"
+
+        query = dict(params or {})
+        if bbox is not None:
+            query['bbox'] = ','.join(str(coord) for coord in bbox)
+        if datetime is not None:
+            query['datetime'] = datetime
+
+        page_size = page_size or self.page_size
+        if limit is not None:
+            page_size = min(page_size, limit)
+        query['limit'] = page_size
+
+        count = 0
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        next_page = None
+
+        try:
+            page = self._get(url, query)
+            while True:
+                features = page.get('features', [])
+                next_params = next_page_params(page)
+
+                if limit is not None:
+                    features = features[:limit - count]
+                count += len(features)
+
+                if not features or (limit is not None and count >= limit):
+                    next_params = None
+
+                next_page = None
+                if next_params is not None:
+                    next_query = dict(query, **next_params)
+                    if executor is not None:
+                        next_page = executor.submit(self._get, url,
+                                                    next_query)
+
+                # Drop the reference so only the pages in flight are kept
+                page = None
+
+                if features:
+                    yield features
+
+                if next_params is None:
+                    break
+
+                page = next_page.result() if next_page is not None \
+                    else self._get(url, next_query)
+        finally:
+            if executor is not None:
+                if next_page is not None:
+                    next_page.cancel()
+                executor.shutdown(wait=False)
+
+        self.logger.debug(f"Got {count} features from {collection_id}.")
+
+    def sharded_features(self, collection_id, bbox=None, datetime=None,
+                         limit=None, workers=4, page_size=None, params=None,
+                         shard_size=None, max_shards=256,
+                         min_interval=dt.timedelta(minutes=1),
+                         min_degrees=0.01):
+        """
+        Searches a collection with several cursors at once and yields its
+            features (dictionaries), in no particular order.
+
+        The query is split into shards over its datetime interval (or, once
+            an interval is too short or if there is none, its bbox), which
+            are paginated concurrently. The first page of each shard gives
+            its number of matches: a shard with more than shard_size
+            matches is split into as many equal parts as it needs (which
+            are checked in turn), so dense periods and areas get more
+            shards than sparse ones. Features returned by two shards (on a
+            shared boundary) are only yielded once.
+
+        An open-ended interval ('..') is not split in time.
+
+        :param collection_id: The collection Id.
+        :type  collection_id: str
+        :param bbox: The bounding box (west, south, east, north).
+        :type  bbox: list
+        :param datetime: The temporal filter as an ISO 8601 date or range
+            (ex: '2020-01-01T00:00:00Z/2023-01-01T00:00:00Z').
+        :type  datetime: str
+        :param limit: The maximum number of features (None for all).
+        :type  limit: int
+        :param workers: The number of shards paginated at once.
+        :type  workers: int
+        :param page_size: The number of features per page (defaults to
+            self.page_size).
+        :type  page_size: int
+        :param params: Other query parameters.
+        :type  params: dict
+        :param shard_size: The maximum number of matches of a shard before
+            it is split (by default, enough for each worker to get two
+            shards, and at least 2 pages).
+        :type  shard_size: int
+        :param max_shards: The maximum number of shards.
+        :type  max_shards: int
+        :param min_interval: The shortest datetime interval which is split.
+        :type  min_interval: datetime.timedelta
+        :param min_degrees: The smallest bbox side (in degrees) which is
+            split.
+        :type  min_degrees: float
+        """
+
+        url = f"{self.base_url}/collections/{collection_id}/items"
+        page_size = page_size or self.page_size
+
+        root = (tuple(float(coord) for coord in bbox)
+                if bbox is not None else None,
+                parse_interval(datetime) if datetime is not None else None)
+
+        stop = threading.Event()
+        shard_q = queue.Queue()
+        result_q = queue.Queue(workers * 2)
+
+        state = {'pending': 1, 'shards': 1, 'shard_size': shard_size}
+        lock = threading.Lock()
+
+        def put(value):
+            while not stop.is_set():
+                try:
+                    result_q.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def query_of(shard):
+            shard_bbox, interval = shard
+            query = dict(params or {})
+            if shard_bbox is not None:
+                query['bbox'] = ','.join(str(coord) for coord in shard_bbox)
+            if interval is not None:
+                query['datetime'] = format_interval(*interval)
+            query['limit'] = page_size
+            return query
+
+        def split(shard, page):
+            matched = page.get('numberMatched')
+            with lock:
+                if matched is None:
+                    # Without a count, a shard with more than one page is
+                    #   halved until each worker has two
+                    dense = next_page_params(page) is not None and \
+                        state['shards'] < workers * 2
+                    parts = 2
+                else:
+                    if state['shard_size'] is None:
+                        # Sized on the first (whole) query
+                        state['shard_size'] = max(
+                            page_size * 2,
+                            math.ceil(matched / (workers * 2)))
+                    dense = matched > state['shard_size']
+                    parts = math.ceil(matched / state['shard_size'])
+
+                parts = min(parts, max_shards - state['shards'] + 1)
+                if not dense or parts < 2:
+                    return None
+
+                shards = split_shard(shard, parts, min_interval,
+                                     min_degrees)
+                if shards is not None:
+                    state['pending'] += len(shards)
+                    state['shards'] += len(shards) - 1
+
+            return shards
+
+        def search(shard):
+            query = query_of(shard)
+            page = self._get(url, query)
+
+            shards = split(shard, page)
+            if shards is not None:
+                for part in shards:
+                    shard_q.put(part)
+                return
+
+            while not stop.is_set():
+                features = page.get('features', [])
+                if features and not put(features):
+                    return
+
+                next_params = next_page_params(page)
+                if not features or next_params is None:
+                    return
+
+                page = self._get(url, dict(query, **next_params))
+
+        def work():
+            while not stop.is_set():
+                try:
+                    shard = shard_q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if shard is _DONE:
+                    break
+
+                try:
+                    search(shard)
+                except Exception as err:
+                    put(err)
+                    stop.set()
+
+                with lock:
+                    state['pending'] -= 1
+                    last = state['pending'] == 0
+                if last:
+                    put(_DONE)
+                    for _ in range(workers):
+                        shard_q.put(_DONE)
+
+        shard_q.put(root)
+        threads = [threading.Thread(target=work, daemon=True)
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        seen = set()
+        count = duplicates = 0
+        try:
+            while True:
+                features = result_q.get()
+                if features is _DONE:
+                    break
+                if isinstance(features, Exception):
+                    raise features
+
+                for feature in features:
+                    feature_id = feature.get('id')
+                    if feature_id in seen:
+                        duplicates += 1
+                        continue
+                    if feature_id is not None:
+                        seen.add(feature_id)
+                    count += 1
+                    yield feature
+
+                    if limit is not None and count >= limit:
+                        return
+        finally:
+            # Also reached if the caller stops iterating early
+            stop.set()
+
+            self.logger.debug(f"Got {count} features from "
+                              f"{collection_id} in {state['shards']} shards "
+                              f"({duplicates} duplicates dropped).")
+
+    def _get(self, url, params=None):
+
+        headers = {}
+
+        if self.aaa is not None:
+            access_token = self.aaa.get_access_token()
+            headers['Authorization'] = f"Bearer {access_token}"
+            resp = self.aaa.prepare_request(url, headers=headers,
+                                            params=params)
+        else:
+            resp = self.retry_policy.call(
+                lambda: self.session.get(url, params=params,
+                                         verify=self.verify_ssl), url)
+
+        if resp.status_code != 200:
+            raise SearchError.from_response(resp)
+
+        try:
+            return resp.json()
+        except ValueError:
+            raise SearchError("Search API cannot be accessed at this time.",
+                              status_code=resp.status_code, response=resp)
@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+
+from .metrics import TimedHTTPAdapter
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                   pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                   keep_alive=True, verify_ssl=True):
+    """
+    Creates a long-lived requests Session backed by a pooled HTTPAdapter.
+        The same session should be shared by the AAA_API, the DDS_API
+        and the download path so that TCP and TLS connections to the
+        EODMS domain are reused between calls.
+
+    :param pool_connections: The number of per-host connection pools to cache.
+    :type  pool_connections: int
+    :param pool_maxsize: The maximum number of connections kept open per host.
+    :type  pool_maxsize: int
+    :param pool_block: If True, no more than pool_maxsize connections will
+        be opened to a single host at once (callers wait for a free
+        connection instead).
+    :type  pool_block: boolean
+    :param keep_alive: If False, connections are closed after each request.
+    :type  keep_alive: boolean
+    :param verify_ssl: Determines whether to verify SSL certificates.
+    :type  verify_ssl: boolean
+
+    The adapter records the timings of each request in metrics.registry.
+    """
+
+    session = requests.Session()
+    session.trust_env = False
+    session.verify = verify_ssl
+
+    adapter = TimedHTTPAdapter(pool_connections=pool_connections,
+                               pool_maxsize=pool_maxsize,
+                               pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def parse_retry_after(value):
+    """
+    Parses the value of a Retry-After header.
+
+    :param value: The header value, either a number of seconds or an
+        HTTP date.
+    :type  value: str
+
+    :return: The number of seconds to wait or None if it can't be parsed.
+    :rtype:  float
+    """
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_dt is None:
+        return None
+
+    if retry_dt.tzinfo is None:
+        retry_dt = retry_dt.replace(tzinfo=timezone.utc)
+
+    delay = (retry_dt - datetime.now(timezone.utc)).total_seconds()
+    return max(delay, 0)
@@ -0,0 +1,290 @@
+import os
+import threading
+
+from .exceptions import DownloadError
+
+
+class Sink():
+    """
+    Base class of the destinations a download can be streamed into other
+        than a file path.
+
+    Chunks are passed as memoryview slices of the read buffer, which may be
+        reused for the next chunk: a sink must consume (or copy) a chunk
+        before returning.
+    """
+
+    # Whether chunks can be written at any offset (for segmented downloads)
+    seekable = False
+
+    # Whether the chunks written can be read back (to hash segments)
+    readable = False
+
+    def open(self, size):
+        """
+        Called before the first chunk with the size of the file (None if
+            unknown).
+        """
+
+    def write(self, chunk):
+        """
+        Writes the next chunk.
+        """
+
+        raise NotImplementedError
+
+    def write_at(self, offset, chunk):
+        """
+        Writes a chunk at the given offset (only for seekable sinks).
+        """
+
+        raise NotImplementedError
+
+    def read_at(self, offset, nbytes):
+        """
+        Reads back nbytes written at the given offset (only for readable
+            sinks).
+        """
+
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Flushes the chunks written so far (before a checkpoint is saved).
+        """
+
+    def reset(self):
+        """
+        Rewinds the sink so the download can start over.
+
+        :return: False if the bytes already written can't be taken back.
+        :rtype:  boolean
+        """
+
+        return False
+
+    def close(self):
+        """
+        Called once the download is finished (or failed).
+        """
+
+
+class FileObjectSink(Sink):
+
+    def __init__(self, file_obj):
+        """
+        Initializes a sink which writes to an open binary file object (ex:
+            a file, a pipe such as the stdin of a subprocess or the input of
+            a decompressor). The file object is not closed.
+
+        :param file_obj: The file object.
+        :type  file_obj: file object
+        """
+
+        self.file_obj = file_obj
+        self.seekable = bool(getattr(file_obj, 'seekable', None) and
+                             file_obj.seekable())
+        self.start = file_obj.tell() if self.seekable else 0
+        self.readable = self.seekable and \
+            bool(getattr(file_obj, 'readable', None) and file_obj.readable())
+
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        self.file_obj.write(chunk)
+
+    def write_at(self, offset, chunk):
+
+        with self._lock:
+            self.file_obj.seek(self.start + offset)
+            self.file_obj.write(chunk)
+
+    def read_at(self, offset, nbytes):
+
+        with self._lock:
+            self.file_obj.seek(self.start + offset)
+            return self.file_obj.read(nbytes)
+
+    def flush(self):
+
+        with self._lock:
+            self.file_obj.flush()
+
+    def reset(self):
+
+        if not self.seekable:
+            return False
+
+        self.file_obj.seek(self.start)
+        self.file_obj.truncate()
+
+        return True
+
+    def close(self):
+        self.file_obj.flush()
+
+
+class PwriteSink(Sink):
+
+    seekable = True
+    readable = True
+
+    def __init__(self, fd):
+        """
+        Initializes a sink which writes to a file descriptor with positional
+            writes (os.pwrite), so parallel segments share the descriptor
+            without a seek pointer or a lock. The descriptor is not closed,
+            and must be readable for the segments to be verified.
+
+        :param fd: The file descriptor.
+        :type  fd: int
+        """
+
+        self.fd = fd
+        self.pos = 0
+
+    def write(self, chunk):
+
+        self.write_at(self.pos, chunk)
+        self.pos += len(chunk)
+
+    def write_at(self, offset, chunk):
+
+        view = memoryview(chunk)
+        while len(view):
+            nbytes = os.pwrite(self.fd, view, offset)
+            view = view[nbytes:]
+            offset += nbytes
+
+    def read_at(self, offset, nbytes):
+        return os.pread(self.fd, nbytes, offset)
+
+    def reset(self):
+
+        self.pos = 0
+        os.ftruncate(self.fd, 0)
+
+        return True
+
+
+class CallableSink(Sink):
+
+    def __init__(self, func):
+        """
+        Initializes a sink which calls a function with each chunk (ex: to
+            feed an object-store multipart upload).
+
+        :param func: The function, called with a memoryview of each chunk
+            which is only valid during the call.
+        :type  func: function
+        """
+
+        self.func = func
+
+    def write(self, chunk):
+        self.func(chunk)
+
+
+class BufferSink(Sink):
+
+    seekable = True
+    readable = True
+
+    def __init__(self, buffer):
+        """
+        Initializes a sink which fills a preallocated writable buffer (ex:
+            a bytearray, a writable mmap or a NumPy array). The response is
+            read straight into the buffer, with no intermediate copy.
+
+        :param buffer: The buffer, at least as large as the file.
+        :type  buffer: object supporting the buffer protocol
+        """
+
+        self.view = memoryview(buffer).cast('B')
+        if self.view.readonly:
+            raise TypeError("The buffer of a BufferSink must be writable.")
+
+        self.pos = 0
+
+    def open(self, size):
+
+        if size is not None and size > len(self.view):
+            raise DownloadError(f"The buffer ({len(self.view)} bytes) is "
+                                f"too small for the file ({size} bytes)")
+
+    def view_at(self, offset, nbytes):
+        """
+        Returns the part of the buffer a chunk at the given offset is read
+            into.
+        """
+
+        return self.view[offset:offset + nbytes]
+
+    def write(self, chunk):
+
+        end = self.pos + len(chunk)
+        if end > len(self.view):
+            raise DownloadError(f"The buffer ({len(self.view)} bytes) is "
+                                f"too small for the file")
+
+        self.view[self.pos:end] = chunk
+        self.pos = end
+
+    def write_at(self, offset, chunk):
+        self.view[offset:offset + len(chunk)] = chunk
+
+    def read_at(self, offset, nbytes):
+        return self.view[offset:offset + nbytes]
+
+    def reset(self):
+
+        self.pos = 0
+
+        return True
+
+    def close(self):
+        # Release the buffer (an mmap can't be closed while it is exported)
+        self.view.release()
+
+
+def _writable_buffer(target):
+
+    try:
+        with memoryview(target) as view:
+            return not view.readonly
+    except TypeError:
+        return False
+
+
+def make_sink(target):
+    """
+    Gets the sink for a download target: a Sink, an open binary file
+        object, a callable or a writable buffer.
+
+    :rtype: Sink
+    """
+
+    if isinstance(target, Sink):
+        return target
+
+    if isinstance(target, (str, os.PathLike)):
+        raise TypeError("File paths are not sinks; use Downloader.download "
+                        "to download to a file.")
+
+    # Before file objects: a writable mmap also has a write method, but is
+    #   filled in place (and in parallel segments) as a buffer
+    if _writable_buffer(target):
+        return BufferSink(target)
+
+    if hasattr(target, 'write'):
+        return FileObjectSink(target)
+
+    if callable(target):
+        return CallableSink(target)
+
+    try:
+        return BufferSink(target)
+    except TypeError:
+        raise TypeError(f"Can't download into {type(target).__name__}; "
+                        f"expected a file path, a binary file object, a "
+                        f"callable or a writable buffer.")
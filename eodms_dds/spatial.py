@@ -0,0 +1,332 @@
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from .features import Feature
+
+MAGIC = b'EODMSRT1'
+
+
+def _intersects(boxes, index, west, south, east, north):
+
+    offset = index * 4
+
+    return boxes[offset] <= east and boxes[offset + 2] >= west and \
+        boxes[offset + 1] <= north and boxes[offset + 3] >= south
+
+
+def _distance(boxes, index, x, y):
+    """
+    Gets the distance from a point to a box (0 inside).
+    """
+
+    offset = index * 4
+    dx = max(boxes[offset] - x, 0, x - boxes[offset + 2])
+    dy = max(boxes[offset + 1] - y, 0, y - boxes[offset + 3])
+
+    return math.hypot(dx, dy)
+
+
+def _str_order(boxes, capacity):
+    """
+    Gets the Sort-Tile-Recursive order of boxes: sorted by centre x into
+        vertical slices of about sqrt(n / capacity) nodes, and each slice
+        sorted by centre y.
+    """
+
+    count = len(boxes) // 4
+    node_count = math.ceil(count / capacity)
+    slice_size = math.ceil(math.sqrt(node_count)) * capacity
+
+    order = sorted(range(count),
+                   key=lambda index: boxes[index * 4] + boxes[index * 4 + 2])
+
+    for start in range(0, count, slice_size):
+        order[start:start + slice_size] = sorted(
+            order[start:start + slice_size],
+            key=lambda index: boxes[index * 4 + 1] + boxes[index * 4 + 3])
+
+    return order
+
+
+class SpatialIndex():
+
+    def __init__(self, bboxes, ids=None, node_capacity=16):
+        """
+        Initializes a static R-tree over bounding boxes, bulk-loaded with
+            Sort-Tile-Recursive packing, for bbox intersection and nearest
+            neighbour queries.
+
+        Coordinates are in degrees and distances are planar. A bbox
+            crossing the antimeridian (west > east) is indexed as two
+            boxes. Items with no bbox (nan) are left out.
+
+        :param bboxes: The bounding boxes (west, south, east, north) of the
+            items.
+        :type  bboxes: iterable
+        :param ids: The Ids returned for the items (by default, their
+            positions). They must be JSON serializable to save the index.
+        :type  ids: list
+        :param node_capacity: The maximum number of children per node.
+        :type  node_capacity: int
+        """
+
+        self.node_capacity = node_capacity
+
+        boxes = array('d')
+        items = array('q')
+        positions = []
+        for position, bbox in enumerate(bboxes):
+            west, south, east, north = (float(coord) for coord in bbox[:4])
+            positions.append(position)
+            if math.isnan(west) or math.isnan(south):
+                continue
+            if west > east:
+                boxes.extend((west, south, 180.0, north))
+                items.append(position)
+                west = -180.0
+            boxes.extend((west, south, east, north))
+            items.append(position)
+
+        self.ids = list(ids) if ids is not None else positions
+
+        # The boxes of the items (level 0) and of the nodes of each level,
+        #   with the range of the children of each node in the level below
+        self._boxes = []
+        self._ranges = [None]
+        self._items = array('q')
+
+        if not items:
+            self._boxes.append(array('d'))
+            return
+
+        order = _str_order(boxes, node_capacity)
+        self._items = array('q', (items[index] for index in order))
+        level = array('d')
+        for index in order:
+            level.extend(boxes[index * 4:index * 4 + 4])
+        self._boxes.append(level)
+
+        while len(level) > 4:
+            nodes = array('d')
+            ranges = array('q')
+            count = len(level) // 4
+            for start in range(0, count, node_capacity):
+                end = min(start + node_capacity, count)
+                children = level[start * 4:end * 4]
+                nodes.extend((min(children[0::4]), min(children[1::4]),
+                              max(children[2::4]), max(children[3::4])))
+                ranges.extend((start, end))
+
+            # Pack the nodes themselves, so their parents stay compact
+            order = _str_order(nodes, node_capacity)
+            level = array('d')
+            level_ranges = array('q')
+            for index in order:
+                level.extend(nodes[index * 4:index * 4 + 4])
+                level_ranges.extend(ranges[index * 2:index * 2 + 2])
+
+            self._boxes.append(level)
+            self._ranges.append(level_ranges)
+
+    @classmethod
+    def from_features(cls, features, node_capacity=16):
+        """
+        Creates the index of search results, returning their feature Ids.
+
+        :param features: The features (a FeatureSet, Features or GeoJSON
+            dictionaries).
+        :type  features: iterable
+
+        :rtype: SpatialIndex
+        """
+
+        ids = []
+        bboxes = []
+        for feature in features:
+            if not isinstance(feature, Feature):
+                feature = Feature.from_dict(feature)
+            ids.append(feature.id)
+            bboxes.append(feature.bbox)
+
+        return cls(bboxes, ids, node_capacity)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def bbox(self):
+        """
+        The bounding box of all the items (None if empty).
+        """
+
+        root = self._boxes[-1]
+        if not root:
+            return None
+
+        return tuple(root[0:4])
+
+    def intersects(self, bbox):
+        """
+        Gets the items whose bbox intersects a bbox (which may cross the
+            antimeridian).
+
+        :param bbox: The bbox (west, south, east, north).
+        :type  bbox: list
+
+        :return: The Ids of the items.
+        :rtype:  list
+        """
+
+        west, south, east, north = (float(coord) for coord in bbox[:4])
+
+        if west > east:
+            found = self._search(west, south, 180.0, north)
+            found |= self._search(-180.0, south, east, north)
+        else:
+            found = self._search(west, south, east, north)
+
+        return [self.ids[position] for position in sorted(found)]
+
+    def _search(self, west, south, east, north):
+
+        top = len(self._boxes) - 1
+        nodes = range(len(self._boxes[top]) // 4)
+
+        for level in range(top, 0, -1):
+            boxes = self._boxes[level]
+            ranges = self._ranges[level]
+            children = []
+            for index in nodes:
+                if _intersects(boxes, index, west, south, east, north):
+                    children.extend(range(ranges[index * 2],
+                                          ranges[index * 2 + 1]))
+            nodes = children
+
+        boxes = self._boxes[0]
+
+        return {self._items[index] for index in nodes
+                if _intersects(boxes, index, west, south, east, north)}
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        """
+        Gets the k items nearest to a point (at distance 0 if their bbox
+            contains it).
+
+        :param x: The longitude.
+        :type  x: float
+        :param y: The latitude.
+        :type  y: float
+        :param k: The number of items.
+        :type  k: int
+        :param max_distance: The maximum distance in degrees.
+        :type  max_distance: float
+
+        :return: The Ids of the items and their distances, nearest first.
+        :rtype:  list of tuple
+        """
+
+        top = len(self._boxes) - 1
+        heap = [(_distance(self._boxes[top], index, x, y), top, index)
+                for index in range(len(self._boxes[top]) // 4)]
+        heapq.heapify(heap)
+
+        found = []
+        seen = set()
+        while heap and len(found) < k:
+            distance, level, index = heapq.heappop(heap)
+            if max_distance is not None and distance > max_distance:
+                break
+
+            if level == 0:
+                position = self._items[index]
+                if position not in seen:
+                    seen.add(position)
+                    found.append((self.ids[position], distance))
+                continue
+
+            ranges = self._ranges[level]
+            boxes = self._boxes[level - 1]
+            for child in range(ranges[index * 2], ranges[index * 2 + 1]):
+                heapq.heappush(heap, (_distance(boxes, child, x, y),
+                                      level - 1, child))
+
+        return found
+
+    def save(self, fn):
+        """
+        Saves the index to a file.
+
+        :param fn: The file name.
+        :type  fn: str
+        """
+
+        header = json.dumps({
+            'node_capacity': self.node_capacity,
+            'levels': [len(boxes) // 4 for boxes in self._boxes],
+            'ids': self.ids
+        }).encode()
+
+        arrays = list(self._boxes) + self._ranges[1:] + [self._items]
+
+        fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)),
+                                      suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for values in arrays:
+                f.write(_to_little_endian(values).tobytes())
+        os.replace(tmp_fn, fn)
+
+    @classmethod
+    def load(cls, fn):
+        """
+        Loads an index saved with save.
+
+        :param fn: The file name.
+        :type  fn: str
+
+        :rtype: SpatialIndex
+        """
+
+        with open(fn, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{fn} is not a saved spatial index.")
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len))
+            data = memoryview(f.read())
+
+        levels = header['levels']
+        offset = 0
+
+        def take(typecode, count):
+            nonlocal offset
+            values = array(typecode)
+            nbytes = count * values.itemsize
+            values.frombytes(data[offset:offset + nbytes])
+            offset += nbytes
+            return _to_little_endian(values)
+
+        index = cls.__new__(cls)
+        index.node_capacity = header['node_capacity']
+        index.ids = header['ids']
+        index._boxes = [take('d', count * 4) for count in levels]
+        index._ranges = [None] + [take('q', count * 2)
+                                  for count in levels[1:]]
+        index._items = take('q', levels[0])
+
+        return index
+
+
+def _to_little_endian(values):
+    # Saved files are little-endian; swapping twice restores the order
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
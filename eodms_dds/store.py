@@ -0,0 +1,289 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from . import api_logger
+
+# Errors for which a hard link falls back to a copy
+LINK_ERRNOS = {getattr(errno, name) for name in
+               ('EXDEV', 'EPERM', 'EMLINK', 'ENOTSUP', 'EOPNOTSUPP', 'EACCES')
+               if hasattr(errno, name)}
+
+# The checksums products are indexed by, in order of preference
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+
+
+def preferred_checksum(checksums):
+    """
+    Gets the checksum a product is indexed by from a dictionary mapping
+        hash algorithms to hex digests (ex: download.item_checksums).
+
+    :return: The checksum as '<algorithm>:<hex>', or None.
+    :rtype:  str
+    """
+
+    for algorithm in CHECKSUM_ALGORITHMS:
+        if checksums.get(algorithm):
+            return f'{algorithm}:{checksums[algorithm].lower()}'
+
+    return None
+
+
+def _split_checksum(checksum):
+
+    algorithm, _, value = str(checksum).partition(':')
+    algorithm = algorithm.strip().lower()
+    if not value or algorithm not in hashlib.algorithms_available:
+        return None
+
+    return algorithm, value.strip().lower()
+
+
+class ProductStore():
+
+    def __init__(self, root):
+        """
+        Initializes a local store of downloaded products (ex: on a shared
+            NFS volume) which lets download_item skip products already
+            downloaded by an earlier run or another job.
+
+        Products are indexed by file name and checksum (their content
+            address) when the checksum is known, otherwise by file name,
+            size and ETag, and by item UUID. The index is kept in small
+            JSON files next to the products, so no database locking is
+            needed on network file systems.
+
+        :param root: The root folder of the store.
+        :type  root: str
+        """
+
+        self.root = os.path.abspath(root)
+        self.objects_folder = os.path.join(self.root, 'objects')
+        self.uuids_folder = os.path.join(self.root, 'uuids')
+        self.refs_folder = os.path.join(self.root, 'refs')
+
+        os.makedirs(self.objects_folder, exist_ok=True)
+        os.makedirs(self.uuids_folder, exist_ok=True)
+        os.makedirs(self.refs_folder, exist_ok=True)
+
+        self.logger = api_logger.EODMSLogger('eodms_dds', api_logger.eodms_logger)
+
+    def find(self, basename, item_uuid=None, size=None, etag=None,
+             checksum=None):
+        """
+        Finds a valid stored copy of a product.
+
+        :param basename: The file name of the product.
+        :type  basename: str
+        :param item_uuid: The UUID of the item (used when the checksum, size
+            and ETag are unknown).
+        :type  item_uuid: str
+        :param size: The expected size in bytes.
+        :type  size: int
+        :param etag: The expected ETag (not checked for a product found by
+            its checksum).
+        :type  etag: str
+        :param checksum: The expected checksum ('<algorithm>:<hex>'). A
+            stored product without a checksum of this algorithm is hashed
+            once, and the checksum recorded in its meta.json.
+        :type  checksum: str
+
+        :return: The path of the stored product or None.
+        :rtype:  str
+        """
+
+        if checksum is not None and _split_checksum(checksum) is None:
+            checksum = None
+
+        folder = None
+        if checksum is not None:
+            folder = self._object_folder(basename, checksum=checksum)
+            if not os.path.exists(os.path.join(folder, 'meta.json')):
+                folder = None
+        if folder is None and size is not None:
+            folder = self._ref_folder(self._key_fn(basename, size, etag))
+            if folder is None:
+                # Stored without a ref (by an earlier version)
+                folder = self._object_folder(basename, size, etag)
+        if folder is None and item_uuid is not None:
+            folder = self._ref_folder(self._uuid_fn(item_uuid))
+        if folder is None:
+            return None
+
+        meta = self._read_json(os.path.join(folder, 'meta.json'))
+        if meta is None or meta.get('basename') != basename:
+            return None
+
+        if size is not None and meta.get('size') != size:
+            return None
+        if checksum is None and etag and meta.get('etag') and \
+                meta.get('etag') != etag:
+            return None
+
+        path = os.path.join(folder, basename)
+
+        try:
+            if os.path.getsize(path) != meta['size']:
+                return None
+        except OSError:
+            return None
+
+        if checksum is not None and \
+                not self._check_checksum(folder, meta, path, checksum):
+            return None
+
+        return path
+
+    def add(self, filename, item_uuid=None, size=None, etag=None,
+            checksum=None):
+        """
+        Adds a downloaded product to the store (as a hard link when
+            possible, otherwise as a copy).
+
+        :param filename: The path of the downloaded product.
+        :type  filename: str
+        :param item_uuid: The UUID of the item.
+        :type  item_uuid: str
+        :param size: The size in bytes (defaults to the file size).
+        :type  size: int
+        :param etag: The ETag of the product.
+        :type  etag: str
+        :param checksum: The checksum of the product ('<algorithm>:<hex>',
+            see preferred_checksum), which it is indexed by.
+        :type  checksum: str
+
+        :return: The path of the stored product.
+        :rtype:  str
+        """
+
+        basename = os.path.basename(filename)
+        if size is None:
+            size = os.path.getsize(filename)
+        if checksum is not None:
+            split = _split_checksum(checksum)
+            checksum = f'{split[0]}:{split[1]}' if split else None
+
+        if checksum is not None:
+            folder = self._object_folder(basename, checksum=checksum)
+        else:
+            folder = self._object_folder(basename, size, etag)
+        os.makedirs(folder, exist_ok=True)
+
+        path = os.path.join(folder, basename)
+        if not (os.path.exists(path) and os.path.samefile(path, filename)):
+            self.link(filename, path)
+
+        meta = {
+            "basename": basename,
+            "size": size,
+            "etag": etag,
+            "checksum": checksum
+        }
+        self._write_json(os.path.join(folder, 'meta.json'), meta)
+
+        ref = {
+            "basename": basename,
+            "object": os.path.relpath(folder, self.objects_folder)
+        }
+        self._write_json(self._key_fn(basename, size, etag), ref)
+        if item_uuid is not None:
+            self._write_json(self._uuid_fn(item_uuid), ref)
+
+        return path
+
+    def link(self, src, dest):
+        """
+        Hard-links src to dest (replacing dest), copying the file if a hard
+            link is not possible (ex: across file systems).
+        """
+
+        tmp_fn = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(src, tmp_fn)
+        except OSError as err:
+            if err.errno not in LINK_ERRNOS:
+                raise
+            shutil.copyfile(src, tmp_fn)
+
+        os.replace(tmp_fn, dest)
+
+        return dest
+
+    def _object_folder(self, basename, size=None, etag=None, checksum=None):
+
+        if checksum is not None:
+            key = 'checksum:' + ':'.join(_split_checksum(checksum))
+        else:
+            key = f'{size}:{etag or ""}'
+        digest = hashlib.sha1(key.encode()).hexdigest()
+
+        return os.path.join(self.objects_folder, f'{basename}.{digest[:16]}')
+
+    def _key_fn(self, basename, size, etag):
+
+        digest = hashlib.sha1(f'{size}:{etag or ""}'.encode()).hexdigest()
+        return os.path.join(self.refs_folder, f'{basename}.{digest[:16]}.json')
+
+    def _uuid_fn(self, item_uuid):
+        return os.path.join(self.uuids_folder, f'{item_uuid}.json')
+
+    def _ref_folder(self, ref_fn):
+        """
+        Gets the object folder a ref (by size and ETag or by UUID) points
+            to, or None.
+        """
+
+        ref = self._read_json(ref_fn)
+        if ref is None or not ref.get('object'):
+            return None
+
+        return os.path.join(self.objects_folder, ref['object'])
+
+    def _check_checksum(self, folder, meta, path, checksum):
+        """
+        Checks a stored product against an expected checksum, hashing it
+            if its meta.json has no checksum of the same algorithm.
+        """
+
+        algorithm, value = _split_checksum(checksum)
+
+        known = dict(meta.get('checksums') or {})
+        stored = _split_checksum(meta.get('checksum') or '')
+        if stored is not None:
+            known.setdefault(*stored)
+        if algorithm in known:
+            return known[algorithm] == value
+
+        self.logger.info(f"Computing the {algorithm} checksum of the stored "
+                         f"{meta['basename']}...")
+        hasher = hashlib.new(algorithm)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        if hasher.hexdigest() != value:
+            return False
+
+        known[algorithm] = value
+        self._write_json(os.path.join(folder, 'meta.json'),
+                         dict(meta, checksums=known))
+
+        return True
+
+    def _read_json(self, fn):
+
+        try:
+            with open(fn, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, fn, vals):
+
+        fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(vals, f)
+        os.replace(tmp_fn, fn)
@@ -19,6 +19,11 @@ setup(
         "requests",
         "tqdm",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "otel": ["opentelemetry-api"],
+        "numpy": ["numpy"],
+    },
     # project_urls={
     #     "Source": "https://github.com/eodms-sgdot/py-eodms-rapi", 
     #     "Bug Tracker": "https://github.com/eodms-sgdot/py-eodms-rapi/issues",
@@ -0,0 +1,137 @@
+"""
+Benchmarks the eodms_dds client against the local stub server (no
+    credentials or network needed).
+
+    python tests/bench_stub.py [--requests N] [--size MB] [--rate MB/s]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import StubServer
+
+from eodms_dds import aaa, dds
+from eodms_dds.download import Downloader
+
+
+def _timed(func):
+
+    start = time.perf_counter()
+    func()
+
+    return time.perf_counter() - start
+
+
+def bench_pooling(stub, requests):
+    """
+    Compares item requests over the pooled session with requests which
+        open a new connection each time.
+    """
+
+    results = []
+    for label, keep_alive in (('pooled', True), ('unpooled', False)):
+        stub.state['connections'] = 0
+        aaa_api = aaa.AAA_API('user', 'pass', 'staging',
+                              keep_alive=keep_alive)
+        dds_api = dds.DDS_API(aaa_api, 'staging')
+
+        def run():
+            for index in range(requests):
+                dds_api.get_item('RCMImageProducts', f'item{index}')
+
+        seconds = _timed(run)
+        results.append((label, seconds, stub.state['connections']))
+        aaa_api.close()
+
+    print(f"Item requests ({requests}):")
+    for label, seconds, connections in results:
+        print(f"  {label:<10} {seconds * 1000 / requests:7.2f} ms/request "
+              f"{connections:5d} connections")
+
+
+def bench_segments(stub, folder):
+    """
+    Compares a single stream with parallel Range segments, with the
+        throughput of each connection capped by the stub server.
+    """
+
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+    url = f'{stub.url}/files/bench.zip'
+    dest_fn = os.path.join(folder, 'bench.zip')
+    size = len(stub.state['file'])
+
+    print(f"Download of {size / 1e6:.0f} MB at "
+          f"{stub.state['rate'] / 1e6:.0f} MB/s per connection:")
+    for segments in (1, 2, 4, 8):
+        downloader = Downloader(aaa_api.session, segments=segments,
+                                progress=False)
+        seconds = _timed(lambda: downloader.download(url, dest_fn))
+        os.remove(dest_fn)
+        print(f"  segments={segments:<3} {size / seconds / 1e6:8.1f} MB/s")
+
+    aaa_api.close()
+
+
+def bench_chunks(stub, folder):
+    """
+    Compares fixed chunk sizes with the adaptive chunk size (and reading
+        into a reused buffer) on an uncapped connection.
+    """
+
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+    url = f'{stub.url}/files/bench.zip'
+    dest_fn = os.path.join(folder, 'bench.zip')
+    size = len(stub.state['file'])
+
+    print(f"Download of {size / 1e6:.0f} MB by chunk size:")
+    for label, chunk_size, readinto in (('8 KB', 8 * 1024, False),
+                                        ('64 KB', 64 * 1024, False),
+                                        ('1 MB', 1024 * 1024, False),
+                                        ('adaptive', None, False),
+                                        ('adaptive+readinto', None, True)):
+        chunks = []
+        downloader = Downloader(aaa_api.session, chunk_size=chunk_size,
+                                readinto=readinto, progress=False,
+                                on_chunk=chunks.append)
+        seconds = _timed(lambda: downloader.download(url, dest_fn))
+        os.remove(dest_fn)
+        print(f"  {label:<18} {size / seconds / 1e6:8.1f} MB/s "
+              f"{len(chunks):7d} chunks")
+
+    aaa_api.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200,
+                        help="The number of item requests.")
+    parser.add_argument('--size', type=int, default=32,
+                        help="The size of the downloaded file in MB.")
+    parser.add_argument('--rate', type=float, default=20,
+                        help="The throughput of each connection in MB/s.")
+    args = parser.parse_args()
+
+    logging.getLogger('eodms_dds').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as home, \
+            StubServer(args.size * 1024 * 1024) as stub:
+        os.environ['HOME'] = home
+        os.environ['EODMS_STAGING_DOMAIN'] = stub.url
+
+        bench_pooling(stub, args.requests)
+        bench_chunks(stub, home)
+
+        stub.state['rate'] = args.rate * 1e6
+        bench_segments(stub, home)
+
+
+if __name__ == '__main__':
+    main()
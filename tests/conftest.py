@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from stub_server import StubServer
+
+from eodms_dds import aaa
+from eodms_dds.retry import RetryPolicy
+
+# Command-line scripts which need EODMS credentials, not tests
+collect_ignore = ['features_dds_test.py', 'rapi_dds_test.py',
+                  'stac_dds_test.py']
+
+logging.getLogger('eodms_dds').setLevel(logging.WARNING)
+logging.getLogger('eodms_aaa').setLevel(logging.WARNING)
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def env(stub, tmp_path, monkeypatch):
+    """
+    Points the 'staging' environment at the stub server and keeps the
+        token files in a temporary home folder.
+    """
+
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('EODMS_STAGING_DOMAIN', stub.url)
+
+    return stub
+
+
+@pytest.fixture
+def out(tmp_path):
+    """
+    An empty output folder (the tokens are kept in tmp_path/.eodms).
+    """
+
+    folder = tmp_path / 'out'
+    folder.mkdir()
+
+    return folder
+
+
+@pytest.fixture
+def aaa_api(env):
+
+    api = aaa.AAA_API('user', 'pass', 'staging',
+                      retry_policy=RetryPolicy(backoff=0))
+    yield api
+    api.close()
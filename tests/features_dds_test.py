@@ -1,4 +1,7 @@
 from eodms_dds import dds, aaa, config
+from eodms_dds.catalog import CatalogMirror
+from eodms_dds.features import FeatureSet
+from eodms_dds.search import SearchAPI, parse_interval
 import requests
 from typing import List, Dict, Any, Optional
 import os
@@ -17,14 +20,17 @@ class OGCFeature:
         return self.raw
 
 class OGCFeatureCollection:
-    def __init__(self, collection_dict):
+    def __init__(self, collection_dict, collection=None):
         self.type = collection_dict.get('type')
-        self.features = [OGCFeature(f) for f in collection_dict.get('features', [])]
-        self.raw = collection_dict
+        # The features are kept compact (ids, datetimes and bboxes, with
+        #   the geometries and properties encoded until they are used)
+        self.features = FeatureSet(collection_dict.get('features', []), collection)
+        self.raw = {key: value for key, value in collection_dict.items()
+                    if key != 'features'}
     def __repr__(self):
         return f"OGCFeatureCollection(type={self.type}, features={len(self.features)})"
     def to_dict(self):
-        return self.raw
+        return dict(self.raw, features=[f.to_dict() for f in self.features])
 
 class OGCFeaturesClient:
     def __init__(self, base_url, access_token=None, verify_ssl=True):
@@ -50,7 +56,7 @@ class OGCFeaturesClient:
             params['datetime'] = datetime
         params['limit'] = limit
         
-        all_features = []
+        all_features = FeatureSet(collection=collection_id)
         page_token = None
         page_count = 0
         
@@ -87,7 +93,7 @@ class OGCFeaturesClient:
         # Construct final collection with all features
         final_data = data.copy()
         final_data['features'] = all_features
-        return OGCFeatureCollection(final_data)
+        return OGCFeatureCollection(final_data, collection_id)
 
     def get_feature(self, collection_id, feature_id):
         url = f"{self.base_url}/collections/{collection_id}/items/{feature_id}"
@@ -116,8 +122,17 @@ def get_features(
     environment='prod',
     bbox: Optional[List[float]] = None,
     datetime: Optional[str] = None,
-    limit: int = 10
+    limit: int = 10,
+    workers: int = 1
 ) -> Dict[str, Any]:
+    if workers > 1:
+        # Page through datetime/bbox shards of the query in parallel
+        search_api = SearchAPI(aaa_api, environment)
+        features = search_api.sharded_features(collection_id, bbox, datetime,
+                                               limit, workers=workers)
+        return OGCFeatureCollection({'type': 'FeatureCollection',
+                                     'features': features}, collection_id)
+
     domain_config = config.get_domain_config(environment)
     domain = domain_config['domain']
     search_endpoint = f"{domain}/search"
@@ -130,6 +145,31 @@ def get_features(
 
 # OGC Features: /collections/{collectionId}/items/{featureId}
 
+def get_mirrored_features(
+    collection_id: str,
+    mirror_fn: str,
+    aaa_api=None,
+    environment='prod',
+    bbox: Optional[List[float]] = None,
+    datetime: Optional[str] = None,
+    limit: int = 10,
+    workers: int = 1
+) -> Dict[str, Any]:
+    # Sync the collection into a local SQLite mirror (only the items since
+    #   the previous sync are requested), then query the mirror
+    mirror = CatalogMirror(mirror_fn, SearchAPI(aaa_api, environment))
+    try:
+        start = parse_interval(datetime)[0] if datetime else None
+        counts = mirror.sync(collection_id, bbox=bbox, start=start,
+                             workers=workers)
+        print(f"Synced {mirror_fn}: {counts['added']} new and "
+              f"{counts['updated']} updated features")
+        features = mirror.query(collection_id, bbox, datetime, limit)
+    finally:
+        mirror.close()
+    return OGCFeatureCollection({'type': 'FeatureCollection',
+                                 'features': features}, collection_id)
+
 def get_feature(
     collection_id: str,
     feature_id: str,
@@ -160,11 +200,13 @@ def download(dds_api, collection, item_uuid, out_folder):
 
     return item_info
 
-def run(username, password, collection, feature_id, env, bbox, datetime, limit):
+def run(username, password, collection, feature_id, env, bbox, datetime, limit,
+        workers=1, mirror=None):
     domain_config = config.get_domain_config(env)
     base_url = f"{domain_config['domain']}/search"
     verify_ssl = domain_config.get('verify_ssl', True)
     access_token = None
+    aaa_api = None
     if username and password:
         aaa_api = aaa.AAA_API(username, password, env)
         access_token = aaa_api.get_access_token()
@@ -191,7 +233,14 @@ def run(username, password, collection, feature_id, env, bbox, datetime, limit):
         return
 
     if collection:
-        result = client.get_features(collection, bbox, datetime, limit)
+        if mirror:
+            result = get_mirrored_features(collection, mirror, aaa_api, env,
+                                           bbox, datetime, limit, workers)
+        elif workers > 1:
+            result = get_features(collection, aaa_api, env, bbox, datetime,
+                                  limit, workers)
+        else:
+            result = client.get_features(collection, bbox, datetime, limit)
         print(f"Found {len(result.features)} features in collection '{collection}':")
         for feature in result.features:
             print(f"  - Feature ID: {feature.id}")
@@ -207,7 +256,11 @@ def run(username, password, collection, feature_id, env, bbox, datetime, limit):
               help='Temporal filter as ISO 8601 string or range (e.g., "2020-10-31T00:00:00Z/2020-11-04T23:59:00Z").')
 @click.option('--env', '-e', required=False, default='prod', help='Defaults to "prod". If "staging", define `EODMS_STAGING_DOMAIN` env variable.')
 @click.option('--limit', '-l', required=False, default=10, type=int, help='Maximum number of features to return.')
-def main(username, password, collection, feature_id, bbox, datetime, env, limit):
+@click.option('--workers', '-w', required=False, default=1, type=int,
+              help='Number of datetime/bbox shards searched in parallel (1 pages through the results in order).')
+@click.option('--mirror', '-m', required=False, default=None,
+              help='A SQLite file to sync the collection into and query locally (later runs only fetch new features).')
+def main(username, password, collection, feature_id, bbox, datetime, env, limit, workers, mirror):
     """
     OGC Features CLI for EODMS STAC
     
@@ -232,6 +285,14 @@ def main(username, password, collection, feature_id, bbox, datetime, env, limit)
     \b
     # Filter by bbox and datetime
     python features_dds_test.py -u USER -p PASS -c RCMImageProducts -b "-100,45,-95,50" -d "2020-10-31T00:00:00Z/2020-11-04T23:59:00Z"
+
+    \b
+    # Search a long period with 8 shards in parallel
+    python features_dds_test.py -u USER -p PASS -c RCMImageProducts -d "2020-01-01T00:00:00Z/2023-01-01T00:00:00Z" -l 5000 -w 8
+
+    \b
+    # Mirror a collection since 2023 locally and query the mirror
+    python features_dds_test.py -u USER -p PASS -c RCMImageProducts -d "2023-01-01T00:00:00Z/.." -b "-100,45,-95,50" -m rcm.db
     """
     bbox_list = None
     if bbox:
@@ -242,7 +303,8 @@ def main(username, password, collection, feature_id, bbox, datetime, env, limit)
         except ValueError as e:
             click.echo(f"Error parsing bbox: {e}", err=True)
             return
-    run(username, password, collection, feature_id, env, bbox_list, datetime, limit)
+    run(username, password, collection, feature_id, env, bbox_list, datetime, limit,
+        workers, mirror)
 
 if __name__ == '__main__':
     main()
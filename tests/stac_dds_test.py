@@ -1,4 +1,5 @@
 from eodms_dds import dds, aaa, config
+from eodms_dds.features import FeatureSet
 from pystac_client import Client
 from typing import Optional, List, Dict, Any
 # import json
@@ -15,7 +16,7 @@ def search(aaa_api=None, environment='prod',
                 bbox: Optional[List[float]] = None,
                 datetime: Optional[str] = None,
                 limit = 100,
-                **kwargs) -> List[Dict[str, Any]]:
+                **kwargs) -> FeatureSet:
     """
     Search the EODMS STAC catalog using pystac_client.
     
@@ -25,7 +26,7 @@ def search(aaa_api=None, environment='prod',
     :param bbox: Bounding box as [west, south, east, north]
     :param datetime: Temporal filter as ISO 8601 string or range
     :param kwargs: Additional search parameters
-    :return: List of item dictionaries
+    :return: The items, as compact features
     """
     
     domain_config = config.get_domain_config(environment)
@@ -43,7 +44,7 @@ def search(aaa_api=None, environment='prod',
         access_token = aaa_api.get_access_token()
         if not access_token:
             print("Authentication failed - no access token available")
-            return []
+            return FeatureSet()
         headers = {"Authorization": f"Bearer {access_token}"}
         print(f"Using authenticated search: {search_endpoint}")
     else:
@@ -70,6 +71,7 @@ def search(aaa_api=None, environment='prod',
     search_params = {}
 
     search_params['limit'] = limit
+    search_params['max_items'] = limit
     
     if collections:
         search_params['collections'] = collections
@@ -85,25 +87,18 @@ def search(aaa_api=None, environment='prod',
     
     # Execute search
     try:
-        items = []
-        
         print(f"Searching for up to {limit} items...")
         search = client.search(**search_params, method='GET')
         print(unquote(search.url_with_parameters()))
         
-        search_results = search.item_collection()
-        
-        # Convert to list of dictionaries
-        items = [item.to_dict() for item in search_results]
-        print(f"Retrieved {len(items)} items")
-        
-        # Trim to limit if we retrieved more
-        items = items[:limit]
+        # Stream the item dictionaries page by page into compact features,
+        #   instead of building pystac Items for the whole result
+        items = FeatureSet(search.items_as_dicts())
         print(f"Found {len(items)} items (limited to {limit})")
 
     except Exception as e:
         print(f"Search error: {e}")
-        return []
+        return FeatureSet()
     
     return items
 
@@ -145,7 +140,7 @@ def run(eodms_user, eodms_pwd, collection, env, out_folder, datetime_range=None,
     )
     
     if items and len(items) > 0:
-        uuid = items[0].get('id')
+        uuid = items[0].id
         print(f"Downloading the first image (UUID: {uuid}) from the list")
         download(dds_api, collection, uuid, out_folder)
 
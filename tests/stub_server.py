@@ -0,0 +1,392 @@
+"""
+A local stand-in for the EODMS AAA, DDS, download and search endpoints,
+    used by the tests and benchmarks (no credentials or network needed).
+
+The behaviour of the server is driven by its state dictionary:
+
+- 'file': the bytes served under /files/
+- 'no_ranges': ignore Range headers (and don't send Accept-Ranges)
+- 'cut_after': drop the connection after this many bytes (once)
+- 'corrupt': number of downloads served with a flipped first byte
+- 'md5_header': send a Content-MD5 header on full downloads
+- 'rate': the bytes per second sent on each connection under /files/
+  (None for no limit), to mimic a per-connection throughput cap
+- 'faults': {path_prefix: [status code or 'drop', ...]} served before
+  the normal responses (429 and 503 carry 'Retry-After': '0')
+- 'item_body': {uuid: (status, content type, body)} for odd DDS replies
+- 'processing': {uuid: number of 202 replies before the item is ready}
+  ('pending' UUIDs are never ready)
+- 'expires_in': the Access Token lifetime sent by login and refresh
+- 'features_total', 'page_delay': the size and latency of the search
+- 'hits': the number of requests per path, 'connections': the number of
+  TCP connections accepted
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlparse, parse_qs
+
+
+def feature(index):
+    """
+    Gets the stub search feature at a position: one per hour from
+        2020-01-01, with a 1 degree bbox.
+    """
+
+    acquired = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + \
+        datetime.timedelta(hours=index)
+    x = -140 + (index * 7) % 80
+    y = 42 + (index * 3) % 40
+
+    return {
+        'type': 'Feature',
+        'id': 'f%06d' % index,
+        'bbox': [x, y, x + 1, y + 1],
+        'geometry': {'type': 'Polygon',
+                     'coordinates': [[[x, y], [x + 1, y], [x + 1, y + 1],
+                                      [x, y + 1], [x, y]]]},
+        'properties': {'datetime': acquired.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                       'platform': 'RCM%d' % (index % 3 + 1),
+                       'cloud': index % 100}
+    }
+
+
+def _parse_datetime(value):
+
+    if value in ('', '..'):
+        return None
+
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.state['connections'] += 1
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _count(self, path):
+        with self.server.lock:
+            hits = self.state['hits']
+            hits[path] = hits.get(path, 0) + 1
+
+    def _json(self, code, obj, headers=None):
+
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drop(self):
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+    def _fault(self):
+
+        for prefix, codes in self.state['faults'].items():
+            if self.path.startswith(prefix) and codes:
+                code = codes.pop(0)
+                if code == 'drop':
+                    self._drop()
+                    return True
+                headers = {'Retry-After': '0'} if code in (429, 503) \
+                    else None
+                self._json(code, {'error': 'Fault', 'message': 'injected'},
+                           headers)
+                return True
+
+        return False
+
+    def _tokens(self):
+        return {'access_token': 'a%d' % time.time_ns(),
+                'refresh_token': 'r%d' % time.time_ns(),
+                'expires_in': self.state['expires_in'],
+                'refresh_token_expires_in': 3600}
+
+    def do_POST(self):
+
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._count(urlparse(self.path).path)
+        if self._fault():
+            return
+
+        self._json(200, self._tokens())
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+
+        path = urlparse(self.path).path
+        self._count(path)
+        if self._fault():
+            return
+
+        if path.startswith('/aaa/v1/refresh'):
+            return self._json(200, self._tokens())
+
+        if path.startswith('/dds/v1/item/'):
+            return self._item(path.rstrip('/').split('/')[-1])
+
+        if path.startswith('/search/collections'):
+            return self._search()
+
+        if path.startswith('/files/'):
+            return self._file(head)
+
+        self._json(404, {'error': 'NotFound', 'message': path})
+
+    def _item(self, uuid):
+
+        if uuid in self.state['item_body']:
+            code, content_type, body = self.state['item_body'][uuid]
+            body = body.encode()
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        with self.server.lock:
+            remaining = self.state['processing'].get(uuid, 0)
+            if remaining:
+                self.state['processing'][uuid] = remaining - 1
+
+        if remaining or uuid.startswith('pending'):
+            return self._json(202, {'status': 'PROCESSING'},
+                              {'Retry-After': '0'})
+
+        if uuid.startswith('bad'):
+            return self._json(404, {'error': 'NotFound',
+                                    'message': 'No item found'})
+
+        port = self.server.server_port
+        self._json(200, {
+            'uuid': uuid,
+            'download_url': f'http://127.0.0.1:{port}/files/{uuid}.zip'
+                            f'?X-Amz-Expires=3600'})
+
+    def _file(self, head):
+
+        data = self.state['file']
+        ranges = self.headers.get('Range')
+        start, end = 0, len(data) - 1
+        code = 200
+
+        if ranges and not self.state['no_ranges']:
+            first, last = ranges.split('=')[1].split('-')
+            start = int(first)
+            end = int(last) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            end = min(end, len(data) - 1)
+            code = 206
+
+        body = data[start:end + 1]
+        self.send_response(code)
+        if not self.state['no_ranges']:
+            self.send_header('Accept-Ranges', 'bytes')
+        if code == 206:
+            self.send_header('Content-Range',
+                             f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"stub"')
+        if self.state['md5_header'] and code == 200:
+            self.send_header('Content-MD5', base64.b64encode(
+                hashlib.md5(data).digest()).decode())
+        self.end_headers()
+
+        if head:
+            return
+
+        cut = self.state['cut_after']
+        if cut and len(body) > cut:
+            self.state['cut_after'] = None
+            self.wfile.write(body[:cut])
+            self._drop()
+            return
+
+        if self.state['corrupt']:
+            self.state['corrupt'] -= 1
+            body = bytes([body[0] ^ 1]) + body[1:]
+
+        rate = self.state['rate']
+        if not rate:
+            self.wfile.write(body)
+            return
+
+        block = 64 * 1024
+        for start in range(0, len(body), block):
+            self.wfile.write(body[start:start + block])
+            time.sleep(block / rate)
+
+    def _search(self):
+
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+
+        if len(parts) == 2:
+            return self._json(200, {'collections': [
+                {'id': 'RCMImageProducts', 'title': 'RCM'}]})
+
+        if len(parts) == 5:
+            return self._json(200, feature(int(parts[4][1:])))
+
+        time.sleep(self.state['page_delay'])
+
+        with self.server.lock:
+            if self.state.get('_features') is None:
+                self.state['_features'] = [
+                    feature(index)
+                    for index in range(self.state['features_total'])]
+                self.state['_times'] = [
+                    _parse_datetime(item['properties']['datetime'])
+                    for item in self.state['_features']]
+        features = self.state['_features']
+        times = self.state['_times']
+
+        matches = range(len(features))
+        if 'datetime' in query:
+            first, _, last = query['datetime'].partition('/')
+            first = _parse_datetime(first)
+            last = _parse_datetime(last) if _ else first
+            matches = [index for index in matches
+                       if (first is None or times[index] >= first) and
+                       (last is None or times[index] <= last)]
+        if 'bbox' in query:
+            west, south, east, north = map(float, query['bbox'].split(','))
+            matches = [index for index in matches
+                       if features[index]['bbox'][0] <= east and
+                       features[index]['bbox'][2] >= west and
+                       features[index]['bbox'][1] <= north and
+                       features[index]['bbox'][3] >= south]
+        matches = list(matches)
+
+        limit = int(query.get('limit', 10))
+        offset = int(query.get('page_token', 0))
+        page = [features[index] for index in matches[offset:offset + limit]]
+
+        links = []
+        if offset + limit < len(matches):
+            next_query = dict(query, page_token=str(offset + limit))
+            # The next links of the real API point at an internal host
+            links.append({'rel': 'next',
+                          'href': f'https://internal.example{url.path}?'
+                                  f'{urlencode(next_query)}'})
+
+        self._json(200, {'type': 'FeatureCollection', 'features': page,
+                         'numberMatched': len(matches),
+                         'numberReturned': len(page), 'links': links})
+
+
+class _Server(ThreadingHTTPServer):
+
+    daemon_threads = True
+    # The default backlog (5) drops the SYNs of parallel workers
+    #   connecting at once, which then wait a second to retry
+    request_queue_size = 64
+
+    def handle_error(self, request, client_address):
+        # Clients which hang up early (ex: a failed download) are expected
+        pass
+
+
+class StubServer():
+
+    def __init__(self, file_size=4 * 1024 * 1024):
+        """
+        Initializes the stub server (call start, or use it as a context
+            manager).
+
+        :param file_size: The size of the file served under /files/.
+        :type  file_size: int
+        """
+
+        self.state = {
+            'file': os.urandom(file_size),
+            'no_ranges': False,
+            'cut_after': None,
+            'corrupt': 0,
+            'md5_header': False,
+            'rate': None,
+            'faults': {},
+            'item_body': {},
+            'processing': {},
+            'expires_in': 900,
+            'features_total': 1000,
+            'page_delay': 0,
+            'hits': {},
+            'connections': 0,
+        }
+        self._server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def hits(self, prefix):
+        """
+        Returns the number of requests to the paths starting with prefix.
+        """
+
+        return sum(count for path, count in self.state['hits'].items()
+                   if path.startswith(prefix))
+
+    def reset_features(self, total):
+        """
+        Changes the number of search features.
+        """
+
+        self.state['features_total'] = total
+        self.state['_features'] = None
+
+    def start(self):
+
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.state = self.state
+        self._server.lock = threading.Lock()
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+        return self
+
+    def stop(self):
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,160 @@
+import threading
+import time
+
+from eodms_dds import aaa
+
+
+def test_token_is_reused_while_valid(aaa_api, stub):
+
+    tokens = {aaa_api.get_access_token() for _ in range(5)}
+
+    assert len(tokens) == 1
+    assert stub.hits('/aaa/v1/login') == 1
+    assert stub.hits('/aaa/v1/refresh') == 0
+
+
+def test_short_lived_token_is_not_renewed_on_every_call(env, stub):
+
+    # 125 s tokens are valid for 5 s once the 120 s safety margin is taken
+    #   off, well within the default renew_margin of 60 s
+    stub.state['expires_in'] = 125
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+
+    for _ in range(5):
+        aaa_api.get_access_token()
+
+    assert stub.hits('/aaa/v1/login') == 1
+    assert stub.hits('/aaa/v1/refresh') == 0
+    aaa_api.close()
+
+
+def test_threads_share_one_renewal(env, stub):
+
+    stub.state['expires_in'] = 125
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+    tokens = []
+
+    def run():
+        tokens.append(aaa_api.get_access_token())
+
+    threads = [threading.Thread(target=run) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(tokens)) == 1
+    assert stub.hits('/aaa/v1/') == 1
+    aaa_api.close()
+
+
+def test_corrupt_creds_file_is_read_once(aaa_api, stub):
+
+    token = aaa_api.get_access_token()
+    with open(aaa_api.aaa_creds.cred_fn, 'w') as f:
+        f.write('{"access_token": "a1", "acc')
+
+    imports = []
+    import_vals = aaa_api.aaa_creds.import_vals
+
+    def counted():
+        imports.append(1)
+        return import_vals()
+    aaa_api.aaa_creds.import_vals = counted
+
+    # The valid in-memory token is kept, without reading the file again
+    assert {aaa_api.get_access_token() for _ in range(5)} == {token}
+    assert len(imports) == 1
+    assert stub.hits('/aaa/v1/') == 1
+
+    # Nor is it read again when a new instance finds it corrupt
+    other = aaa.AAA_API('user', 'pass', 'staging')
+    other.aaa_creds.import_vals()
+    assert not other.aaa_creds.file_changed()
+    assert other.aaa_creds.access_token is None
+    other.close()
+
+
+def test_clamp_margin():
+
+    creds = aaa.AAA_Creds()
+    assert creds.clamp_margin(60) == 60
+
+    creds.access_seconds = 900
+    assert creds.clamp_margin(60) == 60
+
+    creds.access_seconds = 180
+    assert creds.clamp_margin(60) == 30
+
+    creds.access_seconds = 100
+    assert creds.clamp_margin(60) == 0
+
+
+def test_other_instances_clamp_the_margin_too(env, stub):
+
+    # An instance (or process) reading the tokens of another from the file
+    #   knows their lifetime as well
+    stub.state['expires_in'] = 125
+    first = aaa.AAA_API('user', 'pass', 'staging')
+    second = aaa.AAA_API('user', 'pass', 'staging')
+
+    token = first.get_access_token()
+    assert second.get_access_token() == token
+    assert second.aaa_creds.access_seconds == 125
+    assert stub.hits('/aaa/v1/') == 1
+
+    first.close()
+    second.close()
+
+
+def _wait_for(condition, timeout=5):
+
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_background_renewer(env, stub):
+
+    # The tokens are usable for 1 s (121 s less the 120 s safety margin)
+    stub.state['expires_in'] = 121
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging', auto_renew=True)
+
+    assert _wait_for(lambda: stub.hits('/aaa/v1/login') == 1)
+    assert _wait_for(lambda: stub.hits('/aaa/v1/refresh') >= 2)
+
+    # The callers find a valid token in memory
+    start = time.monotonic()
+    for _ in range(100):
+        assert aaa_api.get_access_token() == aaa_api.aaa_creds.access_token
+    assert time.monotonic() - start < 0.5
+
+    aaa_api.close()
+    assert aaa_api._renewer is None
+    hits = stub.hits('/aaa/v1/')
+    time.sleep(1.5)
+    assert stub.hits('/aaa/v1/') == hits
+
+
+def test_renewer_waits_for_long_lived_tokens(env, stub):
+
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+    aaa_api.start_renewer()
+    aaa_api.start_renewer()
+
+    assert _wait_for(lambda: stub.hits('/aaa/v1/login') == 1)
+    time.sleep(0.5)
+    token = aaa_api.get_access_token()
+
+    assert stub.hits('/aaa/v1/') == 1
+    # 900 s tokens are renewed 150 s (renew_margin plus 10% of their
+    #   lifetime) before they expire
+    assert aaa_api._renewer_margin() == 150
+    assert [thread.name for thread in threading.enumerate()].count(
+        'eodms_aaa_renewer') == 1
+
+    aaa_api.stop_renewer(5)
+    assert aaa_api.get_access_token() == token
+    aaa_api.close()
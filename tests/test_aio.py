@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from eodms_dds import aaa, aio, locks
+from eodms_dds.exceptions import IncompleteDownloadError, IntegrityError
+from eodms_dds.retry import RetryPolicy
+
+
+def _run(coro_func, retry_policy=None, **kwargs):
+
+    async def main():
+        policy = retry_policy or RetryPolicy(backoff=0)
+        async with aio.AsyncAAA_API('user', 'pass', 'staging',
+                                    retry_policy=policy,
+                                    **kwargs) as aaa_api:
+            return await coro_func(aio.AsyncDDS_API(aaa_api, 'staging'))
+
+    return asyncio.run(main())
+
+
+def test_fetch_item_retries_busy_server(env, stub):
+
+    stub.state['faults'] = {'/dds/v1/item/': [503, 429]}
+
+    item = _run(lambda dds_api: dds_api.fetch_item('RCMImageProducts', 'a'))
+
+    assert item['uuid'] == 'a'
+    assert stub.hits('/dds/v1/item/') == 3
+
+
+def test_token_is_reused(env, stub, tmp_path):
+
+    async def tokens(dds_api):
+        return {await dds_api.aaa.get_access_token() for _ in range(5)}
+
+    assert len(_run(tokens)) == 1
+    assert stub.hits('/aaa/v1/login') == 1
+    assert os.path.exists(tmp_path / '.eodms' /
+                          'aaa_creds.user.staging.json')
+
+
+def test_creds_file_is_checked_off_the_loop(env, stub):
+
+    async def tokens(dds_api):
+        aaa_api = dds_api.aaa
+        checks = []
+        file_changed = aaa_api.aaa_creds.file_changed
+
+        def counted():
+            checks.append(threading.get_ident())
+            return file_changed()
+        aaa_api.aaa_creds.file_changed = counted
+
+        first = {await aaa_api.get_access_token() for _ in range(50)}
+        await asyncio.sleep(0.25)
+        second = await aaa_api.get_access_token()
+        return first | {second}, checks
+
+    loop_thread = threading.get_ident()
+    results, checks = _run(tokens, file_check_interval=0.2)
+
+    assert len(results) == 1
+    # During the login, on the first request after it and after the
+    #   interval
+    assert len(checks) == 3
+    assert loop_thread not in checks
+
+
+def test_renewal_shares_the_lock_of_sync_clients(env, stub, tmp_path):
+
+    cred_fn = str(tmp_path / '.eodms' / 'aaa_creds.user.staging.json')
+    held = threading.Event()
+    logins = []
+
+    def hold():
+        with locks.get_named_lock(cred_fn):
+            held.set()
+            time.sleep(0.3)
+            logins.append(stub.hits('/aaa/v1/login'))
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+
+    async def token(dds_api):
+        start = time.monotonic()
+        await dds_api.aaa.get_access_token()
+        return time.monotonic() - start
+
+    # The async client waits for the lock held by another thread
+    assert _run(token) >= 0.25
+    holder.join()
+    assert logins == [0]
+
+    # Sync and async clients renewing at once log in only once
+    sync_api = aaa.AAA_API('user', 'pass', 'staging')
+    os.remove(cred_fn)
+    env.state['hits'].clear()
+
+    async def both(dds_api):
+        dds_api.aaa.aaa_creds.access_token = None
+        sync_api.aaa_creds.access_token = None
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            dds_api.aaa.get_access_token(),
+            *[loop.run_in_executor(None, sync_api.get_access_token)
+              for _ in range(4)])
+
+    assert len(set(_run(both))) == 1
+    assert env.hits('/aaa/v1/login') == 1
+    sync_api.close()
+
+
+def test_download_resumes_after_dropped_connection(env, stub, tmp_path):
+
+    stub.state['cut_after'] = 1024 * 1024
+
+    async def download(dds_api):
+        item = await dds_api.get_item('RCMImageProducts', 'a')
+        return await dds_api.download_item(str(tmp_path), item)
+
+    dest_fn = _run(download)
+
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == stub.state['file']
+    assert not os.path.exists(f'{dest_fn}.part')
+    assert not os.path.exists(f'{dest_fn}.part.json')
+    assert stub.hits('/files/') == 2
+
+
+def test_download_continues_part_file_on_next_call(env, stub, tmp_path):
+
+    # More than one checkpoint interval is written before the drop
+    stub.state['file'] = os.urandom(20 * 1024 * 1024)
+    stub.state['cut_after'] = 18 * 1024 * 1024
+
+    async def download(dds_api):
+        item = await dds_api.get_item('RCMImageProducts', 'a')
+        return await dds_api.download_item(str(tmp_path), item)
+
+    with pytest.raises(IncompleteDownloadError):
+        _run(download, RetryPolicy(max_retries=0))
+
+    part_fn = tmp_path / 'a.zip.part'
+    assert os.path.getsize(part_fn) >= 16 * 1024 * 1024
+
+    dest_fn = _run(download)
+
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == stub.state['file']
+
+
+def test_download_renames_complete_part_file(env, stub, out):
+
+    data = stub.state['file']
+    with open(out / 'a.zip.part', 'wb') as f:
+        f.write(data)
+    with open(out / 'a.zip.part.json', 'w') as f:
+        json.dump({'size': None, 'etag': None,
+                   'completed': [[0, len(data) - 1]]}, f)
+
+    async def download(dds_api):
+        item = await dds_api.get_item('RCMImageProducts', 'a')
+        return await dds_api.download_item(str(out), item)
+
+    dest_fn = _run(download)
+
+    # A single Range request past the end, answered with a 416
+    assert stub.hits('/files/') == 1
+    assert os.listdir(out) == ['a.zip']
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == data
+
+
+def test_download_verifies_checksums(env, stub, out):
+
+    data = stub.state['file']
+    md5 = hashlib.md5(data).hexdigest()
+
+    def download(**fields):
+        async def run(dds_api):
+            item = await dds_api.get_item('RCMImageProducts', 'a')
+            return await dds_api.download_item(str(out), dict(item, **fields))
+        return run
+
+    # The Content-MD5 header catches a corrupt download, which is started
+    #   over
+    stub.state['md5_header'] = True
+    stub.state['corrupt'] = 1
+    dest_fn = _run(download())
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == data
+    assert stub.hits('/files/') == 2
+
+    # So does the checksum of the item info, including over a resumed part
+    stub.state['md5_header'] = False
+    with open(out / 'a.zip.part', 'wb') as f:
+        f.write(b'x' + data[1:1000])
+    with open(out / 'a.zip.part.json', 'w') as f:
+        json.dump({'size': len(data), 'etag': '"stub"',
+                   'completed': [[0, 999]]}, f)
+    os.remove(dest_fn)
+    stub.state['hits'].clear()
+    assert _run(download(md5=md5)) == dest_fn
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == data
+    assert stub.hits('/files/') == 2
+
+    # A file of the wrong size is never renamed into place
+    os.remove(dest_fn)
+    with pytest.raises(IntegrityError):
+        _run(download(size=len(data) + 1))
+    assert os.listdir(out) == []
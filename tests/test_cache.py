@@ -0,0 +1,84 @@
+import time
+
+from eodms_dds import dds
+from eodms_dds.cache import ItemCache, download_url_expiry
+
+READY = {'uuid': 'a', 'download_url': 'https://host/a.zip'}
+
+
+def test_download_url_expiry():
+
+    assert download_url_expiry('https://host/a.zip?X-Amz-Date='
+                               '20240101T000000Z&X-Amz-Expires=3600') == \
+        1704067200 + 3600
+    assert download_url_expiry('https://host/a.zip?Expires=1704067200') == \
+        1704067200
+    assert download_url_expiry('https://host/a.zip') is None
+    assert download_url_expiry('https://host/a.zip?Expires=soon') is None
+
+
+def test_lru_eviction():
+
+    cache = ItemCache(max_items=2)
+    for uuid in ('a', 'b', 'c'):
+        cache.put('EODMS', 'C', uuid, dict(READY, uuid=uuid))
+
+    assert cache.get('EODMS', 'C', 'a') is None
+    assert cache.get('EODMS', 'C', 'c')['uuid'] == 'c'
+    assert cache.stats()['size'] == 2
+
+
+def test_expired_and_processing_items():
+
+    cache = ItemCache(processing_ttl=0)
+
+    # The presigned URL expires within the expiry margin
+    signed = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    cache.put('EODMS', 'C', 'a', {
+        'download_url': f'https://host/a.zip?X-Amz-Date={signed}'
+                        f'&X-Amz-Expires=60'})
+    cache.put('EODMS', 'C', 'b', {'status': 'PROCESSING'})
+
+    assert cache.get('EODMS', 'C', 'a') is None
+    assert cache.get('EODMS', 'C', 'b') is None
+
+    cache = ItemCache(processing_ttl=0.05)
+    cache.put('EODMS', 'C', 'b', {'status': 'PROCESSING'})
+    assert cache.get('EODMS', 'C', 'b') is not None
+    time.sleep(0.1)
+    assert cache.get('EODMS', 'C', 'b') is None
+
+
+def test_disk_tier_is_shared_between_runs(tmp_path):
+
+    db_fn = str(tmp_path / 'items.db')
+
+    cache = ItemCache(db_fn=db_fn)
+    cache.put('EODMS', 'C', 'a', READY)
+    cache.close()
+
+    cache = ItemCache(db_fn=db_fn)
+    assert cache.get('EODMS', 'C', 'a') == READY
+    assert cache.get('EODMS', 'C', 'a') == READY
+    assert cache.stats()['disk_hits'] == 1
+
+    cache.invalidate('EODMS', 'C', 'a')
+    cache.close()
+
+    assert ItemCache(db_fn=db_fn).get('EODMS', 'C', 'a') is None
+
+
+def test_dds_api_serves_items_from_the_cache(aaa_api, stub):
+
+    cache = ItemCache()
+    dds_api = dds.DDS_API(aaa_api, 'staging', item_cache=cache)
+
+    for _ in range(3):
+        assert dds_api.get_item('RCMImageProducts', 'a')['uuid'] == 'a'
+    items, errors = dds_api.get_items('RCMImageProducts', ['a', 'b', 'c'])
+
+    assert not errors
+    assert sorted(items) == ['a', 'b', 'c']
+    # One request for 'a', then one each for 'b' and 'c'
+    assert stub.hits('/dds/v1/item/') == 3
+    assert cache.stats()['hits'] == 3
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from eodms_dds.catalog import CatalogMirror
+from eodms_dds.search import SearchAPI
+from stub_server import feature
+
+COLLECTION = 'RCMImageProducts'
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def mirror(aaa_api, tmp_path):
+
+    catalog = CatalogMirror(str(tmp_path / 'mirror.db'),
+                            SearchAPI(aaa_api, 'staging', page_size=100),
+                            batch_size=64)
+    yield catalog
+    catalog.close()
+
+
+def _ids(features):
+    return [feature.id for feature in features]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_sync_and_delta_sync(env, mirror, workers):
+
+    env.reset_features(300)
+
+    assert mirror.high_water(COLLECTION) is None
+    first = mirror.sync(COLLECTION, workers=workers)
+    assert (first['added'], first['updated']) == (300, 0)
+    assert mirror.high_water(COLLECTION) == START + timedelta(hours=299)
+
+    # Only the items since the high-water mark (minus the overlap) are
+    #   requested again, and the overlapping ones are left unchanged
+    env.reset_features(350)
+    env.state['hits'].clear()
+    second = mirror.sync(COLLECTION, workers=workers)
+    assert (second['added'], second['updated']) == (50, 0)
+    assert second['sync_id'] > first['sync_id']
+    assert mirror.high_water(COLLECTION) == START + timedelta(hours=349)
+    if workers == 1:
+        # 24 + 1 overlapping and 50 new items, in one page
+        assert env.hits('/search/collections') == 1
+
+    stats = mirror.stats()[COLLECTION]
+    assert stats['items'] == 350
+    assert stats['high_water'] == START + timedelta(hours=349)
+
+    assert _ids(mirror.query(COLLECTION)) == \
+        [feature(index)['id'] for index in range(350)]
+
+
+def test_changed_items_are_updated(env, mirror):
+
+    env.reset_features(50)
+    mirror.sync(COLLECTION)
+
+    env.state['_features'][45]['properties']['cloud'] = 99
+    result = mirror.sync(COLLECTION)
+
+    assert (result['added'], result['updated']) == (0, 1)
+    assert mirror.query(COLLECTION, datetime='2020-01-02T21:00:00Z')[0] \
+        .get('cloud') == 99
+
+
+def test_query(env, mirror):
+
+    env.reset_features(500)
+    mirror.sync(COLLECTION)
+    features = [feature(index) for index in range(500)]
+
+    bbox = (-120, 50, -110, 60)
+    expected = [f['id'] for f in features
+                if f['bbox'][0] <= bbox[2] and f['bbox'][2] >= bbox[0] and
+                f['bbox'][1] <= bbox[3] and f['bbox'][3] >= bbox[1]]
+    assert expected
+    assert _ids(mirror.query(COLLECTION, bbox=bbox)) == expected
+
+    found = mirror.query(COLLECTION, datetime='2020-01-02T00:00:00Z/'
+                                             '2020-01-02T05:00:00Z')
+    assert _ids(found) == [feature(index)['id'] for index in range(24, 30)]
+    assert found[0].to_dict()['geometry'] == features[24]['geometry']
+
+    found = mirror.query(COLLECTION, bbox=bbox,
+                         datetime='2020-01-05T00:00:00Z/..', limit=3)
+    assert _ids(found) == [f['id'] for f in features[96:]
+                           if f['id'] in expected][:3]
+
+    assert len(mirror.query('other')) == 0
+    # A bbox crossing the antimeridian
+    assert _ids(mirror.query(COLLECTION, bbox=(170, 40, -139.5, 45))) == \
+        [f['id'] for f in features
+         if f['bbox'][0] <= -139.5 and f['bbox'][1] <= 45]
+
+
+def test_whats_new(env, mirror):
+
+    env.reset_features(100)
+    mirror.sync(COLLECTION)
+
+    assert len(mirror.whats_new(COLLECTION)) == 100
+    assert len(mirror.whats_new(COLLECTION)) == 0
+
+    env.reset_features(120)
+    mirror.sync(COLLECTION)
+
+    # Each reader has its own feed, and peeking leaves it unread
+    assert _ids(mirror.whats_new(COLLECTION, mark=False)) == \
+        [feature(index)['id'] for index in range(100, 120)]
+    assert len(mirror.whats_new(COLLECTION)) == 20
+    assert len(mirror.whats_new(COLLECTION)) == 0
+    assert len(mirror.whats_new(COLLECTION, reader='other')) == 120
+
+
+def test_mirror_is_persistent(env, aaa_api, tmp_path):
+
+    env.reset_features(40)
+    db_fn = str(tmp_path / 'mirror.db')
+    catalog = CatalogMirror(db_fn, SearchAPI(aaa_api, 'staging'))
+    catalog.sync(COLLECTION)
+    catalog.close()
+
+    catalog = CatalogMirror(db_fn)
+    try:
+        assert len(catalog.query(COLLECTION)) == 40
+        assert catalog.high_water(COLLECTION) == START + timedelta(hours=39)
+        with pytest.raises(ValueError):
+            catalog.sync(COLLECTION)
+    finally:
+        catalog.close()
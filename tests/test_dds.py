@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from eodms_dds import dds
+from eodms_dds.cache import ItemCache
+from eodms_dds.exceptions import DDSError
+
+COLLECTION = 'RCMImageProducts'
+ITEM = '/dds/v1/item/EODMS/RCMImageProducts/'
+
+
+@pytest.fixture
+def dds_api(aaa_api):
+    return dds.DDS_API(aaa_api, 'staging')
+
+
+def test_get_items(dds_api, stub):
+
+    uuids = [f'item{index}' for index in range(20)]
+    items, errors = dds_api.get_items(
+        COLLECTION, uuids + ['item3', 'pending1', 'bad1', 'bad2'],
+        max_workers=4)
+
+    # In the order of the UUIDs, without duplicates, and with the items
+    #   still being processed
+    assert list(items) == uuids + ['pending1']
+    assert items['item7']['uuid'] == 'item7'
+    assert items['pending1'] == {'status': 'PROCESSING'}
+    assert list(errors) == ['bad1', 'bad2']
+    assert all(isinstance(err, DDSError) and err.status_code == 404
+               for err in errors.values())
+
+    assert stub.hits('/dds/v1/item/') == 23
+    assert stub.hits('/aaa/v1/login') == 1
+    assert dds_api.img_info is None
+
+
+def test_get_items_share_the_pool(dds_api, stub):
+
+    # The first request logs in, so the workers start with a valid token
+    dds_api.get_item(COLLECTION, 'item0')
+    connections = stub.state['connections']
+
+    seen = set()
+    lock = threading.Lock()
+    fetch_item = dds_api.fetch_item
+
+    def record(*args, **kwargs):
+        with lock:
+            seen.add(threading.get_ident())
+        return fetch_item(*args, **kwargs)
+
+    dds_api.fetch_item = record
+    items, errors = dds_api.get_items(
+        COLLECTION, [f'item{index}' for index in range(40)], max_workers=4)
+
+    assert len(items) == 40 and not errors
+    assert 1 < len(seen) <= 4
+    # At most one new connection per worker
+    assert stub.state['connections'] - connections <= 4
+    assert stub.hits('/aaa/v1/') == 1
+
+
+def test_await_ready(aaa_api, stub):
+
+    cache = ItemCache()
+    dds_api = dds.DDS_API(aaa_api, 'staging', item_cache=cache)
+    stub.state['processing'] = {'slow': 3, 'quick': 1}
+
+    start = time.monotonic()
+    results = []
+    for item_uuid, item_info, err in dds_api.await_ready(
+            COLLECTION, ['slow', 'quick', 'ready', 'bad1', 'quick'],
+            initial_delay=0.05, backoff=2, jitter=0):
+        results.append((item_uuid, time.monotonic() - start, err))
+
+    # Each item is yielded as soon as it is ready, and errors right away
+    assert [result[0] for result in results] == \
+        ['ready', 'bad1', 'quick', 'slow']
+    assert isinstance(results[1][2], DDSError)
+    assert results[1][2].status_code == 404
+    assert results[3][2] is None
+
+    # Polled at 0, 0.05, 0.15 and 0.35 s
+    assert 0.35 <= results[3][1] < 1
+    assert stub.hits(ITEM + 'slow') == 4
+    assert stub.hits(ITEM + 'quick') == 2
+
+    # The ready items are cached for the downloads
+    assert cache.get('EODMS', COLLECTION, 'slow')['uuid'] == 'slow'
+
+
+def test_await_ready_timeout_and_transient_errors(dds_api, stub):
+
+    stub.state['processing'] = {'item1': 1}
+    stub.state['faults'] = {ITEM + 'item1': [503] * 3}
+
+    results = list(dds_api.await_ready(
+        COLLECTION, ['item1', 'pending1'], timeout=0.5, initial_delay=0.01,
+        max_delay=0.05))
+
+    assert results[0][0] == 'item1' and results[0][2] is None
+    assert results[1][0] == 'pending1'
+    assert results[1][1] is None
+    assert 'Timed out' in str(results[1][2])
+    assert stub.hits(ITEM + 'pending1') > 5
@@ -0,0 +1,352 @@
+import errno
+import hashlib
+import json
+import os
+import random
+import threading
+
+import pytest
+import requests
+
+from eodms_dds import dds, download
+from eodms_dds.download import INITIAL_CHUNK_SIZE, Downloader, \
+    SegmentHasher
+from eodms_dds.exceptions import IntegrityError
+from eodms_dds.retry import RetryPolicy
+
+
+def _url(stub, name='a.zip'):
+    return f'{stub.url}/files/{name}'
+
+
+def _read(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def downloader(aaa_api):
+
+    def make(**kwargs):
+        kwargs.setdefault('progress', False)
+        return Downloader(aaa_api.session, **kwargs)
+
+    return make
+
+
+@pytest.mark.parametrize('write_mode', ['pwrite', 'mmap', 'seek'])
+def test_segmented_download(downloader, stub, out, write_mode):
+
+    dest_fn = str(out / 'a.zip')
+    downloader(segments=4, write_mode=write_mode).download(_url(stub),
+                                                           dest_fn)
+
+    assert _read(dest_fn) == stub.state['file']
+    # The probe and one request per segment
+    assert stub.hits('/files/') == 5
+    assert os.listdir(out) == ['a.zip']
+
+
+def test_segmented_download_without_ranges(downloader, stub, out):
+
+    stub.state['no_ranges'] = True
+
+    dest_fn = str(out / 'a.zip')
+    downloader(segments=4).download(_url(stub), dest_fn)
+
+    assert _read(dest_fn) == stub.state['file']
+    assert stub.hits('/files/') == 2
+
+
+def test_download_item_with_segments(aaa_api, stub, out):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    dds_api.get_item('RCMImageProducts', 'a')
+
+    dest_fn = dds_api.download_item(str(out), segments=3,
+                                    progress=False)
+
+    assert dest_fn == str(out / 'a.zip')
+    assert _read(dest_fn) == stub.state['file']
+
+
+def _write_part(out, data, size):
+    """
+    Writes a part file and its checkpoint, as left by an interrupted
+        download.
+    """
+
+    with open(out / 'a.zip.part', 'wb') as f:
+        f.write(data)
+    with open(out / 'a.zip.part.json', 'w') as f:
+        json.dump({'size': size, 'etag': '"stub"',
+                   'completed': [[0, len(data) - 1]]}, f)
+
+
+def test_download_resumes_after_dropped_connection(downloader, stub, out):
+
+    stub.state['cut_after'] = 1024 * 1024
+
+    dest_fn = str(out / 'a.zip')
+    downloader(retry_policy=RetryPolicy(backoff=0)).download(_url(stub),
+                                                             dest_fn)
+
+    assert _read(dest_fn) == stub.state['file']
+    assert stub.hits('/files/') == 2
+
+
+def test_failed_requests_are_retried_once_over(downloader, stub, out):
+
+    stub.state['faults'] = {'/files/': ['drop'] * 40}
+    policy = RetryPolicy(max_retries=3, backoff=0, failure_threshold=5)
+
+    # The request is retried 3 times, and not the download around it
+    with pytest.raises(requests.exceptions.ConnectionError):
+        downloader(retry_policy=policy).download(_url(stub),
+                                                 str(out / 'a.zip'))
+    assert stub.hits('/files/') == 4
+    assert policy.retries == 3
+    breaker = policy.breaker(f'{stub.url[7:]}/files/a.zip')
+    assert (breaker.state, breaker.failures) == ('closed', 4)
+
+    # A segmented download (probe and 4 segments) with 2 dropped requests
+    stub.state['faults'] = {'/files/': ['drop'] * 2}
+    stub.state['hits'].clear()
+    policy = RetryPolicy(max_retries=3, backoff=0, failure_threshold=5)
+    downloader(segments=4, retry_policy=policy).download(
+        _url(stub), str(out / 'a.zip'))
+    assert _read(out / 'a.zip') == stub.state['file']
+    assert stub.hits('/files/') == 7
+
+
+def test_download_resumes_part_file(downloader, stub, out):
+
+    data = stub.state['file']
+    _write_part(out, data[:1000], len(data))
+
+    dest_fn = str(out / 'a.zip')
+    downloader().download(_url(stub), dest_fn)
+
+    assert _read(dest_fn) == data
+    assert os.listdir(out) == ['a.zip']
+
+
+def test_complete_part_file_is_only_renamed(downloader, stub, out):
+
+    data = stub.state['file']
+    _write_part(out, data, len(data))
+
+    downloader(checksums={'md5': hashlib.md5(data).hexdigest()}).download(
+        _url(stub), str(out / 'a.zip'))
+
+    assert stub.hits('/files/') == 0
+    assert os.listdir(out) == ['a.zip']
+
+
+def test_complete_part_file_of_unknown_size(downloader, stub, out):
+
+    # The server answers the Range past the end with a 416
+    data = stub.state['file']
+    _write_part(out, data, None)
+
+    downloader().download(_url(stub), str(out / 'a.zip'))
+
+    assert stub.hits('/files/') == 1
+    assert _read(out / 'a.zip') == data
+
+
+def test_part_file_larger_than_remote_file(downloader, stub, out):
+
+    data = stub.state['file']
+    _write_part(out, data + b'extra', None)
+
+    downloader().download(_url(stub), str(out / 'a.zip'))
+
+    assert stub.hits('/files/') == 2
+    assert _read(out / 'a.zip') == data
+
+
+def test_interrupted_rename_is_resumed(downloader, stub, out, monkeypatch):
+
+    replace = os.replace
+
+    def fail(src, dst):
+        if dst.endswith('.zip'):
+            raise OSError('disk removed')
+        replace(src, dst)
+
+    dest_fn = str(out / 'a.zip')
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'replace', fail)
+        with pytest.raises(OSError):
+            downloader().download(_url(stub), dest_fn)
+
+    assert stub.hits('/files/') == 1
+
+    downloader().download(_url(stub), dest_fn)
+
+    assert stub.hits('/files/') == 1
+    assert _read(dest_fn) == stub.state['file']
+
+
+def test_adaptive_chunk_size_grows_on_fast_link(downloader, stub, out):
+
+    sizes = []
+    downloader(on_chunk=sizes.append).download(_url(stub),
+                                               str(out / 'a.zip'))
+
+    assert sum(sizes) == len(stub.state['file'])
+    assert max(sizes) > INITIAL_CHUNK_SIZE
+    assert len(sizes) < len(stub.state['file']) // INITIAL_CHUNK_SIZE
+
+
+@pytest.mark.parametrize('readinto', [False, True])
+def test_fixed_chunk_size(downloader, stub, out, readinto):
+
+    sizes = []
+    downloader(chunk_size=64 * 1024, readinto=readinto,
+               on_chunk=sizes.append).download(_url(stub),
+                                               str(out / 'a.zip'))
+
+    assert set(sizes) == {64 * 1024}
+    assert _read(out / 'a.zip') == stub.state['file']
+
+
+def test_segmented_download_verifies_checksums(downloader, stub, out):
+
+    md5 = hashlib.md5(stub.state['file']).hexdigest()
+
+    # The range probe and one segment of the first attempt are corrupted
+    stub.state['corrupt'] = 2
+
+    dest_fn = str(out / 'a.zip')
+    loader = downloader(segments=4, checksums={'md5': md5})
+    loader.download(_url(stub), dest_fn)
+
+    assert loader.digests == {'md5': md5}
+    assert _read(dest_fn) == stub.state['file']
+    # Both attempts probe the file and fetch 4 segments
+    assert stub.hits('/files/') == 10
+
+
+def test_segment_hasher():
+
+    data = os.urandom(1000003)
+    read_back = []
+
+    def read_at(offset, nbytes):
+        read_back.append(nbytes)
+        return data[offset:offset + nbytes]
+
+    hasher = SegmentHasher(['md5', 'sha256'], read_at)
+    chunks = [(start, data[start:start + 997])
+              for start in range(0, len(data), 997)]
+    # Only the ranges written ahead of the prefix are read back
+    hasher.add(0, 997)
+    first, rest = chunks[1:200], chunks[200:]
+    random.shuffle(rest)
+
+    def write(chunks):
+        for offset, chunk in chunks:
+            hasher.update(offset, chunk)
+
+    threads = [threading.Thread(target=write, args=(rest[index::3],))
+               for index in range(3)]
+    threads.append(threading.Thread(target=write, args=(first,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert hasher.pos == len(data)
+    assert hasher.hashers['md5'].hexdigest() == hashlib.md5(data).hexdigest()
+    assert hasher.hashers['sha256'].hexdigest() == \
+        hashlib.sha256(data).hexdigest()
+    assert 997 <= sum(read_back) < len(data)
+
+
+def test_segments_are_hashed_as_they_are_written(downloader, stub, out,
+                                                 monkeypatch):
+
+    data = stub.state['file']
+    md5 = hashlib.md5(data).hexdigest()
+
+    def second_pass(*args):
+        raise AssertionError("The finished file was read again")
+    monkeypatch.setattr(Downloader, '_hash_prefix', second_pass)
+
+    for write_mode in ('pwrite', 'mmap', 'seek'):
+        loader = downloader(segments=4, write_mode=write_mode,
+                            checksums={'md5': md5})
+        loader.download(_url(stub), str(out / 'a.zip'))
+        assert loader.digests == {'md5': md5}
+
+    # A resumed download also hashes the ranges of the previous attempt
+    _write_part(out, data[:1000], len(data))
+    with open(out / 'a.zip.part', 'ab') as f:
+        f.truncate(len(data))
+    loader = downloader(segments=4, checksums={'md5': md5})
+    loader.download(_url(stub), str(out / 'a.zip'))
+    assert loader.digests == {'md5': md5}
+    assert _read(out / 'a.zip') == data
+
+
+def test_segmented_download_with_bad_checksum(downloader, stub, out):
+
+    loader = downloader(segments=4, checksums={'md5': '0' * 32},
+                        verify_retries=0)
+
+    with pytest.raises(IntegrityError):
+        loader.download(_url(stub), str(out / 'a.zip'))
+
+    assert os.listdir(out) == []
+
+
+def test_preallocate(tmp_path, monkeypatch):
+
+    fn = str(tmp_path / 'a.part')
+    with open(fn, 'wb') as f:
+        assert download.preallocate(f.fileno(), 0, 0) is False
+        if download.preallocate(f.fileno(), 1024, 4096):
+            # Extended to the end of the part
+            assert os.fstat(f.fileno()).st_size == 5120
+
+        def unsupported(fd, offset, length):
+            raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        monkeypatch.setattr(os, 'posix_fallocate', unsupported, raising=False)
+        assert download.preallocate(f.fileno(), 0, 8192) is False
+
+
+@pytest.mark.parametrize('preallocate', [True, False])
+def test_segmented_download_preallocates(downloader, stub, out, monkeypatch,
+                                         preallocate):
+
+    calls = []
+    monkeypatch.setattr(download, 'preallocate',
+                        lambda fd, offset, length: calls.append(
+                            (os.fstat(fd).st_size, offset, length)) or False)
+
+    dest_fn = str(out / 'a.zip')
+    downloader(segments=4, preallocate=preallocate).download(_url(stub),
+                                                             dest_fn)
+
+    size = len(stub.state['file'])
+    assert _read(dest_fn) == stub.state['file']
+    # The whole file is reserved before any segment is written (and only
+    #   truncated to its size without preallocate)
+    assert calls == ([(0, 0, size)] if preallocate else [])
+
+
+def test_full_disk_is_reported_before_downloading(downloader, stub, out,
+                                                  monkeypatch):
+
+    def full(fd, offset, length):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+    monkeypatch.setattr(os, 'posix_fallocate', full, raising=False)
+
+    with pytest.raises(OSError) as err:
+        downloader(segments=4).download(_url(stub), str(out / 'a.zip'))
+
+    assert err.value.errno == errno.ENOSPC
+    # Only the probe was sent
+    assert stub.hits('/files/') == 1
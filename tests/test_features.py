@@ -0,0 +1,184 @@
+import math
+import pickle
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from eodms_dds import features as features_module
+from eodms_dds.features import Feature, FeatureSet
+from stub_server import feature
+
+np = features_module.np
+needs_numpy = pytest.mark.skipif(np is None, reason="numpy is not installed")
+
+
+def test_from_dict():
+
+    item = feature(30)
+    compact = Feature.from_dict(item, 'RCMImageProducts')
+
+    assert compact.id == 'f000030'
+    assert compact.collection == 'RCMImageProducts'
+    assert compact.bbox == tuple(float(coord) for coord in item['bbox'])
+    assert compact.datetime == datetime(2020, 1, 2, 6, tzinfo=timezone.utc)
+
+    # The geometry and properties stay encoded until they are used
+    assert isinstance(compact._properties, bytes)
+    assert compact._peek_properties()['cloud'] == 30
+    assert isinstance(compact._properties, bytes)
+    assert compact.get('platform') == 'RCM1'
+    assert compact.geometry == item['geometry']
+
+    assert compact.to_dict() == dict(item, bbox=compact.to_dict()['bbox'],
+                                     collection='RCMImageProducts')
+
+
+def test_from_dict_without_bbox_or_datetime():
+
+    # The bbox is computed from the geometry, or is taken from a 3D bbox
+    polygon = {'type': 'MultiPolygon', 'coordinates': [
+        [[[10, 20], [12, 20], [12, 21], [10, 20]]],
+        [[[-5, 25], [-4, 25], [-4, 26.5], [-5, 25]]]]}
+    assert Feature.from_dict({'id': 'a', 'geometry': polygon}).bbox == \
+        (-5.0, 20.0, 12.0, 26.5)
+    collection = {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': [1, 2]},
+        {'type': 'LineString', 'coordinates': [[3, -4], [5, 6]]}]}
+    assert Feature.from_dict({'id': 'b', 'geometry': collection}).bbox == \
+        (1.0, -4.0, 5.0, 6.0)
+    assert Feature.from_dict({'id': 'c', 'bbox': [1, 2, 0, 3, 4, 100]}) \
+        .bbox == (1.0, 2.0, 3.0, 4.0)
+
+    compact = Feature.from_dict({'id': 'd', 'collection': 'C',
+                                 'properties': {
+                                     'start_datetime': '2021-05-01T12:00:00'
+                                 }})
+    assert compact.collection == 'C'
+    assert compact.datetime == datetime(2021, 5, 1, 12, tzinfo=timezone.utc)
+    assert math.isnan(compact.bbox[0])
+    assert compact.geometry is None
+    assert 'bbox' not in compact.to_dict()
+
+    compact = Feature.from_dict({'id': 'e', 'properties': {
+        'datetime': 'unknown'}})
+    assert compact.datetime is None
+    assert Feature.from_dict({'id': 'f'}).properties == {}
+
+
+def test_pickle_keeps_the_compact_form():
+
+    compact = Feature.from_dict(feature(5), 'C')
+    assert compact.properties['cloud'] == 5
+
+    state = compact.__getstate__()
+    assert isinstance(state[5], bytes)
+
+    restored = pickle.loads(pickle.dumps(compact))
+    assert restored.to_dict() == compact.to_dict()
+    assert repr(restored) == "Feature('f000005', 'C')"
+
+
+def test_feature_set_indexing():
+
+    features = FeatureSet((feature(index) for index in range(10)), 'C')
+
+    assert len(features) == 10
+    assert [f.id for f in features] == ['f%06d' % index
+                                        for index in range(10)]
+    assert features[3].id == 'f000003'
+    assert features[-1].collection == 'C'
+
+    subset = features[2:5]
+    assert isinstance(subset, FeatureSet)
+    assert [f.id for f in subset] == ['f000002', 'f000003', 'f000004']
+    assert subset.collection == 'C'
+    assert [f.id for f in features[[0, 9]]] == ['f000000', 'f000009']
+    mask = [index % 4 == 0 for index in range(10)]
+    assert [f.id for f in features[mask]] == \
+        ['f000000', 'f000004', 'f000008']
+
+    features.extend([Feature('x'), feature(10)])
+    assert len(features) == 12
+    assert features[-1].collection == 'C'
+
+
+def test_to_columns():
+
+    items = [feature(index) for index in range(3)]
+    items.append({'id': 'none', 'properties': {'cloud': [1, 2]}})
+    features = FeatureSet(items, 'C')
+
+    columns = features.to_columns(['cloud', 'platform'], numpy=False)
+    assert columns['id'] == ['f000000', 'f000001', 'f000002', 'none']
+    assert list(columns['datetime'][:3]) == \
+        [1577836800.0, 1577840400.0, 1577844000.0]
+    assert math.isnan(columns['datetime'][3])
+    assert list(columns['bbox'][:4]) == [-140.0, 42.0, -139.0, 43.0]
+    assert len(columns['bbox']) == 16
+    assert columns['platform'] == ['RCM1', 'RCM2', 'RCM3', None]
+    # Reading the columns doesn't decode the properties of the features
+    assert all(isinstance(f._properties, bytes) for f in features)
+
+
+@needs_numpy
+def test_to_columns_with_numpy():
+
+    items = [feature(index) for index in range(3)]
+    items.append({'id': 'none', 'properties': {'cloud': [1, 2]}})
+    features = FeatureSet(items, 'C')
+
+    columns = features.to_columns(['cloud', 'platform'])
+    assert columns['datetime'].dtype == np.dtype('datetime64[ms]')
+    assert columns['datetime'][1] == np.datetime64('2020-01-01T01:00')
+    assert np.isnat(columns['datetime'][3])
+    assert columns['bbox'].shape == (4, 4)
+    assert np.isnan(columns['bbox'][3]).all()
+    assert columns['cloud'].dtype == object
+    assert columns['cloud'][3] == [1, 2]
+    assert columns['platform'][3] is None
+
+    columns = features[:3].to_columns(['cloud'])
+    assert columns['cloud'].dtype.kind == 'i'
+
+    empty = FeatureSet().to_columns(['cloud'])
+    assert empty['bbox'].shape == (0, 4)
+    assert len(empty['datetime']) == 0
+
+    # A mask computed on the columns selects features
+    features = FeatureSet(feature(index) for index in range(10))
+    columns = features.to_columns(['cloud'])
+    assert [f.id for f in features[columns['cloud'] >= 7]] == \
+        ['f000007', 'f000008', 'f000009']
+    assert [f.id for f in features[np.array([1, 2])]] == \
+        ['f000001', 'f000002']
+
+
+def test_to_columns_without_numpy(monkeypatch):
+
+    monkeypatch.setattr(features_module, 'np', None)
+    features = FeatureSet([feature(0)])
+
+    assert features.to_columns()['id'] == ['f000000']
+    with pytest.raises(ImportError):
+        features.to_columns(numpy=True)
+
+
+def test_feature_is_smaller_than_its_dictionary():
+
+    item = feature(0)
+    compact = Feature.from_dict(item)
+
+    def deep_size(value):
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(deep_size(key) + deep_size(child)
+                        for key, child in value.items())
+        elif isinstance(value, (list, tuple)):
+            size += sum(deep_size(child) for child in value)
+        return size
+
+    compact_size = sys.getsizeof(compact) + deep_size(compact.bbox) + \
+        sys.getsizeof(compact._geometry) + sys.getsizeof(compact._properties)
+
+    assert compact_size < deep_size(item) / 2
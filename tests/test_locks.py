@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from eodms_dds import aaa, locks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GET_TOKEN = """
+from eodms_dds import aaa
+print(aaa.AAA_API('user', 'pass', 'staging').get_access_token())
+"""
+
+HOLD_LOCK = """
+import sys, time
+from eodms_dds import locks
+with locks.FileLock(sys.argv[1]):
+    print('locked', flush=True)
+    time.sleep(float(sys.argv[2]))
+"""
+
+
+def _python(code, *args):
+    return subprocess.Popen([sys.executable, '-c', code] + list(args),
+                            stdout=subprocess.PIPE, text=True,
+                            env=dict(os.environ, PYTHONPATH=ROOT))
+
+
+def test_named_locks():
+
+    assert locks.get_named_lock('a') is locks.get_named_lock('a')
+    assert locks.get_named_lock('a') is not locks.get_named_lock('b')
+
+
+def test_file_lock_between_processes(tmp_path):
+
+    path = str(tmp_path / 'creds.lock')
+    holder = _python(HOLD_LOCK, path, '0.5')
+    assert holder.stdout.readline().strip() == 'locked'
+
+    with pytest.raises(TimeoutError):
+        locks.FileLock(path, timeout=0.1).acquire()
+
+    # Waits for the other process to release it
+    with locks.FileLock(path, timeout=10):
+        assert holder.poll() is not None or holder.wait(10) == 0
+
+
+def test_file_lock_between_threads(tmp_path):
+
+    path = str(tmp_path / 'creds.lock')
+    inside = []
+    overlaps = []
+
+    def run():
+        for _ in range(20):
+            with locks.FileLock(path, poll_interval=0.001):
+                inside.append(1)
+                overlaps.append(len(inside))
+                inside.pop()
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(overlaps) == 80
+    assert max(overlaps) == 1
+
+
+def test_processes_share_one_login(env, tmp_path):
+
+    processes = [_python(GET_TOKEN) for _ in range(4)]
+    tokens = [process.communicate()[0].strip().splitlines()[-1]
+              for process in processes]
+
+    assert all(process.returncode == 0 for process in processes)
+    assert len(set(tokens)) == 1
+    assert env.hits('/aaa/v1/login') == 1
+
+    # The creds file is written atomically, with no temporary file left
+    folder = tmp_path / '.eodms'
+    creds_fn = folder / 'aaa_creds.user.staging.json'
+    assert json.loads(creds_fn.read_text())
+    assert not [path for path in os.listdir(folder) if path.endswith('.tmp')]
+
+    # Another instance in this process reuses the tokens of the file
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging')
+    assert aaa_api.get_access_token() == tokens[0]
+    assert env.hits('/aaa/v1/') == 1
+    aaa_api.close()
+
+
+def test_instances_reuse_each_others_renewal(env):
+
+    # The tokens are usable for 1 s (121 s less the 120 s safety margin)
+    env.state['expires_in'] = 121
+    first = aaa.AAA_API('user', 'pass', 'staging')
+    second = aaa.AAA_API('user', 'pass', 'staging')
+
+    token = first.get_access_token()
+    assert second.get_access_token() == token
+    assert env.hits('/aaa/v1/') == 1
+
+    # A renewal by one instance is picked up by the other from the file
+    time.sleep(1.1)
+    renewed = first.get_access_token()
+    assert renewed != token
+    assert env.hits('/aaa/v1/refresh') == 1
+    assert second.get_access_token() == renewed
+    assert env.hits('/aaa/v1/') == 2
+
+    first.close()
+    second.close()
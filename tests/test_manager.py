@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from eodms_dds import dds
+from eodms_dds.manager import DownloadManager
+
+
+def test_manager_counts_the_bytes_of_segmented_downloads(aaa_api, stub,
+                                                         out):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    manager = DownloadManager(dds_api, str(out), max_transfers=3,
+                              segments=4, chunk_size=16 * 1024)
+    jobs = [manager.add('RCMImageProducts', f'item{index}')
+            for index in range(6)]
+    pending = manager.add('RCMImageProducts', 'pending1')
+    bad = manager.add('RCMImageProducts', 'bad1')
+
+    manager.run()
+
+    size = len(stub.state['file'])
+    for job in jobs:
+        assert job.status == 'downloaded'
+        assert job.bytes == size
+    assert pending.status == 'processing'
+    assert bad.status == 'failed'
+
+    stats = manager.stats()
+    assert stats['bytes'] == 6 * size
+    assert (stats['downloaded'], stats['processing'], stats['failed']) == \
+        (6, 1, 1)
+    assert sorted(path.name for path in out.iterdir()) == \
+        [f'item{index}.zip' for index in range(6)]
+
+
+@pytest.mark.parametrize('order', ['priority', 'smallest', 'largest'])
+def test_order_holds_when_resolution_is_slow(aaa_api, stub, out, order):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    fetch_item = dds_api.fetch_item
+    download_item = dds_api.download_item
+    started = []
+
+    # The first item in the order is the slowest to resolve
+    def slow_fetch(collection, item_uuid, catalog="EODMS"):
+        if item_uuid == 'item0':
+            time.sleep(0.3)
+        return fetch_item(collection, item_uuid, catalog)
+
+    def record(out_folder, item_uuid=None, **kwargs):
+        started.append(item_uuid)
+        return download_item(out_folder, item_uuid=item_uuid, **kwargs)
+
+    dds_api.fetch_item = slow_fetch
+    dds_api.download_item = record
+
+    def run(**kwargs):
+        started.clear()
+        manager = DownloadManager(dds_api, str(out), max_transfers=1,
+                                  order=order, **kwargs)
+        # The sizes are equal, so the priorities decide
+        for index in range(4):
+            manager.add('RCMImageProducts', f'item{index}', priority=index)
+        manager.run()
+        return list(started)
+
+    assert run() == ['item0', 'item1', 'item2', 'item3']
+
+    # Starting early only orders the items resolved so far
+    early = run(start_early=True)
+    assert early[0] != 'item0'
+    assert sorted(early) == ['item0', 'item1', 'item2', 'item3']
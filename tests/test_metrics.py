@@ -0,0 +1,96 @@
+import urllib.request
+
+import pytest
+
+from eodms_dds import dds
+from eodms_dds.metrics import Metrics, registry
+
+
+@pytest.fixture
+def metrics():
+    registry.reset()
+    yield registry
+    registry.reset()
+
+
+def test_registry_and_prometheus_format():
+
+    reg = Metrics(buckets=(0.1, 1))
+    updates = []
+    reg.add_listener(lambda *args: updates.append(args))
+
+    def broken(*args):
+        raise RuntimeError('listener failed')
+    reg.add_listener(broken)
+
+    reg.inc('eodms_requests_total', family='dds', status=200)
+    reg.inc('eodms_requests_total', 2, family='dds', status=200)
+    reg.inc('eodms_requests_total', family='aaa', status=401)
+    reg.set('eodms_download_bytes_per_second', 5.5, host='a"b')
+    for value in (0.05, 0.5, 0.1, 3):
+        reg.observe('eodms_download_seconds', value, host='h')
+
+    assert reg.value('eodms_requests_total', status=200, family='dds') == 3
+    assert reg.total('eodms_requests_total') == 4
+    assert reg.value('eodms_download_seconds', host='h') == 4
+    assert reg.value('missing') == 0
+    # The failing listener doesn't stop the updates or the other listeners
+    assert len(updates) == 8
+    assert updates[0] == ('counter', 'eodms_requests_total', 1,
+                          {'family': 'dds', 'status': 200})
+
+    lines = reg.to_prometheus().splitlines()
+    assert '# TYPE eodms_requests_total counter' in lines
+    assert 'eodms_requests_total{family="dds",status="200"} 3' in lines
+    assert 'eodms_download_bytes_per_second{host="a\\"b"} 5.5' in lines
+    # The buckets are cumulative, and a value on a bound falls in it
+    assert 'eodms_download_seconds_bucket{host="h",le="0.1"} 2' in lines
+    assert 'eodms_download_seconds_bucket{host="h",le="1"} 3' in lines
+    assert 'eodms_download_seconds_bucket{host="h",le="+Inf"} 4' in lines
+    assert 'eodms_download_seconds_sum{host="h"} 3.65' in lines
+    assert 'eodms_download_seconds_count{host="h"} 4' in lines
+
+    reg.reset()
+    assert reg.to_prometheus() == '\n'
+
+
+def test_requests_and_downloads_are_recorded(metrics, aaa_api, stub, out):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    dds_api.get_item('RCMImageProducts', 'item1')
+    dds_api.download_item(str(out), progress=False)
+    dds_api.get_item('RCMImageProducts', 'bad1')
+
+    size = len(stub.state['file'])
+    assert metrics.value('eodms_token_renewals_total', kind='login',
+                         result='success') == 1
+    assert metrics.value('eodms_requests_total', family='aaa', method='POST',
+                         status=200) == 1
+    assert metrics.value('eodms_requests_total', family='dds', method='GET',
+                         status=200) == 1
+    assert metrics.value('eodms_requests_total', family='dds', method='GET',
+                         status=404) == 1
+    assert metrics.total('eodms_download_bytes_total') == size
+
+    # The pooled session connects once per host, and times every response
+    assert metrics.value('eodms_request_seconds', family='dds',
+                         phase='ttfb') == 2
+    assert metrics.value('eodms_request_seconds', family='aaa',
+                         phase='connect') == 1
+    assert metrics.value('eodms_request_seconds', family='dds',
+                         phase='connect') == 0
+
+
+def test_serve_prometheus(metrics):
+
+    metrics.inc('eodms_retries_total', family='dds')
+    server = metrics.serve_prometheus(port=0, addr='127.0.0.1')
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/metrics'
+        with urllib.request.urlopen(url) as resp:
+            body = resp.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'eodms_retries_total{family="dds"} 1' in body.splitlines()
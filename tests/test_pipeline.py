@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from eodms_dds import dds
+from eodms_dds.features import Feature
+from eodms_dds.pipeline import DownloadPipeline
+
+COLLECTION = 'RCMImageProducts'
+
+
+@pytest.fixture
+def dds_api(aaa_api):
+    return dds.DDS_API(aaa_api, 'staging')
+
+
+def test_pipeline_statuses(dds_api, stub, out):
+
+    pipeline = DownloadPipeline(dds_api, str(out), resolve_workers=3,
+                                download_workers=2, queue_size=2)
+    items = ['item0', {'id': 'item1'}, Feature('item2'), 'pending1', 'bad1']
+    items += [f'item{index}' for index in range(3, 10)]
+
+    jobs = {job.item_uuid: job for job in pipeline.run(COLLECTION, items)}
+
+    size = len(stub.state['file'])
+    assert len(jobs) == len(items)
+    for index in range(10):
+        job = jobs[f'item{index}']
+        assert job.status == 'downloaded'
+        assert job.bytes == size
+        assert job.filename == str(out / f'item{index}.zip')
+    assert jobs['pending1'].status == 'processing'
+    assert jobs['bad1'].status == 'failed'
+    assert jobs['bad1'].error is not None
+    assert len(list(out.iterdir())) == 10
+
+
+def test_downloads_start_before_the_search_ends(dds_api, out):
+
+    first_done = threading.Event()
+
+    def search():
+        yield 'item0'
+        # A later page only arrives once the first item is downloaded
+        assert first_done.wait(10)
+        yield 'item1'
+
+    statuses = []
+    for job in DownloadPipeline(dds_api, str(out)).run(COLLECTION, search()):
+        statuses.append(job.status)
+        first_done.set()
+
+    assert statuses == ['downloaded', 'downloaded']
+
+
+def test_search_errors_and_early_stop(dds_api, stub, out):
+
+    def search():
+        yield 'item0'
+        raise RuntimeError('search failed')
+
+    pipeline = DownloadPipeline(dds_api, str(out))
+    jobs = []
+    with pytest.raises(RuntimeError, match='search failed'):
+        for job in pipeline.run(COLLECTION, search()):
+            jobs.append(job)
+    assert [job.status for job in jobs] == ['downloaded']
+
+    # Stopping early stops the stages instead of draining the source
+    fed = []
+
+    def endless():
+        index = 0
+        while True:
+            fed.append(index)
+            yield f'item{index}'
+            index += 1
+
+    for job in pipeline.run(COLLECTION, endless()):
+        break
+    count = len(fed)
+    threading.Event().wait(0.5)
+    assert len(fed) <= count + 1
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from eodms_dds import aaa, dds
+from eodms_dds.ratelimit import RateLimiter, TokenBucket, endpoint_family
+
+
+def test_endpoint_family():
+
+    assert endpoint_family('https://host/aaa/v1/login') == 'aaa'
+    assert endpoint_family('https://host/dds/v1/item/EODMS/C/a') == 'dds'
+    assert endpoint_family('https://host/search/collections/C/items') == \
+        'search'
+    assert endpoint_family('https://host/stac/search') == 'search'
+    assert endpoint_family('https://bucket.s3.amazonaws.com/a.zip') == \
+        'download'
+
+
+def test_token_bucket_burst_and_rate():
+
+    bucket = TokenBucket(10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    # Amounts larger than the capacity go into debt
+    assert bucket.reserve(10) == pytest.approx(1.1, abs=0.01)
+
+
+def test_limiter_paces_threads(env, stub):
+
+    limiter = RateLimiter({'dds': (20, 1)})
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging', rate_limiter=limiter)
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+
+    def run(index):
+        for uuid in range(3):
+            dds_api.fetch_item('RCMImageProducts', f'{index}-{uuid}')
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 12 requests at 20 per second, after a burst of 1
+    assert time.monotonic() - start >= 0.5
+    assert stub.hits('/dds/v1/item/') == 12
+    aaa_api.close()
+
+
+def test_penalize_pauses_the_family():
+
+    limiter = RateLimiter({'dds': 100, 'search': 100})
+    url = 'https://host/dds/v1/item/EODMS/C/a'
+
+    limiter.penalize(url, 0.2)
+
+    assert limiter.acquire(url) == pytest.approx(0.21, abs=0.02)
+    assert limiter.acquire('https://host/search/collections') == 0
+    assert limiter.acquire('https://host/files/a.zip') == 0
+
+
+def test_shared_dir_is_shared_between_limiters(tmp_path):
+
+    # Two limiters on the same folder stand for two processes
+    first = RateLimiter({'dds': (10, 1)}, shared_dir=str(tmp_path))
+    second = RateLimiter({'dds': (10, 1)}, shared_dir=str(tmp_path))
+    url = 'https://host/dds/v1/item/EODMS/C/a'
+
+    assert first.acquire(url) == 0
+    assert second.acquire(url) == pytest.approx(0.1, abs=0.02)
+
+
+def test_acquire_async():
+
+    limiter = RateLimiter({'dds': (10, 1)})
+    url = 'https://host/dds/v1/item/EODMS/C/a'
+
+    async def main():
+        return await asyncio.gather(*[limiter.acquire_async(url)
+                                      for _ in range(3)])
+
+    waits = sorted(asyncio.run(main()))
+
+    assert waits[0] == 0
+    assert waits[2] == pytest.approx(0.2, abs=0.02)
@@ -0,0 +1,117 @@
+import pytest
+
+from eodms_dds import aaa, dds
+from eodms_dds.exceptions import CircuitOpenError, DDSError
+from eodms_dds.retry import RetryPolicy
+
+
+@pytest.fixture
+def dds_api(aaa_api):
+    return dds.DDS_API(aaa_api, 'staging')
+
+
+def _api(retry_policy):
+    return dds.DDS_API(aaa.AAA_API('user', 'pass', 'staging',
+                                   retry_policy=retry_policy), 'staging')
+
+
+def test_get_item_retries_busy_server(dds_api, stub):
+
+    stub.state['faults'] = {'/dds/v1/item/': [429, 503, 'drop']}
+
+    assert dds_api.get_item('RCMImageProducts', 'a')['uuid'] == 'a'
+    assert stub.hits('/dds/v1/item/') == 4
+    assert dds_api.retry_policy.retries == 3
+
+
+def test_get_item_gives_up_after_max_retries(env, stub):
+
+    stub.state['faults'] = {'/dds/v1/item/': [503] * 6}
+    dds_api = _api(RetryPolicy(max_retries=2, backoff=0,
+                               failure_threshold=0))
+
+    assert dds_api.get_item('RCMImageProducts', 'a') is None
+    assert stub.hits('/dds/v1/item/') == 3
+
+    with pytest.raises(DDSError) as err:
+        dds_api.fetch_item('RCMImageProducts', 'b')
+    assert err.value.status_code == 503
+
+
+def test_get_item_errors_return_none(dds_api, stub):
+
+    item_info = dds_api.get_item('RCMImageProducts', 'a')
+
+    # A missing item is not retried, and doesn't replace the last item
+    assert dds_api.get_item('RCMImageProducts', 'bad1') is None
+    assert stub.hits('/dds/v1/item/') == 2
+    assert dds_api.img_info == item_info
+
+    with pytest.raises(DDSError) as err:
+        dds_api.fetch_item('RCMImageProducts', 'bad1')
+    assert (err.value.status_code, err.value.error) == (404, 'NotFound')
+
+
+def test_get_item_with_html_response(dds_api, stub):
+
+    stub.state['item_body'] = {
+        'html': (200, 'text/html', '<HTML><BODY>Maintenance</BODY></HTML>')}
+
+    assert dds_api.get_item('RCMImageProducts', 'html') is None
+
+    with pytest.raises(DDSError, match='cannot be accessed'):
+        dds_api.fetch_item('RCMImageProducts', 'html')
+
+
+def test_get_item_while_processing(dds_api, stub):
+
+    item_info = dds_api.get_item('RCMImageProducts', 'pending1')
+
+    assert item_info == {'status': 'PROCESSING'}
+    assert dds_api.img_info == item_info
+
+
+def test_circuit_breaker_fails_fast(env, stub):
+
+    stub.state['faults'] = {'/dds/v1/item/': [500] * 10}
+    dds_api = _api(RetryPolicy(max_retries=0, failure_threshold=2,
+                               reset_timeout=60))
+
+    for uuid in ('a', 'b'):
+        with pytest.raises(DDSError):
+            dds_api.fetch_item('RCMImageProducts', uuid)
+
+    with pytest.raises(CircuitOpenError):
+        dds_api.fetch_item('RCMImageProducts', 'c')
+
+    assert stub.hits('/dds/v1/item/') == 2
+    # Other endpoints have their own breaker
+    assert dds_api.aaa.get_access_token()
+
+
+def test_get_item_logs_open_circuit_and_network_errors(env, stub):
+
+    stub.state['faults'] = {'/dds/v1/item/': [503] * 3 + ['drop'] * 3}
+    dds_api = _api(RetryPolicy(max_retries=2, backoff=0, failure_threshold=3,
+                               reset_timeout=60))
+
+    # The retries of the first item open the breaker, which then refuses
+    #   the next items without sending them
+    assert dds_api.get_item('RCMImageProducts', 'a') is None
+    assert dds_api.get_item('RCMImageProducts', 'b') is None
+    assert stub.hits('/dds/v1/item/') == 3
+
+    # Network errors which outlast the retries are logged too
+    dds_api = _api(RetryPolicy(max_retries=2, backoff=0, failure_threshold=0))
+    assert dds_api.get_item('RCMImageProducts', 'c') is None
+    assert stub.hits('/dds/v1/item/') == 6
+    assert dds_api.get_item('RCMImageProducts', 'd')['uuid'] == 'd'
+
+
+def test_login_is_retried(aaa_api, stub):
+
+    # Logging in again is harmless, so the POST is retried like a GET
+    stub.state['faults'] = {'/aaa/v1/login': [503, 500]}
+
+    assert aaa_api.get_access_token()
+    assert stub.hits('/aaa/v1/login') == 3
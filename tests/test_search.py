@@ -0,0 +1,219 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from eodms_dds.exceptions import SearchError
+from eodms_dds.search import SearchAPI, next_page_params, split_shard
+from stub_server import feature
+
+COLLECTION = 'RCMImageProducts'
+ITEMS = '/search/collections/RCMImageProducts/items'
+
+
+def _ids(features):
+    return [feature['id'] for feature in features]
+
+
+def _wait_for(condition, timeout=5):
+
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_next_page_params():
+
+    assert next_page_params({'links': [
+        {'rel': 'self', 'href': 'https://a/items?limit=5'},
+        {'rel': 'next', 'href': 'https://internal/items?limit=5&page_token='
+                                'abc&bbox=1,2,3,4'}]}) == \
+        {'limit': '5', 'page_token': 'abc', 'bbox': '1,2,3,4'}
+    assert next_page_params({'page_token': 'xyz'}) == {'page_token': 'xyz'}
+    assert next_page_params({'links': []}) is None
+
+
+def test_features_across_pages(aaa_api, env):
+
+    env.reset_features(50)
+    search_api = SearchAPI(aaa_api, 'staging', page_size=7)
+
+    # The next links point at an internal host, so only their query is used
+    assert _ids(search_api.features(COLLECTION)) == \
+        [feature(index)['id'] for index in range(50)]
+    assert env.hits(ITEMS) == 8
+
+    pages = list(search_api.pages(COLLECTION, page_size=20))
+    assert [len(page) for page in pages] == [20, 20, 10]
+
+
+def test_limit_and_filters(aaa_api, env):
+
+    search_api = SearchAPI(aaa_api, 'staging', page_size=10)
+
+    assert _ids(search_api.features(COLLECTION, limit=15)) == \
+        [feature(index)['id'] for index in range(15)]
+    assert env.hits(ITEMS) == 2
+
+    # A limit smaller than a page is requested as the page size
+    env.state['hits'].clear()
+    assert len(list(search_api.features(COLLECTION, limit=3))) == 3
+    assert env.hits(ITEMS) == 1
+
+    found = list(search_api.features(
+        COLLECTION, bbox=(-120, 50, -110, 60),
+        datetime='2020-01-02T00:00:00Z/2020-01-10T00:00:00Z'))
+    expected = [feature(index) for index in range(24, 217)]
+    expected = [f['id'] for f in expected
+                if f['bbox'][0] <= -110 and f['bbox'][2] >= -120 and
+                f['bbox'][1] <= 60 and f['bbox'][3] >= 50]
+    assert expected
+    assert _ids(found) == expected
+
+
+def test_prefetch(aaa_api, env):
+
+    search_api = SearchAPI(aaa_api, 'staging', page_size=10)
+
+    # The next page is requested while the caller holds the first one
+    pages = search_api.pages(COLLECTION)
+    next(pages)
+    assert _wait_for(lambda: env.hits(ITEMS) == 2)
+
+    # Closing the generator early doesn't request more pages
+    pages.close()
+    time.sleep(0.2)
+    assert env.hits(ITEMS) == 2
+
+    env.state['hits'].clear()
+    pages = search_api.pages(COLLECTION, prefetch=False)
+    next(pages)
+    time.sleep(0.2)
+    assert env.hits(ITEMS) == 1
+    pages.close()
+
+
+def test_prefetch_overlaps_the_caller(aaa_api, env):
+
+    env.reset_features(40)
+    env.state['page_delay'] = 0.1
+    search_api = SearchAPI(aaa_api, 'staging', page_size=10)
+
+    def consume(prefetch):
+        start = time.monotonic()
+        for page in search_api.pages(COLLECTION, prefetch=prefetch):
+            time.sleep(0.1)
+        return time.monotonic() - start
+
+    # 4 pages of 0.1 s each, and 0.1 s of work per page
+    assert consume(False) >= 0.8
+    assert consume(True) < 0.7
+
+
+def test_guest_search_and_errors(aaa_api, env):
+
+    guest = SearchAPI(environment='staging', page_size=100)
+
+    assert guest.get_collections()['collections'][0]['id'] == COLLECTION
+    assert guest.get_feature(COLLECTION, 'f000012') == feature(12)
+    assert len(list(guest.features(COLLECTION, limit=250))) == 250
+
+    # Transient errors are retried, others raised
+    search_api = SearchAPI(aaa_api, 'staging')
+    env.state['faults'] = {ITEMS: [503]}
+    assert len(list(search_api.features(COLLECTION, limit=5))) == 5
+
+    env.state['faults'] = {ITEMS: [400]}
+    with pytest.raises(SearchError) as err:
+        list(search_api.features(COLLECTION))
+    assert err.value.status_code == 400
+
+
+def test_split_shard():
+
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    day = timedelta(days=1)
+
+    # The interval is split first, sharing the boundaries
+    parts = split_shard((None, (start, start + 4 * day)), 4,
+                        timedelta(minutes=1), 0.01)
+    assert parts == [(None, (start + index * day,
+                             start + (index + 1) * day))
+                     for index in range(4)]
+
+    # Then the bbox, across its longest side
+    assert split_shard(((0, 0, 10, 2), (start, start)), 2,
+                       timedelta(minutes=1), 0.01) == \
+        [((0, 0, 5.0, 2), (start, start)),
+         ((5.0, 0, 10, 2), (start, start))]
+    assert split_shard(((0, 0, 1, 4), None), 2, day, 0.01) == \
+        [((0, 0, 1, 2.0), None), ((0, 2.0, 1, 4), None)]
+    # Across the antimeridian
+    assert split_shard(((170, 0, -170, 1), None), 2, day, 0.01) == \
+        [((170, 0, 180.0, 1), None), ((180.0, 0, -170.0, 1), None)]
+    # No bbox is the whole world
+    assert split_shard((None, None), 2, day, 0.01)[0][0] == \
+        (-180.0, -90.0, 0.0, 90.0)
+    assert split_shard(((0, 0, 0.01, 0.01), None), 2, day, 0.01) is None
+
+
+@pytest.mark.parametrize('datetime_range', [
+    '2020-01-01T00:00:00Z/2020-02-01T00:00:00Z', None])
+def test_sharded_features_match_the_sequential_search(aaa_api, env,
+                                                      datetime_range):
+
+    search_api = SearchAPI(aaa_api, 'staging', page_size=20)
+    bbox = (-140, 40, -80, 80)
+
+    expected = _ids(search_api.features(COLLECTION, bbox, datetime_range))
+    env.state['hits'].clear()
+    found = _ids(search_api.sharded_features(COLLECTION, bbox,
+                                             datetime_range, workers=4,
+                                             shard_size=50))
+
+    # Items on the shared boundaries of the shards are only yielded once
+    assert len(found) == len(set(found))
+    assert sorted(found) == sorted(expected)
+    assert len(expected) > 200
+    # The first page of the whole query and of each split shard
+    assert env.hits(ITEMS) > len(expected) // 20 + 1
+
+    limited = list(search_api.sharded_features(COLLECTION, bbox,
+                                               datetime_range, limit=30,
+                                               workers=4))
+    assert len(limited) == 30
+    assert set(_ids(limited)) <= set(expected)
+
+
+def test_sharded_features_run_in_parallel(aaa_api, env):
+
+    env.state['page_delay'] = 0.05
+    search_api = SearchAPI(aaa_api, 'staging', page_size=50)
+    datetime_range = '2020-01-01T00:00:00Z/2020-03-01T00:00:00Z'
+
+    start = time.monotonic()
+    expected = _ids(search_api.features(COLLECTION,
+                                        datetime=datetime_range))
+    sequential = time.monotonic() - start
+
+    start = time.monotonic()
+    found = _ids(search_api.sharded_features(COLLECTION,
+                                             datetime=datetime_range,
+                                             workers=8))
+    sharded = time.monotonic() - start
+
+    assert sorted(found) == sorted(expected)
+    assert len(expected) == 1000
+    assert sharded < sequential / 2
+
+
+def test_sharded_features_errors(aaa_api, env):
+
+    search_api = SearchAPI(aaa_api, 'staging', page_size=20)
+    env.state['faults'] = {ITEMS: [404]}
+
+    with pytest.raises(SearchError) as err:
+        list(search_api.sharded_features(COLLECTION, workers=4))
+    assert err.value.status_code == 404
@@ -0,0 +1,26 @@
+from eodms_dds import aaa, dds
+
+
+def test_aaa_and_dds_share_one_pooled_session(aaa_api, stub):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    assert dds_api.session is aaa_api.session
+
+    for index in range(10):
+        assert dds_api.get_item('RCMImageProducts', f'item{index}')
+
+    # The login and the 10 item requests reuse one connection
+    assert stub.hits('/dds/v1/item/') == 10
+    assert stub.state['connections'] == 1
+
+
+def test_keep_alive_false_opens_a_connection_per_request(env, stub):
+
+    aaa_api = aaa.AAA_API('user', 'pass', 'staging', keep_alive=False)
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+
+    for index in range(5):
+        dds_api.get_item('RCMImageProducts', f'item{index}')
+
+    assert stub.state['connections'] == 6
+    aaa_api.close()
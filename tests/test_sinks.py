@@ -0,0 +1,112 @@
+import hashlib
+import io
+import logging
+import mmap
+
+import pytest
+
+from eodms_dds import dds
+from eodms_dds.download import Downloader
+from eodms_dds.exceptions import DownloadError, IntegrityError
+from eodms_dds.sinks import BufferSink, CallableSink, FileObjectSink, \
+    make_sink
+
+
+def test_make_sink():
+
+    with mmap.mmap(-1, 16) as mm:
+        sink = make_sink(mm)
+        assert isinstance(sink, BufferSink)
+        sink.close()
+
+    assert isinstance(make_sink(bytearray(16)), BufferSink)
+    assert isinstance(make_sink(io.BytesIO()), FileObjectSink)
+    assert isinstance(make_sink(print), CallableSink)
+
+    with pytest.raises(TypeError):
+        make_sink('a.zip')
+    with pytest.raises(TypeError):
+        make_sink(b'read-only')
+
+
+@pytest.fixture
+def dds_api(aaa_api):
+
+    dds_api = dds.DDS_API(aaa_api, 'staging')
+    dds_api.get_item('RCMImageProducts', 'a')
+
+    return dds_api
+
+
+def test_stream_item_into_mmap_with_segments(dds_api, stub):
+
+    data = stub.state['file']
+
+    with mmap.mmap(-1, len(data)) as mm:
+        assert dds_api.stream_item(mm, segments=4) == len(data)
+        assert mm[:] == data
+
+    # The probe and one request per segment
+    assert stub.hits('/files/') == 5
+
+
+def test_stream_item_into_file_object_and_callable(dds_api, stub):
+
+    data = stub.state['file']
+
+    f = io.BytesIO()
+    assert dds_api.stream_item(f, segments=4) == len(data)
+    assert f.getvalue() == data
+
+    chunks = []
+    assert dds_api.stream_item(lambda chunk: chunks.append(bytes(chunk))) \
+        == len(data)
+    assert b''.join(chunks) == data
+
+
+def test_stream_item_into_too_small_buffer(dds_api, stub):
+
+    with pytest.raises(DownloadError, match='too small'):
+        dds_api.stream_item(bytearray(1024))
+
+
+def test_stream_item_with_segments_verifies_checksums(dds_api, stub):
+
+    data = stub.state['file']
+    item_info = dict(dds_api.img_info, md5=hashlib.md5(data).hexdigest())
+
+    # The range probe and one segment of the first attempt are corrupted
+    stub.state['corrupt'] = 2
+    buffer = bytearray(len(data))
+    assert dds_api.stream_item(buffer, item_info, segments=4) == len(data)
+    assert buffer == data
+    # Both attempts probe the file and fetch 4 segments
+    assert stub.hits('/files/') == 10
+
+    stub.state['corrupt'] = 2
+    loader = Downloader(dds_api.session, segments=4, progress=False,
+                        checksums={'md5': item_info['md5']},
+                        verify_retries=0)
+    with pytest.raises(IntegrityError):
+        loader.stream(item_info['download_url'], bytearray(len(data)))
+
+
+def test_stream_into_write_only_file_with_segments(dds_api, stub, tmp_path,
+                                                   caplog):
+
+    data = stub.state['file']
+    md5 = hashlib.md5(data).hexdigest()
+    loader = Downloader(dds_api.session, segments=4, progress=False,
+                        checksums={'md5': md5})
+
+    # The segments can't be read back, so only their size is verified
+    with open(tmp_path / 'a.zip', 'wb') as f, \
+            caplog.at_level(logging.WARNING):
+        assert loader.stream(dds_api.img_info['download_url'], f) == \
+            len(data)
+    assert "can't be verified" in caplog.text
+    assert (tmp_path / 'a.zip').read_bytes() == data
+
+    with open(tmp_path / 'b.zip', 'w+b') as f:
+        loader.stream(dds_api.img_info['download_url'], f)
+    assert loader.digests == {'md5': md5}
@@ -0,0 +1,143 @@
+import math
+import random
+
+import pytest
+
+from eodms_dds.features import FeatureSet
+from eodms_dds.spatial import SpatialIndex
+from stub_server import feature
+
+
+def _brute_force(bboxes, query):
+
+    west, south, east, north = query
+    found = []
+    for position, (w, s, e, n) in enumerate(bboxes):
+        if w <= east and e >= west and s <= north and n >= south:
+            found.append(position)
+
+    return found
+
+
+def _random_bboxes(count, seed=0):
+
+    rand = random.Random(seed)
+    bboxes = []
+    for _ in range(count):
+        x = rand.uniform(-180, 175)
+        y = rand.uniform(-90, 85)
+        bboxes.append((x, y, x + rand.uniform(0, 5), y + rand.uniform(0, 5)))
+
+    return bboxes
+
+
+@pytest.mark.parametrize('node_capacity', [2, 4, 16])
+def test_intersects_matches_brute_force(node_capacity):
+
+    bboxes = _random_bboxes(2000)
+    index = SpatialIndex(bboxes, node_capacity=node_capacity)
+
+    rand = random.Random(1)
+    for _ in range(200):
+        x = rand.uniform(-180, 170)
+        y = rand.uniform(-90, 80)
+        query = (x, y, x + rand.uniform(0, 10), y + rand.uniform(0, 10))
+        assert index.intersects(query) == _brute_force(bboxes, query)
+
+    assert len(index) == 2000
+
+
+def test_from_features_with_a_feature_set():
+
+    features = [feature(index) for index in range(500)]
+    index = SpatialIndex.from_features(FeatureSet(features))
+    query = (-120, 50, -110, 60)
+
+    expected = [features[position]['id'] for position in
+                _brute_force([f['bbox'] for f in features], query)]
+
+    assert index.intersects(query) == expected
+    assert expected
+    # GeoJSON dictionaries give the same index
+    assert SpatialIndex.from_features(features).intersects(query) == expected
+    assert index.bbox == (-140.0, 42.0, -60.0, 82.0)
+
+
+def test_antimeridian():
+
+    index = SpatialIndex([(170, 0, -170, 10), (0, 0, 1, 1),
+                          (-179, 20, -178, 21)], ['crossing', 'zero', 'east'])
+
+    # A box crossing the antimeridian is found from either side, once
+    assert index.intersects((175, 5, 176, 6)) == ['crossing']
+    assert index.intersects((-175, 5, -174, 6)) == ['crossing']
+    assert index.intersects((-10, -10, 10, 10)) == ['zero']
+
+    # And so is a query crossing it
+    assert index.intersects((179, 0, -177, 30)) == ['crossing', 'east']
+    assert index.nearest(179, 5, k=3)[0] == ('crossing', 0)
+    assert len(index.nearest(179, 5, k=3)) == 3
+
+
+def test_nearest():
+
+    bboxes = _random_bboxes(1000, seed=2)
+    index = SpatialIndex(bboxes, node_capacity=8)
+
+    def distance(bbox, x, y):
+        dx = max(bbox[0] - x, 0, x - bbox[2])
+        dy = max(bbox[1] - y, 0, y - bbox[3])
+        return math.hypot(dx, dy)
+
+    rand = random.Random(3)
+    for _ in range(50):
+        x, y = rand.uniform(-180, 180), rand.uniform(-90, 90)
+        found = index.nearest(x, y, k=5)
+        expected = sorted(distance(bbox, x, y) for bbox in bboxes)[:5]
+        assert [d for _, d in found] == pytest.approx(expected)
+        assert all(distance(bboxes[position], x, y) == pytest.approx(d)
+                   for position, d in found)
+
+    found = index.nearest(0, 0, k=1000, max_distance=10)
+    assert found and all(d <= 10 for _, d in found)
+    assert len(found) == sum(distance(bbox, 0, 0) <= 10 for bbox in bboxes)
+
+
+def test_save_and_load(tmp_path):
+
+    features = [feature(index) for index in range(300)]
+    index = SpatialIndex.from_features(features, node_capacity=4)
+    fn = str(tmp_path / 'index.rt')
+    index.save(fn)
+
+    loaded = SpatialIndex.load(fn)
+
+    assert loaded.ids == index.ids
+    assert loaded.bbox == index.bbox
+    for query in [(-140, 42, -130, 50), (-100, 60, -90, 70), (0, 0, 1, 1)]:
+        assert loaded.intersects(query) == index.intersects(query)
+    assert loaded.nearest(-100, 60, k=3) == index.nearest(-100, 60, k=3)
+    assert [path.name for path in tmp_path.iterdir()] == ['index.rt']
+
+    (tmp_path / 'other').write_bytes(b'not an index')
+    with pytest.raises(ValueError):
+        SpatialIndex.load(str(tmp_path / 'other'))
+
+
+def test_empty_and_unknown_bboxes(tmp_path):
+
+    index = SpatialIndex([])
+    assert len(index) == 0
+    assert index.bbox is None
+    assert index.intersects((-180, -90, 180, 90)) == []
+    assert index.nearest(0, 0) == []
+
+    fn = str(tmp_path / 'empty.rt')
+    index.save(fn)
+    assert SpatialIndex.load(fn).intersects((-180, -90, 180, 90)) == []
+
+    # Features without a bbox or geometry are left out of the index
+    index = SpatialIndex.from_features([{'id': 'none', 'properties': {}},
+                                        feature(0)])
+    assert len(index) == 2
+    assert index.intersects((-180, -90, 180, 90)) == ['f000000']
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+
+from eodms_dds import dds
+from eodms_dds.store import ProductStore, preferred_checksum
+
+
+def test_add_and_find(tmp_path):
+
+    store = ProductStore(str(tmp_path / 'store'))
+    fn = tmp_path / 'a.zip'
+    fn.write_bytes(b'x' * 100)
+
+    path = store.add(str(fn), 'uuid-a', etag='"e1"')
+
+    assert os.path.samefile(path, fn)
+    assert store.find('a.zip', size=100, etag='"e1"') == path
+    assert store.find('a.zip', 'uuid-a') == path
+    assert store.find('a.zip', size=100, etag='"e2"') is None
+    assert store.find('a.zip', size=99) is None
+    assert store.find('b.zip', 'uuid-a') is None
+
+    # A truncated copy is not reused
+    with open(path, 'r+b') as f:
+        f.truncate(50)
+    assert store.find('a.zip', size=100, etag='"e1"') is None
+
+
+def test_products_are_indexed_by_checksum(tmp_path):
+
+    store = ProductStore(str(tmp_path / 'store'))
+    fn = tmp_path / 'a.zip'
+    fn.write_bytes(b'x' * 100)
+    sha256 = 'sha256:' + hashlib.sha256(b'x' * 100).hexdigest()
+
+    path = store.add(str(fn), 'uuid-a', etag='"e1"', checksum=sha256.upper())
+
+    # Found by its checksum whatever its ETag, and by its size and ETag
+    assert store.find('a.zip', checksum=sha256) == path
+    assert store.find('a.zip', size=100, etag='"e2"', checksum=sha256) == \
+        path
+    assert store.find('a.zip', size=100, etag='"e1"') == path
+    assert store.find('a.zip', 'uuid-a') == path
+
+    # The checksum must match, even when the size and ETag do
+    wrong = 'sha256:' + '0' * 64
+    assert store.find('a.zip', 'uuid-a', 100, '"e1"', wrong) is None
+    assert store.find('a.zip', size=99, checksum=sha256) is None
+    assert store.find('b.zip', checksum=sha256) is None
+
+    with open(os.path.join(os.path.dirname(path), 'meta.json')) as f:
+        assert json.load(f)['checksum'] == sha256
+
+
+def test_checksum_of_product_stored_without_one(tmp_path, monkeypatch):
+
+    store = ProductStore(str(tmp_path / 'store'))
+    fn = tmp_path / 'a.zip'
+    fn.write_bytes(b'y' * 100)
+    path = store.add(str(fn), etag='"e1"')
+    md5 = 'md5:' + hashlib.md5(b'y' * 100).hexdigest()
+
+    assert store.find('a.zip', size=100, etag='"e1"',
+                      checksum='md5:' + '0' * 32) is None
+    assert store.find('a.zip', size=100, etag='"e1"', checksum=md5) == path
+
+    # The checksum is recorded, so the product is not hashed again
+    monkeypatch.setattr(hashlib, 'new', None)
+    assert store.find('a.zip', size=100, etag='"e1"', checksum=md5) == path
+    assert store.find('a.zip', size=100, etag='"e1"',
+                      checksum='md5:' + '0' * 32) is None
+
+
+def test_preferred_checksum():
+
+    assert preferred_checksum({'md5': 'AB', 'sha256': 'CD'}) == 'sha256:cd'
+    assert preferred_checksum({'md5': 'ab'}) == 'md5:ab'
+    assert preferred_checksum({}) is None
+
+
+def test_download_item_reuses_stored_products(aaa_api, stub, tmp_path):
+
+    store = ProductStore(str(tmp_path / 'store'))
+    dds_api = dds.DDS_API(aaa_api, 'staging', product_store=store)
+    dds_api.get_item('RCMImageProducts', 'a')
+
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+
+    dds_api.download_item(str(first), progress=False)
+    # The probe and the download
+    assert stub.hits('/files/') == 2
+
+    dest_fn = dds_api.download_item(str(second), progress=False)
+
+    # Only the probe
+    assert stub.hits('/files/') == 3
+    assert os.path.samefile(dest_fn, first / 'a.zip')
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == stub.state['file']
+
+
+def test_download_item_checks_stored_checksums(aaa_api, stub, tmp_path):
+
+    store = ProductStore(str(tmp_path / 'store'))
+    dds_api = dds.DDS_API(aaa_api, 'staging', product_store=store)
+    item_info = dict(dds_api.get_item('RCMImageProducts', 'a'),
+                     md5=hashlib.md5(stub.state['file']).hexdigest())
+
+    for name in ('first', 'second', 'third'):
+        (tmp_path / name).mkdir()
+
+    dds_api.download_item(str(tmp_path / 'first'), item_info=item_info,
+                          item_uuid='a', progress=False)
+    dds_api.download_item(str(tmp_path / 'second'), item_info=item_info,
+                          item_uuid='a', progress=False)
+    # The probes and a single download
+    assert stub.hits('/files/') == 3
+
+    # A stored copy whose checksum doesn't match is downloaded again
+    meta_fn = os.path.join(os.path.dirname(store.find('a.zip', 'a')),
+                           'meta.json')
+    with open(meta_fn) as f:
+        meta = json.load(f)
+    with open(meta_fn, 'w') as f:
+        json.dump(dict(meta, checksum='md5:' + '0' * 32), f)
+
+    dest_fn = dds_api.download_item(str(tmp_path / 'third'),
+                                    item_info=item_info, item_uuid='a',
+                                    progress=False)
+    assert stub.hits('/files/') == 5
+    with open(dest_fn, 'rb') as f:
+        assert f.read() == stub.state['file']